@@ -590,7 +590,8 @@ def process_map(file_in, validate):
 
 if __name__ == '__main__':
     # Note: Validation is ~ 10X slower. For the project consider using a small
-    # sample of the map when validating.
+    # sample of the map when validating (osm_wrangling/osm_sample.py writes one that keeps way -> node
+    # references intact).
     process_map(OSM_PATH, validate=True)
 
 
@@ -620,6 +621,18 @@ import pprint
 filename = open("phoenix_arizona.osm", "r")
 
 
+# In[ ]:
+
+# every audit below in one pass, cached until the file or the audit code changes
+# (StageCache(force=True) reruns it; see osm_wrangling/stage_cache.py)
+
+from osm_wrangling.audit import print_audit
+from osm_wrangling.stage_cache import StageCache, cached_audit, cached_shape
+
+cache = StageCache()
+print_audit(cached_audit(cache, "phoenix_arizona.osm"))
+
+
 # In[ ]:
 
 # count the number of unique element types
@@ -730,39 +743,14 @@ beginning of the street names (mapping2)
 
 filename = open("phoenix_arizona.osm", "r")
 
-mapping = {
-            "Boulavard": "Boulevard",
-            "D": "Drive",
-            "street": "Street",
-            "Rd": "Road",
-            "Rd.": "Road",
-            "RD": "Road",
-            "Pkwy": "Parkway",
-            "Ave": "Avenue",
-            "Ave.": "Avenue",
-            "Glen": "Glendale",
-            "Blvd": "Boulevard",
-            "Blvd.": "Boulevard",
-            "street": "Street",
-            "St": "Street",
-            "Glen": "Glendale",
-            "Dr": "Drive",
-            "Dr.": "Drive",
-            "Ctr": "Centre",
-            
-            }
+# The mapping dictionaries live in osm_wrangling/cleaning.py, so that the same rules are used for the audit
+# below, for cleaning inside SQLite (sqlite_cleaning.py) and while shaping.
+from osm_wrangling.cleaning import mapping
 
 
 # In[ ]:
 
-mapping2 =  {"E"  : "East",
-             "E." : "East",
-             "N"  : "North",
-             "N." : "North",
-             "S"  : "South",
-             "S." : "South",
-             "W"  : "West",
-             "W." : "West"}
+from osm_wrangling.cleaning import mapping2
 
 
 # In[ ]:
@@ -792,31 +780,16 @@ street_type_pre = re.compile(r'^[NSEW]\b\.?', re.IGNORECASE)
 # In[ ]:
 
 '''
-We also identified some unique cases that will not be changed by the update name function. We explicitly state the 
-change we want individually for each case.
+We also identified some unique cases that will not be changed by the update name function (suite numbers, building
+names, '#' unit numbers). clean_street in cleaning.py strips those parts before applying both mappings.
 '''
 
 
+from osm_wrangling.cleaning import clean_street
+
 for street_type, ways in street_types.iteritems(): 
         for name in ways:
-            if "Suite"  in name:
-                name = name.split(", Suite")[0].strip()
-            if "#" in name:
-                name = name.split(" #")[0].strip()
-            if "," in name:
-                name = name.split(", ")[0].strip()
-            if "Suite" in name:
-                name = name.split(" Suite")[0].strip()
-            if "Building" in name:
-                name = name.split(" Building")[0].strip()
-            if "Ste" in name:
-                name = name.split(" Ste")[0].strip()
-            if "St" in name:
-                name = name.split(" St")[0].strip()
-            name_improv_first = update_name(name, mapping, street_type_re)
-            name_improv_sec = update_name(name_improv_first, mapping2, street_type_pre)
-            
-            print name, "=>", name_improv_first, "=>", name_improv_sec
+            print name, "=>", clean_street(name)
 
 
 # ### Problem with the Data - Postal Codes
@@ -870,13 +843,11 @@ We want to have all postal codes in the standard 5 digit display. This means we
 than 5 digits, the ones that beginn with "AZ" and any other ones that differ from the the plain 5 digit display.
 '''
 
+from osm_wrangling.cleaning import clean_zip
+
 for zip_type, ways in zip_types.iteritems(): 
         for name in ways:
-            if "-" in name:
-                name = name.split("-")[0].strip()
-            if "AZ" in name:
-                name = name.split("AZ")[1].strip('AZ ')
-            print name
+            print name, "=>", clean_zip(name)
 
 
 # ### Problem with the Data - Phone Numbers
@@ -927,45 +898,16 @@ audit(filename, phone_type_re)
 
 '''
 The goal is to have all phone numbers in a similar way: "XXX XXX XXXX". The phone numbers as we found out during the audit are
-quite messy. We are using an approach were we explicitly state the required change for each set of cases.
+quite messy. clean_phone in cleaning.py keeps the first of several numbers, drops the +1 / 1 / 01 country prefix and
+all punctuation and reformats the remaining 10 digits.
 
 '''
 
+from osm_wrangling.cleaning import clean_phone
+
 for phone_type, ways in phone_types.iteritems():
     for name in ways:
-        if "+1 " in name:
-            name = name.split("+1 ")[1].strip('+1 ')
-        if "+" in name:
-            name = name.split("+")[1].strip('+')
-        if ";" in name:
-            name = name.split(";")[0].strip()
-        if name.startswith ("1-"): 
-            name = name.strip("1-")
-        if name.startswith ("1 "):
-            name = name.strip("1 ")
-        if "-" in name:
-            name = name.replace("-", " ")
-        if "(" in name:
-            name = name.replace("(", "")
-        if ")" in name:
-            name = name.replace(")", "")
-        if "." in name:
-            name = name.replace(".", " ")
-        if name.startswith("01"):
-            name = name.strip("01")
-        if name.startswith("Phone number "):
-            name = name.strip("Phone number")
-        if name.startswith("1 "):
-            name = name.strip("1 ")
-        if len(name) < 12:
-            only_numbers = re.sub(r'\D', "", name)
-            name = only_numbers[0:3] + " " + only_numbers[3:6] + " " + only_numbers[6:]
-        if name.startswith(" "):
-            name = name.replace(" ", "")
-        if "x1" in name:
-            name = name.strip("x1")
-    
-        print name
+        print name, "=>", clean_phone(name)
 
 
 # ### Problematic Tags
@@ -1011,33 +953,24 @@ process_map(filename)
 
 # import xml data into a csv file for later integration into sql database
 
-# first load necessary packages
+# first load necessary packages; the shaping code and SCHEMA live in the osm_wrangling
+# package (shape.py, schema.py) and cerberus is only imported when validating
 
-import csv
-import codecs
-import cerberus
-import schema
+from osm_wrangling.schema import SCHEMA
+from osm_wrangling.shape import (
+    NODES_PATH, NODE_TAGS_PATH, WAYS_PATH, WAY_NODES_PATH, WAY_TAGS_PATH,
+    LOWER_COLON, PROBLEMCHARS,
+    NODE_FIELDS, NODE_TAGS_FIELDS, WAY_FIELDS, WAY_TAGS_FIELDS, WAY_NODES_FIELDS,
+    shape_element, get_element, validate_element, UnicodeDictWriter, process_map)
 
 
 # In[ ]:
 
-# create the csv files to which specific data should be drawn
+# the csv files (NODES_PATH etc.) are written next to the notebook
 
 
 OSM_PATH = "phoenix_arizona.osm"
 
-NODES_PATH = "nodes.csv"
-NODE_TAGS_PATH = "nodes_tags.csv"
-WAYS_PATH = "ways.csv"
-WAY_NODES_PATH = "ways_nodes.csv"
-WAY_TAGS_PATH = "ways_tags.csv"
-
-
-# In[ ]:
-
-LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
-PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
-
 
 # In[ ]:
 
@@ -1083,222 +1016,8 @@ process_map(OSM_PATH, validate=True)
 
 # In[ ]:
 
-# Note: The schema is stored in a .py file in order to take advantage of the
-# int() and float() type coercion functions. Otherwise it could easily stored as
-# as JSON or another serialized format.
-
-SCHEMA = {
-    'node': {
-        'type': 'dict',
-        'schema': {
-            'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'lat': {'required': True, 'type': 'float', 'coerce': float},
-            'lon': {'required': True, 'type': 'float', 'coerce': float},
-            'user': {'required': True, 'type': 'string'},
-            'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
-            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
-        }
-    },
-    'node_tags': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'key': {'required': True, 'type': 'string'},
-                'value': {'required': True, 'type': 'string'},
-                'type': {'required': True, 'type': 'string'}
-            }
-        }
-    },
-    'way': {
-        'type': 'dict',
-        'schema': {
-            'id': {'required': True, 'type': 'integer', 'coerce': int},
-            'user': {'required': True, 'type': 'string'},
-            'uid': {'required': True, 'type': 'integer', 'coerce': int},
-            'version': {'required': True, 'type': 'string'},
-            'changeset': {'required': True, 'type': 'integer', 'coerce': int},
-            'timestamp': {'required': True, 'type': 'string'}
-        }
-    },
-    'way_nodes': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'node_id': {'required': True, 'type': 'integer', 'coerce': int},
-                'position': {'required': True, 'type': 'integer', 'coerce': int}
-            }
-        }
-    },
-    'way_tags': {
-        'type': 'list',
-        'schema': {
-            'type': 'dict',
-            'schema': {
-                'id': {'required': True, 'type': 'integer', 'coerce': int},
-                'key': {'required': True, 'type': 'string'},
-                'value': {'required': True, 'type': 'string'},
-                'type': {'required': True, 'type': 'string'}
-            }
-        }
-    }
-}
-
-
-# In[ ]:
-
-NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
-NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
-WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
-WAY_NODES_FIELDS = ['id', 'node_id', 'position']
-
-
-def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
-                  problem_chars=PROBLEMCHARS, default_tag_type='regular'):
-    """Clean and shape node or way XML element to Python dict"""
-
-    node_attribs = {}
-    way_attribs = {}
-    way_nodes = []
-    tags = []  # Handle secondary tags the same way for both node and way elements
-    poscounter = 0 #for way nodes position
-    
-    if element.tag == 'node':
-        for field in NODE_FIELDS:
-            node_attribs[field] = element.attrib[field]
-        for tag in element.iter('tag'):
-            tag_dict = {}
-            tag_dict['id'] = element.attrib['id'] #id (NODE_TAGS_FIELDS)
-            
-            #key and type (NODE_TAGS_FIELDS)
-            if PROBLEMCHARS.match(tag.attrib["k"]):
-                pass
-            elif ':' in tag.attrib['k']:
-                tag_dict['type'] = tag.attrib['k'].split(':')[0]
-                tag_dict['key'] = tag.attrib["k"].split(':',1)[1]
-            else:
-                tag_dict['type'] = 'regular'
-                tag_dict['key'] = tag.attrib['k']
-                
-            #value (NODE_TAGS_FIELDS)
-            tag_dict['value'] = tag.attrib['v']
-            
-            tags.append(tag_dict)
-        return {'node': node_attribs, 'node_tags': tags}
-        
-    elif element.tag == 'way':
-        for field in WAY_FIELDS:
-            way_attribs[field] = element.attrib[field]
-        for nd in element.iter('nd'):
-            nd_dict = {}
-            nd_dict['id'] = element.attrib['id']
-            nd_dict['node_id'] = nd.attrib['ref']
-            nd_dict['position'] = poscounter
-            poscounter += 1
-            way_nodes.append(nd_dict)
-        for tag in element.iter('tag'):
-            tag_dict = {}
-            tag_dict['id'] = element.attrib['id'] #id
-            #key and type
-            if PROBLEMCHARS.match(tag.attrib["k"]):
-                pass
-            elif ':' in tag.attrib['k']:
-                tag_dict['type'] = tag.attrib['k'].split(':')[0]
-                tag_dict['key'] = tag.attrib["k"].split(':',1)[1]
-            else:
-                tag_dict['type'] = 'regular'
-                tag_dict['key'] = tag.attrib['k']
-            #value
-            tag_dict['value'] = tag.attrib['v']
-            
-            tags.append(tag_dict)    
-        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
-    
-# HELPER FUNCTIONS    
-    
-def get_element(osm_file, tags=('node', 'way', 'relation')):
-    """Yield element if it is the right type of tag"""
-
-    context = ET.iterparse(osm_file, events=('start', 'end'))
-    _, root = next(context)
-    for event, elem in context:
-        if event == 'end' and elem.tag in tags:
-            yield elem
-            root.clear()
-
-
-def validate_element(element, validator, schema=SCHEMA):
-    """Raise ValidationError if element does not match schema"""
-    if validator.validate(element, schema) is not True:
-        field, errors = next(validator.errors.iteritems())
-        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
-        error_strings = (
-            "{0}: {1}".format(k, v if isinstance(v, str) else ", ".join(v))
-            for k, v in errors.iteritems()
-        )
-        raise cerberus.ValidationError(
-            message_string.format(field, "\n".join(error_strings))
-        )
-
-
-class UnicodeDictWriter(csv.DictWriter, object):
-    """Extend csv.DictWriter to handle Unicode input"""
-
-    def writerow(self, row):
-        super(UnicodeDictWriter, self).writerow({
-            k: (v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in row.iteritems()
-        })
-
-    def writerows(self, rows):
-        for row in rows:
-            self.writerow(row)
-
-
-# MAIN FUNCTION
-
-def process_map(file_in, validate):
-    """Iteratively process each XML element and write to csv(s)"""
-
-    with codecs.open(NODES_PATH, 'w') as nodes_file,          codecs.open(NODE_TAGS_PATH, 'w') as nodes_tags_file,          codecs.open(WAYS_PATH, 'w') as ways_file,          codecs.open(WAY_NODES_PATH, 'w') as way_nodes_file,          codecs.open(WAY_TAGS_PATH, 'w') as way_tags_file:
-
-        nodes_writer = UnicodeDictWriter(nodes_file, NODE_FIELDS)
-        node_tags_writer = UnicodeDictWriter(nodes_tags_file, NODE_TAGS_FIELDS)
-        ways_writer = UnicodeDictWriter(ways_file, WAY_FIELDS)
-        way_nodes_writer = UnicodeDictWriter(way_nodes_file, WAY_NODES_FIELDS)
-        way_tags_writer = UnicodeDictWriter(way_tags_file, WAY_TAGS_FIELDS)
-
-        nodes_writer.writeheader()
-        node_tags_writer.writeheader()
-        ways_writer.writeheader()
-        way_nodes_writer.writeheader()
-        way_tags_writer.writeheader()
-
-        validator = cerberus.Validator()
-
-        for element in get_element(file_in, tags=('node', 'way')):
-            el = shape_element(element)
-            if el:
-                if validate is True:
-                    validate_element(el, validator)
-
-                if element.tag == 'node':
-                    nodes_writer.writerow(el['node'])
-                    node_tags_writer.writerows(el['node_tags'])
-                elif element.tag == 'way':
-                    ways_writer.writerow(el['way'])
-                    way_nodes_writer.writerows(el['way_nodes'])
-                    way_tags_writer.writerows(el['way_tags'])
-
-
-# In[ ]:
-
-process_map(OSM_PATH, validate=False)
+# skipped while phoenix_arizona.osm and the shaping code are unchanged
+cached_shape(cache, OSM_PATH)
 
 # ALL DONE. NOW LETS LOAD THE CSV FILES INTO SQL AND START PERFORMING QUERIES
 
@@ -1310,87 +1029,21 @@ process_map(OSM_PATH, validate=False)
 ### import sqlite3
 
 import sqlite3
-import csv
 from pprint import pprint
 
+from osm_wrangling.stage_cache import StageCache, cached_load
+
 sqlite_file = 'OpenStreetMap2.db'    # name of the sqlite database file
 
-# Connect to the database
-conn = sqlite3.connect(sqlite_file)
+# (Re)create the tables from the csv files; the tag rows also fill the tag_search
+# full-text index and the addresses table, and the edit-history and address
+# indexes are built after the insert (see osm_wrangling/load.py). Skipped while
+# the database already holds a load of the same csv files.
+print(cached_load(StageCache(), sqlite_file))
 
-# Get a cursor object
+conn = sqlite3.connect(sqlite_file)
 cur = conn.cursor()
 
-def unicode_csv_reader(unicode_csv_data, dialect=csv.excel, **kwargs):
-    # csv.py doesn't do Unicode; encode temporarily as UTF-8:
-    csv_reader = csv.reader(utf_8_encoder(unicode_csv_data),
-                            dialect=dialect, **kwargs)
-    for row in csv_reader:
-        # decode UTF-8 back to Unicode, cell by cell:
-        yield [unicode(cell, 'utf-8') for cell in row]
-
-def utf_8_encoder(unicode_csv_data):
-    for line in unicode_csv_data:
-        yield line.encode('utf-8')
-        
-def UnicodeDictReader(utf8_data, **kwargs):
-    csv_reader = csv.DictReader(utf8_data, **kwargs)
-    for row in csv_reader:
-        yield {key: unicode(value, 'utf-8') for key, value in row.iteritems()}
-
-# Create the table, specifying the column names and data types:
-cur.execute('''
-    CREATE TABLE nodes_tags(id INTEGER, key TEXT, value TEXT,type TEXT)
-''')
-cur.execute('''
-    CREATE TABLE nodes(id INTEGER, lat REAL, lon REAL, user TEXT, uid INTEGER, 
-    version INTEGER, changeset INTEGER, timestamp TIMESTAMP)
-''')
-cur.execute('''
-    CREATE TABLE ways(id INTEGER, user TEXT, uid INTEGER, changeset INTEGER, timestamp TIMESTAMP)
-''')
-cur.execute('''
-    CREATE TABLE ways_tags(id INTEGER, key TEXT, value TEXT, type TEXT) 
-''')
-cur.execute('''
-    CREATE TABLE ways_nodes(id INTEGER, node_id INTEGER, position INTEGER)
-''')
-
-# commit the changes
-conn.commit()
-
-# Read in the csv file as a dictionary, format the
-# data as a list of tuples:
-with open('nodes_tags.csv','rb') as fin:
-    dr = UnicodeDictReader(fin) # comma is default delimiter
-    to_db = [(i['id'], i['key'],i['value'], i['type']) for i in dr]
-
-with open('nodes.csv', 'rb') as fin2:
-    dr2 = UnicodeDictReader(fin2)
-    to_db2 = [(i['id'], i['lat'], i['lon'], i['user'], i['uid'], i['version'], i['changeset'], i['timestamp']) for i in dr2]
-    
-with open('ways.csv', 'rb') as fin3:
-    dr3 = UnicodeDictReader(fin3)
-    to_db3 = [(i['id'], i['user'], i['uid'], i['changeset'], i['timestamp']) for i in dr3]
-    
-with open('ways_tags.csv', 'rb') as fin4:
-    dr4 = UnicodeDictReader(fin4)
-    to_db4 = [(i['id'], i['key'], i['value'], i['type']) for i in dr4]  
-    
-with open('ways_nodes.csv', 'rb') as fin5:
-    dr5 = UnicodeDictReader(fin5)
-    to_db5 = [(i['id'], i['node_id'], i['position']) for i in dr5]  
-    
-    # insert the formatted data
-cur.executemany("INSERT INTO nodes_tags(id, key, value,type) VALUES (?, ?, ?, ?);", to_db)
-cur.executemany("INSERT INTO nodes(id, lat, lon, user, uid, version, changeset, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", to_db2)
-cur.executemany("INSERT INTO ways(id, user, uid, changeset, timestamp) VALUES (?, ?, ?, ?, ?);", to_db3)
-cur.executemany("INSERT INTO ways_tags(id, key, value, type) VALUES (?, ?, ?, ?);", to_db4)
-cur.executemany("INSERT INTO ways_nodes(id, node_id, position) VALUES (?, ?, ?);", to_db5)
-
-# commit the changes
-conn.commit()
-
 cur.execute('SELECT * FROM nodes_tags')
 all_rows = cur.fetchall()
 print('1):')
@@ -1416,188 +1069,105 @@ conn.close()
 
 # In[ ]:
 
-# Counting number of nodes
+# The queries live in reports.py (REPORTS); the runner keeps a small pool of
+# read-only connections open and caches results until the database changes
 
-conn = sqlite3.connect(sqlite_file)
+from osm_wrangling.report_runner import ReportRunner
 
-cur = conn.cursor()
+runner = ReportRunner(sqlite_file)
 
-cur.execute('''
-    SELECT COUNT(*) FROM nodes;
-''')
-all_rows = cur.fetchall()
 
-print('Number of nodes are:{}').format(all_rows)
+# In[ ]:
 
-conn.commit()
+# Counting number of nodes
 
+all_rows = runner.run('nodes')
 
-# In[ ]:
+print('Number of nodes are:{}').format(all_rows)
 
-# Counting number of nodes
 
-conn = sqlite3.connect(sqlite_file)
+# In[ ]:
 
-cur = conn.cursor()
+# Counting number of ways
 
-cur.execute('''
-    SELECT COUNT(*) FROM ways;
-''')
-all_rows = cur.fetchall()
+all_rows = runner.run('ways')
 
 print('Number of ways are:{}').format(all_rows)
 
-conn.commit()
-
 
 # In[ ]:
 
 # Counting number of unique users
 
-conn = sqlite3.connect(sqlite_file)
-
-cur = conn.cursor()
-
-cur.execute('''
-SELECT COUNT(DISTINCT(e.uid))          
-FROM (SELECT uid FROM nodes UNION ALL SELECT uid FROM ways) e;
-''')
-
-all_rows = cur.fetchall()
+all_rows = runner.run('unique_users')
 
 print('Number of unique users are:{}').format(all_rows)
 
-conn.commit()
-
 
 # In[ ]:
 
 # TOP 10 contributing users
 
-conn = sqlite3.connect(sqlite_file)
-
-cur = conn.cursor()
-
-cur.execute('''
-SELECT e.user, COUNT(*) as num
-FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) e
-GROUP BY e.user
-ORDER BY num DESC
-LIMIT 10;
-''')
-
-all_rows = cur.fetchall()
+all_rows = runner.run('top_users')
 
 print('Number of unique users are:')
 pprint(all_rows)
 
-conn.commit()
-
 
 # In[ ]:
 
-conn = sqlite3.connect(sqlite_file)
-
-cur = conn.cursor()
-
-cur.execute('''
-SELECT COUNT(*) 
-FROM
-    (SELECT e.user, COUNT(*) as num
-     FROM (SELECT user FROM nodes UNION ALL SELECT user FROM ways) e
-     GROUP BY e.user
-     HAVING num=1)  u;
-''')
-
-all_rows = cur.fetchall()
+all_rows = runner.run('single_edit_users')
 
 print('Number of unique users only appearing once are:')
 pprint(all_rows)
 
-conn.commit()
-
 
 # In[ ]:
 
 # Sorts Parts of the metropolitan area of Phoenix
 
-conn = sqlite3.connect(sqlite_file)
-
-cur = conn.cursor()
-
-cur.execute('''
-SELECT tags.value, COUNT(*) as count 
-FROM (SELECT * FROM nodes_tags UNION ALL 
-      SELECT * FROM ways_tags) tags
-WHERE tags.key LIKE '%city'
-GROUP BY tags.value
-ORDER BY count DESC;
-
-''')
-
-all_rows = cur.fetchall()
+all_rows = runner.run('cities')
 
 print('1):')
 pprint(all_rows)
 
-conn.commit()
-
 
 # In[3]:
 
 # TOP 10 appearing amenities
 
-conn = sqlite3.connect(sqlite_file)
+all_rows = runner.run('religions')
 
-cur = conn.cursor()
+print('1):')
+pprint(all_rows)
 
-cur.execute('''
-SELECT nodes_tags.value, COUNT(*) as num
-FROM nodes_tags 
-    JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='place_of_worship') i
-    ON nodes_tags.id=i.id
-WHERE nodes_tags.key='religion'
-GROUP BY nodes_tags.value
-ORDER BY num DESC
-LIMIT 5;
 
-''')
+# In[ ]:
 
-all_rows = cur.fetchall()
+# Most popular Cusines
+
+all_rows = runner.run('cuisines')
 
 print('1):')
 pprint(all_rows)
 
-conn.commit()
-
 
 # In[ ]:
 
-# Most popular Cusines
+# Edits over time
 
-# TOP 10 appearing amenities
+from osm_wrangling.edit_history import edits_over_time, editors_since
 
 conn = sqlite3.connect(sqlite_file)
 
-cur = conn.cursor()
-
-cur.execute('''
-SELECT nodes_tags.value, COUNT(*) as num
-FROM nodes_tags 
-    JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='restaurant') i
-    ON nodes_tags.id=i.id
-WHERE nodes_tags.key='cuisine'
-GROUP BY nodes_tags.value
-ORDER BY num DESC;
-
-''')
-
-all_rows = cur.fetchall()
+print('Edits per year:')
+pprint(edits_over_time(conn, 'year'))
 
-print('1):')
-pprint(all_rows)
+print('Most active editors since 2016:')
+pprint(editors_since(conn, '2016-01-01'))
 
-conn.commit()
+conn.close()
+runner.close()
 
 
 # In[ ]:
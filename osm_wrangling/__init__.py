@@ -0,0 +1,19 @@
+"""
+Data wrangling of OpenStreetMap extracts: audit, shape, load into SQLite and
+report.
+
+Nothing is imported or run at import time; each module pulls in its own
+(possibly heavy) dependencies when it is used. The pipeline steps are
+
+    osm_wrangling.audit     audits of the raw .osm file
+    osm_wrangling.shape     shape_element / process_map -> csv files
+    osm_wrangling.load      csv files -> SQLite, with search and address indexes
+    osm_wrangling.reports   the SQL report catalog
+
+and the command line front end is
+
+    python -m osm_wrangling {audit,shape,load,report} --help
+
+The other modules are tools built around those steps, most with their own
+command line: python -m osm_wrangling.<module> --help.
+"""
@@ -0,0 +1,164 @@
+"""
+Normalized address lookup table built at load time.
+
+Looking an address up in nodes_tags took one self-join per part (street,
+housenumber, postcode). Instead, the loader folds each element's addr:* tags
+into one row of the addresses table: the parts are cleaned with the same
+normalizers as the audit (clean_street, clean_zip) and joined into a
+canonical key,
+
+    "1234|NORTH 7TH STREET|85004"      housenumber|street|postcode
+
+so an exact lookup is a single index seek on address_key, and partial
+lookups (street, street + housenumber, postcode) seek the composite indexes.
+AddressIndex loads the same keys into a dict for O(1) lookups in memory.
+
+    find_address(conn, '1234', 'N 7th St', '85004')
+    find_address(conn, street='N 7th St')
+    AddressIndex.from_db(conn).lookup('1234', 'N 7th St', '85004')
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import re
+import sqlite3
+from collections import defaultdict
+
+from .cleaning import clean_street, clean_zip
+
+CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS addresses(element TEXT, id INTEGER, housenumber TEXT,
+        street TEXT, postcode TEXT, city TEXT, address_key TEXT)
+'''
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS addresses_key ON addresses(address_key)',
+    'CREATE INDEX IF NOT EXISTS addresses_street ON addresses(street, housenumber)',
+    'CREATE INDEX IF NOT EXISTS addresses_postcode ON addresses(postcode, street)',
+]
+INSERT = '''INSERT INTO addresses(element, id, housenumber, street, postcode, city, address_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+_SPACES_RE = re.compile(r'\s+')
+
+
+def _norm(value):
+    return _SPACES_RE.sub(' ', value).strip().upper() if value else ''
+
+
+def normalize(housenumber=None, street=None, postcode=None):
+    """Cleaned, upper-cased (housenumber, street, postcode)"""
+    # the street mappings are keyed by title-case abbreviations ("Rd", "N")
+    return (_norm(housenumber), _norm(clean_street(street.title())) if street else '',
+            _norm(clean_zip(postcode)) if postcode else '')
+
+
+def address_key(housenumber=None, street=None, postcode=None):
+    """Canonical key of an address"""
+    return '|'.join(normalize(housenumber, street, postcode))
+
+
+def create_table(conn):
+    conn.execute(CREATE_TABLE)
+
+
+def create_indexes(conn):
+    """Create the lookup indexes (after the bulk insert is faster)"""
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.commit()
+
+
+def index_addresses(conn, element, rows):
+    """Insert one addresses row per element from (id, key, value, type) tag rows
+
+    Rows must come grouped by element id, as process_map writes them.
+    """
+    def addresses():
+        for element_id, tags in itertools.groupby(rows, key=lambda row: row[0]):
+            parts = {key: value for _, key, value, kind in tags if kind == 'addr'}
+            if 'street' not in parts and 'housenumber' not in parts:
+                continue
+            housenumber, street, postcode = normalize(
+                parts.get('housenumber'), parts.get('street'), parts.get('postcode'))
+            yield (element, element_id, housenumber, street, postcode,
+                   _norm(parts.get('city')), '|'.join((housenumber, street, postcode)))
+
+    conn.executemany(INSERT, addresses())
+
+
+def build(conn):
+    """(Re)build the table and its indexes from the loaded tag tables"""
+    conn.execute('DROP TABLE IF EXISTS addresses')
+    create_table(conn)
+    for element, table in (('node', 'nodes_tags'), ('way', 'ways_tags'),
+                           ('relation', 'relations_tags')):
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+            continue  # loaded before relations were shaped
+        rows = conn.cursor().execute(
+            "SELECT id, key, value, type FROM {0} WHERE type = 'addr' ORDER BY id".format(table))
+        index_addresses(conn, element, rows)
+    create_indexes(conn)
+
+
+def find_address(conn, housenumber=None, street=None, postcode=None):
+    """Return [(element, id, housenumber, street, postcode, city)] for an exact or partial address"""
+    housenumber, street, postcode = normalize(housenumber, street, postcode)
+    columns = 'SELECT element, id, housenumber, street, postcode, city FROM addresses WHERE '
+    if housenumber and street and postcode:
+        return conn.execute(columns + 'address_key = ?',
+                            ('|'.join((housenumber, street, postcode)),)).fetchall()
+    conditions, params = [], []
+    for column, value in (('street', street), ('housenumber', housenumber), ('postcode', postcode)):
+        if value:
+            conditions.append(column + ' = ?')
+            params.append(value)
+    if not conditions:
+        raise ValueError("Give at least one address part")
+    return conn.execute(columns + ' AND '.join(conditions), params).fetchall()
+
+
+class AddressIndex(object):
+    """address_key -> [(element, id)] held in a dict"""
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else defaultdict(list)
+
+    @classmethod
+    def from_db(cls, conn):
+        index = cls()
+        for element, element_id, key in conn.execute('SELECT element, id, address_key FROM addresses'):
+            index.entries[key].append((element, element_id))
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, housenumber=None, street=None, postcode=None):
+        """Elements at exactly this address"""
+        return self.entries.get(address_key(housenumber, street, postcode), [])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('sqlite_file')
+    parser.add_argument('--build', action='store_true', help='rebuild the addresses table')
+    parser.add_argument('--housenumber')
+    parser.add_argument('--street')
+    parser.add_argument('--postcode')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.sqlite_file)
+    try:
+        if args.build:
+            build(conn)
+            print('{0} addresses'.format(conn.execute('SELECT COUNT(*) FROM addresses').fetchone()[0]))
+        if args.housenumber or args.street or args.postcode:
+            for row in find_address(conn, args.housenumber, args.street, args.postcode):
+                print('{0:<5} {1:>12}  {2} {3} {4} {5}'.format(*row))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
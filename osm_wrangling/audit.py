@@ -0,0 +1,101 @@
+"""
+Audits of a raw .osm file, from the "Auditing the Data" cells of OSM_Code.py.
+
+The notebook reads the file once per audit; audit() runs all of them in a
+single pass:
+
+    tags         count of each element type
+    users        number of distinct uids
+    keys         tag keys by shape: lower, lower_colon, problemchars, other
+    street       unexpected street types -> street names
+    postcode     postcodes by their last word
+    phone        phone numbers by their last word
+
+print_audit() prints the results with the value each cleaning function in
+cleaning.py would produce, as the notebook does.
+"""
+from __future__ import print_function
+
+import pprint
+import re
+from collections import defaultdict
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from .cleaning import clean_phone, clean_street, clean_zip, street_type_re
+
+LOWER = re.compile(r'^([a-z]|_)*$')
+LOWER_COLON = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+LAST_WORD_RE = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+
+EXPECTED_STREET_TYPES = [
+    "Street", "Avenue", "Boulevard", "Drive", "Court", "Place", "Square", "Lane", "Road",
+    "Trail", "Commons", "Mountain", "Highway", "Horne", "Sycamore", "Way", "Freeway", "Crossing",
+    "Mall", "Loop", "Ventura"]
+
+# tag key -> (report name, regex, expected values, cleaning function)
+VALUE_AUDITS = {
+    'addr:street': ('street', street_type_re, frozenset(EXPECTED_STREET_TYPES), clean_street),
+    'addr:postcode': ('postcode', LAST_WORD_RE, frozenset(), clean_zip),
+    'phone': ('phone', LAST_WORD_RE, frozenset(), clean_phone),
+}
+
+
+def key_type(k, keys):
+    """Count tag key k into the lower / lower_colon / problemchars / other buckets"""
+    if LOWER.search(k):
+        keys["lower"] += 1
+    elif LOWER_COLON.search(k):
+        keys["lower_colon"] += 1
+    elif PROBLEMCHARS.search(k):
+        keys["problemchars"] += 1
+    else:
+        keys["other"] += 1
+
+
+def audit(osm_file):
+    """Run every audit in one pass over osm_file; return {audit name: result}"""
+    tags = defaultdict(int)
+    users = set()
+    keys = {"lower": 0, "lower_colon": 0, "problemchars": 0, "other": 0}
+    values = {name: defaultdict(set) for name, _, _, _ in VALUE_AUDITS.values()}
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'start':
+            continue
+        tags[elem.tag] += 1
+        if 'uid' in elem.attrib:
+            users.add(elem.attrib['uid'])
+        if elem.tag == 'tag':
+            key_type(elem.attrib['k'], keys)
+        elif elem.tag in ('node', 'way'):
+            for tag in elem.iter('tag'):
+                spec = VALUE_AUDITS.get(tag.attrib['k'])
+                if spec is not None:
+                    name, regex, expected, _ = spec
+                    m = regex.search(tag.attrib['v'])
+                    if m and m.group() not in expected:
+                        values[name][m.group()].add(tag.attrib['v'])
+        if elem.tag in ('node', 'way', 'relation'):
+            root.clear()
+    result = {'tags': dict(tags), 'users': len(users), 'keys': keys}
+    result.update((name, dict(found)) for name, found in values.items())
+    return result
+
+
+def print_audit(result):
+    """Print audit() results, with the cleaned form of every flagged value"""
+    for name in ('tags', 'users', 'keys'):
+        print('{0}:'.format(name))
+        pprint.pprint(result[name])
+    for name, _, _, clean in sorted(VALUE_AUDITS.values()):
+        print('{0}:'.format(name))
+        for kind in sorted(result[name]):
+            for value in sorted(result[name][kind]):
+                print(u'    {0} => {1}'.format(value, clean(value)))
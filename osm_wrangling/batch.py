@@ -0,0 +1,227 @@
+"""
+Audit, shape and load many regions at once on a process pool.
+
+A manifest lists the regions; each one gets its own directory under
+output_dir holding its csv files, its database (<name>.db) and its stage
+cache, so regions never share a file and a rerun skips the regions (and
+stages) whose inputs did not change:
+
+    {
+      "output_dir": "regions",
+      "defaults": {"rules": true, "load": true},
+      "regions": [
+        {"name": "phoenix", "osm": "phoenix_arizona.osm"},
+        {"name": "tucson", "osm": "tucson.osm", "bbox": [32.0, -111.2, 32.4, -110.7]}
+      ]
+    }
+
+Region keys: name and osm (relative to the manifest) are required; validate,
+rules (true for the shipped rules, or a path), bbox, tags, load (default
+true), tile_zoom and way_tile are optional. A region with tile_zoom is
+written as quadkey tiles (tiles.py) and not loaded.
+
+The pool has min(--workers, --memory-mb / --worker-memory-mb) processes, so
+both the CPU and the memory budget hold. Each region runs in a fresh process
+(maxtasksperchild=1), which is what makes its peak RSS measurable, and with
+--hard-limit the process is also capped with RLIMIT_AS so a runaway region
+fails on its own instead of taking the machine down. The largest extracts
+are started first. The combined throughput report is printed and written
+to output_dir/batch_report.json.
+
+    python -m osm_wrangling.batch regions.json --workers 8 --memory-mb 16000
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+WORKER_MEMORY_MB = 1024
+REPORT_FILE = 'batch_report.json'
+REGION_KEYS = frozenset(['name', 'osm', 'validate', 'rules', 'bbox', 'tags', 'load', 'tile_zoom',
+                         'way_tile'])
+
+
+def read_manifest(path):
+    """Return (output_dir, [region dict]) with paths resolved against the manifest"""
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get('defaults', {})
+    regions = []
+    for entry in manifest['regions']:
+        region = dict(defaults, **entry)
+        unknown = set(region) - REGION_KEYS
+        if unknown:
+            raise ValueError('region {0!r}: unknown keys {1}'.format(region.get('name'), sorted(unknown)))
+        if 'name' not in region or 'osm' not in region:
+            raise ValueError('every region needs a name and an osm file: {0!r}'.format(entry))
+        region['osm'] = os.path.join(base, region['osm'])
+        if region.get('rules') not in (None, True, False):
+            region['rules'] = os.path.join(base, region['rules'])
+        regions.append(region)
+    names = [region['name'] for region in regions]
+    if len(set(names)) != len(names):
+        raise ValueError('region names must be unique')
+    return os.path.join(base, manifest.get('output_dir', 'regions')), regions
+
+
+def pool_size(workers=None, memory_mb=None, worker_memory_mb=WORKER_MEMORY_MB):
+    """Number of processes that fits both the CPU and the memory budget"""
+    size = workers or multiprocessing.cpu_count()
+    if memory_mb:
+        size = min(size, int(memory_mb // worker_memory_mb))
+    return max(1, size)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _limit_memory(limit_mb):
+    if limit_mb and resource is not None:
+        limit = int(limit_mb * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def run_region(job):
+    """Audit, shape and load one region in its own directory; return its stats"""
+    region, output_dir, force = job
+    from .cleaning_rules import RULES_PATH
+    from .stage_cache import StageCache, cached_audit, cached_load, cached_shape
+
+    name = region['name']
+    out_dir = os.path.join(output_dir, name)
+    stats = {'name': name, 'osm': region['osm'], 'out_dir': out_dir, 'seconds': {}}
+    try:
+        stats['mb'] = os.path.getsize(region['osm']) / 1e6
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        cache = StageCache(os.path.join(out_dir, '.osm_cache'), force=force)
+        rules = region.get('rules')
+
+        start = time.time()
+        audit = cached_audit(cache, region['osm'])
+        stats['seconds']['audit'] = time.time() - start
+        stats['elements'] = sum(audit['tags'].get(tag, 0) for tag in ('node', 'way', 'relation'))
+
+        start = time.time()
+        cached_shape(cache, region['osm'], out_dir, region.get('validate', False),
+                     RULES_PATH if rules is True else rules or None,
+                     region.get('bbox'), region.get('tags', ()),
+                     region.get('tile_zoom'), region.get('way_tile', 'first'))
+        stats['seconds']['shape'] = time.time() - start
+
+        if region.get('load', True) and not region.get('tile_zoom'):
+            start = time.time()
+            stats['rows'] = cached_load(cache, os.path.join(out_dir, name + '.db'), out_dir)
+            stats['seconds']['load'] = time.time() - start
+        stats['cached'] = cache.hits
+        stats['status'] = 'ok'
+    except Exception as e:  # one bad extract must not stop the batch
+        stats['status'] = 'failed'
+        stats['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    stats['peak_rss_mb'] = _peak_rss_mb()
+    return stats
+
+
+def run_batch(output_dir, regions, workers=None, memory_mb=None,
+              worker_memory_mb=WORKER_MEMORY_MB, hard_limit=False, force=False):
+    """Run every region on a process pool; return the combined report dict"""
+    size = min(pool_size(workers, memory_mb, worker_memory_mb), len(regions)) or 1
+    # largest first, so a big extract does not start last and stretch the whole batch
+    regions = sorted(regions, key=lambda r: os.path.getsize(r['osm']) if os.path.exists(r['osm']) else 0,
+                     reverse=True)
+    jobs = [(region, output_dir, force) for region in regions]
+    start = time.time()
+    pool = multiprocessing.Pool(size, _limit_memory, (worker_memory_mb if hard_limit else None,),
+                                maxtasksperchild=1)
+    try:
+        results = []
+        for stats in pool.imap_unordered(run_region, jobs):
+            print('{0:<20} {1}'.format(stats['name'], stats['status']), file=sys.stderr)
+            results.append(stats)
+    finally:
+        pool.close()
+        pool.join()
+    wall = time.time() - start
+    return _report(results, wall, size)
+
+
+def _report(results, wall, size):
+    done = [r for r in results if r['status'] == 'ok']
+    busy = sum(sum(r['seconds'].values()) for r in done)
+    mb = sum(r['mb'] for r in done)
+    elements = sum(r['elements'] for r in done)
+    return {
+        'workers': size,
+        'wall_seconds': wall,
+        'regions': sorted(results, key=lambda r: r['name']),
+        'ok': len(done),
+        'failed': len(results) - len(done),
+        'mb': mb,
+        'elements': elements,
+        'mb_per_s': mb / wall if wall else None,
+        'elements_per_s': elements / wall if wall else None,
+        # region-seconds per wall second: how well the pool was used
+        'parallelism': busy / wall if wall else None,
+    }
+
+
+def print_report(report):
+    print('{0:<20} {1:>9} {2:>10} {3:>8} {4:>8} {5:>8} {6:>10} {7:>8}  {8}'.format(
+        'region', 'MB', 'elements', 'audit s', 'shape s', 'load s', 'elem/s', 'peak MB', 'cached'))
+    for r in report['regions']:
+        if r['status'] != 'ok':
+            print('{0:<20} FAILED {1}'.format(r['name'], r['error']))
+            continue
+        seconds = r['seconds']
+        total = sum(seconds.values())
+        print('{0:<20} {1:>9.1f} {2:>10} {3:>8.2f} {4:>8.2f} {5:>8} {6:>10.0f} {7:>8} {8}'.format(
+            r['name'], r['mb'], r['elements'], seconds['audit'], seconds['shape'],
+            '{0:.2f}'.format(seconds['load']) if 'load' in seconds else '-',
+            r['elements'] / total if total else 0,
+            '{0:.0f}'.format(r['peak_rss_mb']) if r['peak_rss_mb'] is not None else '-',
+            ','.join(r['cached'])))
+    print('{0} regions ok, {1} failed on {2} workers in {3:.1f}s: {4:.1f} MB/s, '
+          '{5:.0f} elements/s, parallelism {6:.1f}'.format(
+              report['ok'], report['failed'], report['workers'], report['wall_seconds'],
+              report['mb_per_s'] or 0, report['elements_per_s'] or 0, report['parallelism'] or 0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('manifest')
+    parser.add_argument('--workers', type=int, help='processes (default: cpu count)')
+    parser.add_argument('--memory-mb', type=float, help='memory budget for the whole batch')
+    parser.add_argument('--worker-memory-mb', type=float, default=WORKER_MEMORY_MB,
+                        help='memory one region may use (default %(default)s)')
+    parser.add_argument('--hard-limit', action='store_true',
+                        help='enforce --worker-memory-mb with RLIMIT_AS')
+    parser.add_argument('--force', action='store_true', help='ignore the stage caches')
+    args = parser.parse_args(argv)
+
+    output_dir, regions = read_manifest(args.manifest)
+    report = run_batch(output_dir, regions, args.workers, args.memory_mb,
+                       args.worker_memory_mb, args.hard_limit, args.force)
+    print_report(report)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    with open(os.path.join(output_dir, REPORT_FILE), 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,112 @@
+"""
+Street name, postal code and phone number normalizers.
+
+These are the cleaning rules worked out in the audit sections of OSM_Code.py,
+pulled into plain functions so the same rules can be applied when printing
+the audit results, inside SQLite (sqlite_cleaning.py) or while shaping.
+Each function takes one tag value and returns the cleaned value; values it
+does not know how to clean are returned unchanged.
+"""
+import re
+
+# ================================================== #
+#               Street Names                         #
+# ================================================== #
+street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
+street_type_pre = re.compile(r'^[NSEW]\b\.?', re.IGNORECASE)
+
+# suite / unit / building parts and anything after a comma or '#'
+street_unit_re = re.compile(r'\s*(?:,|#|\b(?:Suite|Ste|Building)\b).*$')
+
+# street name endings
+mapping = {
+    "Boulavard": "Boulevard",
+    "D": "Drive",
+    "street": "Street",
+    "Rd": "Road",
+    "Rd.": "Road",
+    "RD": "Road",
+    "Pkwy": "Parkway",
+    "Ave": "Avenue",
+    "Ave.": "Avenue",
+    "Glen": "Glendale",
+    "Blvd": "Boulevard",
+    "Blvd.": "Boulevard",
+    "St": "Street",
+    "Dr": "Drive",
+    "Dr.": "Drive",
+    "Ctr": "Centre",
+}
+
+# cardinal directions at the beginning of the street name
+mapping2 = {
+    "E": "East",
+    "E.": "East",
+    "N": "North",
+    "N.": "North",
+    "S": "South",
+    "S.": "South",
+    "W": "West",
+    "W.": "West",
+}
+
+
+def update_name(name, mapping, regex):
+    m = regex.search(name)
+    if m:
+        street_type = m.group()
+        if street_type in mapping:
+            name = regex.sub(mapping[street_type], name)
+    return name
+
+
+def clean_street(name):
+    """Drop suite/unit parts, then expand street type and direction abbreviations"""
+    if name is None:
+        return None
+    name = street_unit_re.sub('', name).strip()
+    name = update_name(name, mapping, street_type_re)
+    return update_name(name, mapping2, street_type_pre)
+
+
+# ================================================== #
+#               Postal Codes                         #
+# ================================================== #
+def clean_zip(code):
+    """Reduce "AZ 85004" and ZIP+4 "85004-1234" to the plain 5 digit code"""
+    if code is None:
+        return None
+    code = code.strip()
+    if code[:2].upper() == 'AZ':
+        code = code[2:].strip()
+    return code.split('-')[0].strip()
+
+
+# ================================================== #
+#               Phone Numbers                        #
+# ================================================== #
+phone_extension_re = re.compile(r'\s*(?:x|ext\.?)\s*(\d+)$', re.IGNORECASE)
+
+
+def clean_phone(number):
+    """Format US phone numbers as "XXX XXX XXXX"
+
+    Only the first of several ';' separated numbers is kept, the +1 / 1 / 01
+    country prefix is dropped and an extension is kept as " x123".
+    """
+    if number is None:
+        return None
+    first = number.split(';')[0].strip()
+    extension = ''
+    m = phone_extension_re.search(first)
+    if m:
+        extension = ' x' + m.group(1)
+        first = first[:m.start()]
+    digits = re.sub(r'\D', '', first)
+    if len(digits) == 11 and digits.startswith('1'):
+        digits = digits[1:]
+    elif len(digits) == 12 and digits.startswith('01'):
+        digits = digits[2:]
+    if len(digits) != 10:
+        return number
+    return digits[0:3] + ' ' + digits[3:6] + ' ' + digits[6:] + extension
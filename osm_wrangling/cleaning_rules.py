@@ -0,0 +1,168 @@
+"""
+Declarative cleaning rules applied while shaping.
+
+A rule set maps full tag keys ("addr:street", "phone", ...) to an ordered
+list of rules. It is written as JSON (or YAML, if PyYAML is installed), see
+cleaning_rules.json for the rules used on the Phoenix extract:
+
+    {"addr:postcode": [{"rule": "strip_prefix", "prefix": "AZ"},
+                       {"rule": "split", "sep": "-", "index": 0}]}
+
+A parameter written as {"cleaning": "name"} stands for that object of
+cleaning.py, so the street tables and patterns are kept in one place:
+
+    {"addr:street": [{"rule": "map_word", "mapping": {"cleaning": "mapping"}}]}
+
+RuleSet compiles the file once into a dispatch table keyed by tag key, so
+shape_element pays a single dict lookup for tags that have no rules. Every
+rule counts how often it actually changed a value; hits() exports those
+counters.
+
+Available rules:
+  sub           regex "pattern" replaced by "repl" (default ""), "flags": "i"
+  map_word      replace the "last" or "first" word through "mapping"
+  split         keep part "index" of the value split on "sep"
+  strip_prefix  drop a case-insensitive "prefix"
+  strip         strip whitespace (or "chars")
+  digits        keep the digits, drop "drop_prefixes", regroup by "groups"; with
+                "split" only the first part is used (the whole value is kept
+                when it is not a number)
+  function      call "name" from cleaning.py
+"""
+import json
+import os
+import re
+
+from . import cleaning
+
+# the rules used on the Phoenix extract, shipped next to this module
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cleaning_rules.json')
+
+_WORD_PATTERNS = {
+    'last': cleaning.street_type_re,
+    'first': cleaning.street_type_pre,
+}
+_EXTENSION_RE = cleaning.phone_extension_re
+
+
+def _resolve(value):
+    if isinstance(value, dict) and list(value) == ['cleaning']:
+        return getattr(cleaning, value['cleaning'])
+    return value
+
+
+def _sub(pattern, repl='', flags=''):
+    if hasattr(pattern, 'sub'):  # already compiled, e.g. {"cleaning": "street_unit_re"}
+        regex = pattern
+    else:
+        regex = re.compile(pattern, re.IGNORECASE if 'i' in flags else 0)
+    return lambda value: regex.sub(repl, value).strip()
+
+
+def _map_word(mapping, position='last', pattern=None):
+    regex = re.compile(pattern, re.IGNORECASE) if pattern else _WORD_PATTERNS[position]
+    return lambda value: cleaning.update_name(value, mapping, regex)
+
+
+def _split(sep, index=0):
+    def split(value):
+        parts = value.split(sep)
+        return parts[index].strip() if -len(parts) <= index < len(parts) else value
+    return split
+
+
+def _strip_prefix(prefix):
+    size = len(prefix)
+    prefix = prefix.upper()
+    return lambda value: value[size:].strip() if value[:size].upper() == prefix else value
+
+
+def _strip(chars=None):
+    return lambda value: value.strip(chars)
+
+
+def _digits(groups=(3, 3, 4), sep=' ', drop_prefixes=(), extension=True, split=None):
+    total = sum(groups)
+
+    def digits(value):
+        original, suffix = value, ''
+        if split:
+            value = value.split(split)[0].strip()
+        m = _EXTENSION_RE.search(value) if extension else None
+        if m:
+            suffix = ' x' + m.group(1)
+            value = value[:m.start()]
+        number = re.sub(r'\D', '', value)
+        for prefix in drop_prefixes:
+            if len(number) == total + len(prefix) and number.startswith(prefix):
+                number = number[len(prefix):]
+                break
+        if len(number) != total:
+            return original
+        parts, start = [], 0
+        for size in groups:
+            parts.append(number[start:start + size])
+            start += size
+        return sep.join(parts) + suffix
+    return digits
+
+
+def _function(name):
+    return getattr(cleaning, name)
+
+
+RULE_TYPES = {
+    'sub': _sub,
+    'map_word': _map_word,
+    'split': _split,
+    'strip_prefix': _strip_prefix,
+    'strip': _strip,
+    'digits': _digits,
+    'function': _function,
+}
+
+
+class RuleSet(object):
+    """Compiled per-key cleaning rules with hit counters"""
+
+    def __init__(self, spec):
+        self.dispatch = {}
+        self.labels = {}
+        self.counts = {}
+        for key, rules in spec.items():
+            chain = []
+            for rule in rules:
+                params = dict((name, _resolve(value)) for name, value in rule.items())
+                kind = params.pop('rule')
+                if kind not in RULE_TYPES:
+                    raise ValueError("Unknown cleaning rule {0!r} for {1}".format(kind, key))
+                chain.append(RULE_TYPES[kind](**params))
+            self.dispatch[key] = chain
+            self.labels[key] = ['{0}:{1}'.format(i, r['rule']) for i, r in enumerate(rules)]
+            self.counts[key] = [0] * len(chain)
+
+    @classmethod
+    def load(cls, path):
+        """Read a rule set from a .json or .yaml/.yml file"""
+        with open(path) as f:
+            if path.endswith(('.yaml', '.yml')):
+                import yaml
+                return cls(yaml.safe_load(f))
+            return cls(json.load(f))
+
+    def clean(self, key, value):
+        """Run the rules for key over value and return the cleaned value"""
+        chain = self.dispatch.get(key)
+        if chain is None:
+            return value
+        counts = self.counts[key]
+        for i, rule in enumerate(chain):
+            cleaned = rule(value)
+            if cleaned != value:
+                counts[i] += 1
+                value = cleaned
+        return value
+
+    def hits(self):
+        """Return {key: {rule label: number of values the rule changed}}"""
+        return {key: dict(zip(self.labels[key], self.counts[key])) for key in self.dispatch}
@@ -0,0 +1,211 @@
+"""
+Command line front end: python -m osm_wrangling {audit,shape,load,report,cache,batch,bench}.
+
+Only argparse is imported up front; every subcommand imports what it needs
+when it runs, so --help starts in a few tens of milliseconds.
+
+audit, shape and load go through the stage cache (stage_cache.py): a run
+whose inputs, options and code match an earlier one is skipped. --force
+reruns the stage, --no-cache bypasses the cache and
+"cache clear STAGE" forgets one stage's runs.
+
+--profile cprofile,tracemalloc,sample profiles the command's stages (the
+same as setting OSM_PROFILE, see profiling.py).
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+SQLITE_FILE = 'OpenStreetMap2.db'  # reports.SQLITE_FILE, not imported here to keep startup fast
+
+
+def _stage_cache(args):
+    from .stage_cache import StageCache
+    return StageCache(args.cache_dir, force=args.force)
+
+
+def _report_cache(cache):
+    if cache.hits:
+        print('{0}: reused the cached result (--force to rerun)'.format(', '.join(cache.hits)))
+
+
+def _audit(args):
+    from .audit import audit, print_audit
+    if args.no_cache:
+        result = audit(args.osm_file)
+    else:
+        from .stage_cache import cached_audit
+        cache = _stage_cache(args)
+        result = cached_audit(cache, args.osm_file)
+        _report_cache(cache)
+    print_audit(result)
+
+
+def _shape(args):
+    from .shape import process_map
+    if not (args.no_cache or args.check_integrity):
+        from .cleaning_rules import RULES_PATH
+        from .stage_cache import cached_shape
+        cache = _stage_cache(args)
+        cached_shape(cache, args.osm_file, args.out_dir, args.validate,
+                     RULES_PATH if args.rules == 'default' else args.rules, args.bbox, args.tag,
+                     args.tile_zoom, args.way_tile)
+        _report_cache(cache)
+        return 0
+    element_filter = integrity_checker = cleaning_rules = writer = None
+    if args.bbox or args.tag:
+        from .osm_filter import BBox, ElementFilter, parse_tag_predicate
+        area = BBox(*args.bbox) if args.bbox else None
+        element_filter = ElementFilter(area, [parse_tag_predicate(t) for t in args.tag])
+    if args.check_integrity:
+        from .osm_integrity import IntegrityChecker
+        integrity_checker = IntegrityChecker()
+    if args.rules:
+        from .cleaning_rules import RULES_PATH, RuleSet
+        cleaning_rules = RuleSet.load(RULES_PATH if args.rules == 'default' else args.rules)
+    if args.tile_zoom:
+        from .tiles import TileWriter
+        writer = TileWriter(args.out_dir, args.tile_zoom, args.way_tile)
+    process_map(args.osm_file, args.validate, element_filter=element_filter,
+                integrity_checker=integrity_checker, cleaning_rules=cleaning_rules,
+                out_dir=args.out_dir, writer=writer)
+    if integrity_checker is not None:
+        print(integrity_checker.summary())
+        return 0 if integrity_checker.ok() else 1
+    return 0
+
+
+def _load(args):
+    from .load import load
+    if args.no_cache:
+        counts = load(args.db, args.csv_dir)
+    else:
+        from .stage_cache import cached_load
+        cache = _stage_cache(args)
+        counts = cached_load(cache, args.db, args.csv_dir)
+        _report_cache(cache)
+    width = max(len(table) for table in counts)
+    for table, rows in sorted(counts.items()):
+        print('{0:<{width}} {1:>10}'.format(table, rows, width=width))
+
+
+def _report(args):
+    from pprint import pprint
+    from .reports import REPORTS, open_engine, run_reports
+    unknown = [name for name in args.reports if name not in REPORTS]
+    if unknown:
+        raise SystemExit('unknown report(s): ' + ', '.join(unknown))
+    engine = open_engine(args.engine, args.db, args.csv_dir)
+    try:
+        for name, rows in run_reports(engine, args.reports).items():
+            print('{0}:'.format(REPORTS[name][0]))
+            pprint(rows)
+    finally:
+        engine.close()
+
+
+def _batch(args):
+    from .batch import main as batch_main
+    return batch_main(args.args)
+
+
+def _bench(args):
+    from .query_bench import main as bench_main
+    return bench_main(args.args)
+
+
+def _cache(args):
+    from .stage_cache import main as cache_main
+    cache_main(['--cache-dir', args.cache_dir] + args.args)
+
+
+def _bbox(text):
+    values = [float(v) for v in text.split(',')]
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError('expected minlat,minlon,maxlat,maxlon')
+    return values
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='osm_wrangling', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--time', action='store_true', help='print the elapsed time')
+    parser.add_argument('--cache-dir', default='.osm_cache', help='stage cache directory')
+    parser.add_argument('--force', action='store_true', help='rerun the stage even if it is cached')
+    parser.add_argument('--no-cache', action='store_true', help='neither use nor record the stage cache')
+    parser.add_argument('--profile', metavar='MODES',
+                        help='comma separated profile modes: cprofile, tracemalloc, sample')
+    parser.add_argument('--profile-dir', default='profiles', help='where profiles are written')
+    sub = parser.add_subparsers(dest='command', metavar='command')
+    sub.required = True
+
+    audit = sub.add_parser('audit', help='audit tags, users, streets, postcodes and phones')
+    audit.add_argument('osm_file')
+    audit.set_defaults(run=_audit)
+
+    shape = sub.add_parser('shape', help='shape an .osm file into the csv files')
+    shape.add_argument('osm_file')
+    shape.add_argument('--out-dir', default='.')
+    shape.add_argument('--validate', action='store_true', help='validate with cerberus')
+    shape.add_argument('--rules', nargs='?', const='default',
+                       help='clean tag values with a rule file (default: the shipped rules)')
+    shape.add_argument('--bbox', type=_bbox, help='minlat,minlon,maxlat,maxlon')
+    shape.add_argument('--tag', action='append', default=[],
+                       help='keep elements matching a tag predicate, e.g. "amenity in (cafe,bar)"')
+    shape.add_argument('--check-integrity', action='store_true', help='check references (not cached)')
+    shape.add_argument('--tile-zoom', type=int,
+                       help='write one file set per quadkey tile at this zoom, plus tiles.json')
+    shape.add_argument('--way-tile', choices=['first', 'centroid'], default='first',
+                       help='tile a way by its first node or its centroid (default: first)')
+    shape.set_defaults(run=_shape)
+
+    load = sub.add_parser('load', help='load the csv files into SQLite')
+    load.add_argument('--db', default=SQLITE_FILE)
+    load.add_argument('--csv-dir', default='.')
+    load.set_defaults(run=_load)
+
+    report = sub.add_parser('report', help='run the SQL reports')
+    report.add_argument('reports', nargs='*', help='report names (default: all)')
+    report.add_argument('--db', default=SQLITE_FILE)
+    report.add_argument('--engine', choices=['sqlite', 'duckdb'], default='sqlite')
+    report.add_argument('--csv-dir', default='.', help='csv files, for the duckdb engine')
+    report.set_defaults(run=_report)
+
+    cache = sub.add_parser('cache', help='list, clear or prune the stage cache',
+                           description='list | clear [STAGE ...] | prune')
+    cache.add_argument('args', nargs=argparse.REMAINDER)
+    cache.set_defaults(run=_cache)
+
+    batch = sub.add_parser('batch', help='run many regions from a manifest on a process pool',
+                           description='MANIFEST [--workers N] [--memory-mb MB] ... '
+                                       '(see python -m osm_wrangling.batch --help)')
+    batch.add_argument('args', nargs=argparse.REMAINDER)
+    batch.set_defaults(run=_batch)
+
+    # no option prefix of its own: every option, even a leading one, goes through to query_bench
+    bench = sub.add_parser('bench', help='time the SQL reports at several scale factors against a baseline',
+                           prefix_chars='+', add_help=False,
+                           description='[REPORT ...] [--scale 1,4,16] [--baseline FILE] ... '
+                                       '(see python -m osm_wrangling.query_bench --help)')
+    bench.add_argument('args', nargs=argparse.REMAINDER)
+    bench.set_defaults(run=_bench)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    start = time.time()
+    if args.profile:
+        from .profiling import Profiler, parse_modes
+        try:
+            modes = parse_modes(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+        with Profiler(modes, args.profile_dir, args.command):
+            status = args.run(args)
+    else:
+        status = args.run(args)
+    if args.time:
+        print('{0} took {1:.2f}s'.format(args.command, time.time() - start))
+    return status or 0
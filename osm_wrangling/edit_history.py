@@ -0,0 +1,115 @@
+"""
+Edit-history reports over OpenStreetMap2.db.
+
+shape_element stores timestamps as integer epoch seconds, and the loader
+indexes nodes and ways on (timestamp) and (uid, timestamp). Time-window
+questions are therefore index range scans instead of string parsing on
+every row:
+
+    edits_over_time(conn, 'month')               edits per month
+    editors_since(conn, '2015-01-01')            who edited since a date
+    user_edits(conn, uid, since='2016-01-01')    one user's edits in a window
+
+    python -m osm_wrangling.edit_history OpenStreetMap2.db --period month --since 2014-01-01
+"""
+from __future__ import print_function
+
+import argparse
+import sqlite3
+
+from .osm_io import epoch_to_timestamp, timestamp_to_epoch
+
+PERIODS = {'year': '%Y', 'month': '%Y-%m', 'day': '%Y-%m-%d'}
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS nodes_timestamp ON nodes(timestamp)',
+    'CREATE INDEX IF NOT EXISTS nodes_uid_timestamp ON nodes(uid, timestamp)',
+    'CREATE INDEX IF NOT EXISTS ways_timestamp ON ways(timestamp)',
+    'CREATE INDEX IF NOT EXISTS ways_uid_timestamp ON ways(uid, timestamp)',
+]
+
+_NO_LIMIT = 1 << 53
+
+
+def create_indexes(conn):
+    """Create the timestamp access paths (after the bulk insert is faster)"""
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.commit()
+
+
+def to_epoch(value):
+    """Accept epoch seconds, "YYYY-MM-DD" or a full OSM timestamp"""
+    if value is None or isinstance(value, int):
+        return value
+    if len(value) == 10:
+        value += 'T00:00:00Z'
+    return timestamp_to_epoch(value)
+
+
+def _window(since, until):
+    since, until = to_epoch(since), to_epoch(until)
+    return (0 if since is None else since), (_NO_LIMIT if until is None else until)
+
+
+def edits_over_time(conn, period='month', since=None, until=None):
+    """Return [(period, edits)] for nodes and ways edited in [since, until)"""
+    window = _window(since, until)
+    return conn.execute('''
+        SELECT strftime(?, e.timestamp, 'unixepoch') AS period, COUNT(*)
+        FROM (SELECT timestamp FROM nodes WHERE timestamp >= ? AND timestamp < ?
+              UNION ALL
+              SELECT timestamp FROM ways WHERE timestamp >= ? AND timestamp < ?) e
+        GROUP BY period
+        ORDER BY period
+    ''', (PERIODS[period],) + window + window).fetchall()
+
+
+def editors_since(conn, since, until=None, limit=10):
+    """Return [(user, uid, edits)] of the most active editors in [since, until)"""
+    window = _window(since, until)
+    return conn.execute('''
+        SELECT e.user, e.uid, COUNT(*) AS num
+        FROM (SELECT user, uid FROM nodes WHERE timestamp >= ? AND timestamp < ?
+              UNION ALL
+              SELECT user, uid FROM ways WHERE timestamp >= ? AND timestamp < ?) e
+        GROUP BY e.uid
+        ORDER BY num DESC
+        LIMIT ?
+    ''', window + window + (limit,)).fetchall()
+
+
+def user_edits(conn, uid, since=None, until=None):
+    """Return [(type, id, timestamp)] for one user's edits in [since, until)"""
+    window = _window(since, until)
+    rows = conn.execute('''
+        SELECT 'node', id, timestamp FROM nodes WHERE uid = ? AND timestamp >= ? AND timestamp < ?
+        UNION ALL
+        SELECT 'way', id, timestamp FROM ways WHERE uid = ? AND timestamp >= ? AND timestamp < ?
+        ORDER BY timestamp
+    ''', (uid,) + window + (uid,) + window).fetchall()
+    return [(kind, element_id, epoch_to_timestamp(ts)) for kind, element_id, ts in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('sqlite_file', nargs='?', default='OpenStreetMap2.db')
+    parser.add_argument('--period', choices=sorted(PERIODS), default='month')
+    parser.add_argument('--since')
+    parser.add_argument('--until')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.sqlite_file)
+    try:
+        for period, edits in edits_over_time(conn, args.period, args.since, args.until):
+            print('{0:<10} {1:>10}'.format(period, edits))
+        print()
+        print('Most active editors:')
+        for user, uid, edits in editors_since(conn, args.since, args.until):
+            print('{0:<30} {1:>10} {2:>10}'.format(user, uid, edits))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
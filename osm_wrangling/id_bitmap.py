@@ -0,0 +1,68 @@
+"""
+Compact bitmap of OSM element ids.
+
+A python set spends around 70 bytes per id, which is far too much once an
+extract holds tens of millions of nodes. IdBitmap spends one bit per id
+instead: the id space is cut into fixed size chunks and a chunk is only
+allocated once an id falls into it. OSM ids in a regional extract are
+clustered, so most allocated chunks end up densely populated.
+"""
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_BYTES = CHUNK_SIZE >> 3
+
+
+class IdBitmap(object):
+    """Set of non-negative integer ids backed by lazily allocated bit chunks"""
+
+    __slots__ = ('_chunks', '_count')
+
+    def __init__(self, ids=()):
+        self._chunks = {}
+        self._count = 0
+        for i in ids:
+            self.add(i)
+
+    def add(self, i):
+        """Add id i; return True if it was not present before"""
+        chunk = self._chunks.get(i >> CHUNK_BITS)
+        if chunk is None:
+            chunk = self._chunks[i >> CHUNK_BITS] = bytearray(CHUNK_BYTES)
+        offset = i & CHUNK_MASK
+        bit = 1 << (offset & 7)
+        if chunk[offset >> 3] & bit:
+            return False
+        chunk[offset >> 3] |= bit
+        self._count += 1
+        return True
+
+    def update(self, ids):
+        for i in ids:
+            self.add(i)
+
+    def __contains__(self, i):
+        chunk = self._chunks.get(i >> CHUNK_BITS)
+        if chunk is None:
+            return False
+        offset = i & CHUNK_MASK
+        return bool(chunk[offset >> 3] & (1 << (offset & 7)))
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Yield the ids in ascending order"""
+        for base in sorted(self._chunks):
+            chunk = self._chunks[base]
+            base <<= CHUNK_BITS
+            for byte_index, byte in enumerate(chunk):
+                if byte:
+                    for bit in range(8):
+                        if byte & (1 << bit):
+                            yield base + (byte_index << 3) + bit
+
+    def memory(self):
+        """Approximate number of bytes held by the bit chunks"""
+        return len(self._chunks) * CHUNK_BYTES
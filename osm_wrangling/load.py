@@ -0,0 +1,123 @@
+"""
+Load the process_map csv files into SQLite (the "Preparing for SQL" cell).
+
+The tables are recreated, then every csv file is streamed into its table.
+Tag rows are inserted in chunks that end on an element boundary, and each
+chunk also feeds the tag_search full-text index and the addresses table, so
+the tag files are read only once. The edit-history, address and relation
+member indexes are created after the bulk insert. A csv_dir shaped before
+relations were has no relations*.csv files; their tables are left empty.
+With OSM_PROFILE set (see profiling.py) the inserts and the index builds are
+profiled as the load and load_indexes stages.
+
+    load('OpenStreetMap2.db', csv_dir='phoenix')
+"""
+import itertools
+import os
+import sqlite3
+from collections import OrderedDict
+
+from . import address_index, profiling, relations, tag_search
+from .edit_history import create_indexes
+from .osm_io import iter_csv
+from .reports import SQLITE_FILE
+
+CHUNK_ROWS = 10000
+
+# table -> (csv file, create statement, columns)
+TABLES = OrderedDict([
+    ('nodes_tags', ('nodes_tags.csv',
+                    'CREATE TABLE nodes_tags(id INTEGER, key TEXT, value TEXT, type TEXT)',
+                    ['id', 'key', 'value', 'type'])),
+    ('nodes', ('nodes.csv',
+               '''CREATE TABLE nodes(id INTEGER, lat REAL, lon REAL, user TEXT, uid INTEGER,
+                  version INTEGER, changeset INTEGER, timestamp INTEGER)''',
+               ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp'])),
+    ('ways', ('ways.csv',
+              'CREATE TABLE ways(id INTEGER, user TEXT, uid INTEGER, changeset INTEGER, timestamp INTEGER)',
+              ['id', 'user', 'uid', 'changeset', 'timestamp'])),
+    ('ways_tags', ('ways_tags.csv',
+                   'CREATE TABLE ways_tags(id INTEGER, key TEXT, value TEXT, type TEXT)',
+                   ['id', 'key', 'value', 'type'])),
+    ('ways_nodes', ('ways_nodes.csv',
+                    'CREATE TABLE ways_nodes(id INTEGER, node_id INTEGER, position INTEGER)',
+                    ['id', 'node_id', 'position'])),
+    ('relations', ('relations.csv',
+                   '''CREATE TABLE relations(id INTEGER, user TEXT, uid INTEGER, version INTEGER,
+                      changeset INTEGER, timestamp INTEGER)''',
+                   ['id', 'user', 'uid', 'version', 'changeset', 'timestamp'])),
+    ('relations_tags', ('relations_tags.csv',
+                        'CREATE TABLE relations_tags(id INTEGER, key TEXT, value TEXT, type TEXT)',
+                        ['id', 'key', 'value', 'type'])),
+    ('relations_members', ('relations_members.csv',
+                           '''CREATE TABLE relations_members(id INTEGER, member_type TEXT,
+                              member_id INTEGER, role TEXT, position INTEGER)''',
+                           ['id', 'member_type', 'member_id', 'role', 'position'])),
+])
+TAG_TABLES = {'nodes_tags': 'node', 'ways_tags': 'way', 'relations_tags': 'relation'}
+# csv directories shaped before relations were have none of these files; their tables stay empty
+OPTIONAL_TABLES = frozenset(['relations', 'relations_tags', 'relations_members'])
+
+
+def _element_chunks(rows, size=CHUNK_ROWS):
+    """Lists of about size rows that never split one element's rows"""
+    chunk = []
+    for _, group in itertools.groupby(rows, key=lambda row: row[0]):
+        chunk.extend(group)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert(conn, counts, csv_dir):
+    """Recreate the tables and stream the csv files into them"""
+    for table, (_, create, _) in TABLES.items():
+        conn.execute('DROP TABLE IF EXISTS {0}'.format(table))
+        conn.execute(create)
+    conn.execute('DROP TABLE IF EXISTS tag_search')
+    conn.execute('DROP TABLE IF EXISTS addresses')
+    tag_search.create_table(conn)
+    address_index.create_table(conn)
+
+    for table, (csv_name, _, columns) in TABLES.items():
+        path = os.path.join(csv_dir, csv_name)
+        if table in OPTIONAL_TABLES and not os.path.exists(path):
+            counts[table] = 0
+            continue
+        insert = 'INSERT INTO {0}({1}) VALUES ({2})'.format(
+            table, ', '.join(columns), ', '.join('?' * len(columns)))
+        rows = (tuple(row[c] for c in columns) for row in iter_csv(path))
+        element = TAG_TABLES.get(table)
+        if element is None:
+            counts[table] = conn.executemany(insert, rows).rowcount
+            continue
+        counts[table] = 0
+        for chunk in _element_chunks(rows):
+            conn.executemany(insert, chunk)
+            tag_search.index_tags(conn, element, chunk)
+            address_index.index_addresses(conn, element, chunk)
+            counts[table] += len(chunk)
+    conn.commit()
+
+
+def load(sqlite_file=SQLITE_FILE, csv_dir='.'):
+    """(Re)create the tables and indexes in sqlite_file from the csv files in csv_dir
+
+    Returns {table: rows inserted}.
+    """
+    counts = {}
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        with profiling.profiled('load') as profiler:
+            with profiling.stage(profiler, 'load'):
+                _insert(conn, counts, csv_dir)
+            with profiling.stage(profiler, 'load_indexes'):
+                # timestamps are epoch seconds; index them for time-window queries (see edit_history.py)
+                create_indexes(conn)
+                address_index.create_indexes(conn)
+                relations.create_indexes(conn)
+    finally:
+        conn.close()
+    return counts
@@ -0,0 +1,111 @@
+"""
+Diff two OSM extracts into an osmChange file.
+
+Planet dumps and Geofabrik/Mapzen extracts list nodes, then ways, then
+relations, each sorted by id. Both files are therefore streamed side by side
+and merge-joined on (type, id), like a sorted merge join in a database:
+only the current element of each file is held in memory, whatever the size
+of the extracts.
+
+An element present only in the new file is a create, one present only in the
+old file is a delete, and one present in both is a modify when its version
+or its tag set differs. Changes are written in the order they are found,
+consecutive changes of the same kind sharing a <create>/<modify>/<delete>
+block, which is valid osmChange (0.6):
+
+    python -m osm_wrangling.osm_diff phoenix_arizona_old.osm phoenix_arizona.osm changes.osc
+"""
+from __future__ import print_function
+
+import argparse
+import time
+from xml.sax.saxutils import quoteattr
+
+from .osm_io import iter_top_level, to_xml
+
+TYPES = ('node', 'way', 'relation')
+ACTIONS = ('create', 'modify', 'delete')
+_RANK = {kind: rank for rank, kind in enumerate(TYPES)}
+
+
+def _elements(osm_file):
+    """Yield ((type rank, id), version, tags, elem) in file order, checking the order"""
+    last = None
+    for root, elem in iter_top_level(osm_file):
+        if elem.tag not in _RANK:
+            continue
+        key = (_RANK[elem.tag], int(elem.attrib['id']))
+        if last is not None and key <= last:
+            raise ValueError("{0} is not sorted by type and id: {1} {2} after {3} {4}".format(
+                osm_file, elem.tag, key[1], TYPES[last[0]], last[1]))
+        last = key
+        tags = {tag.attrib['k']: tag.attrib['v'] for tag in elem.iter('tag')}
+        yield key, elem.attrib.get('version'), tags, elem
+
+
+def diff(old_file, new_file):
+    """Yield (action, elem) for every difference between the two extracts
+
+    The element is only valid until the next item is requested.
+    """
+    old, new = _elements(old_file), _elements(new_file)
+    a, b = next(old, None), next(new, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield 'delete', a[3]
+            a = next(old, None)
+        elif a is None or b[0] < a[0]:
+            yield 'create', b[3]
+            b = next(new, None)
+        else:
+            if a[1] != b[1] or a[2] != b[2]:
+                yield 'modify', b[3]
+            else:
+                yield None, b[3]
+            a, b = next(old, None), next(new, None)
+
+
+def write_change(old_file, new_file, change_file):
+    """Write the osmChange for old_file -> new_file; return {action: {type: count}}"""
+    counts = {action: dict.fromkeys(TYPES, 0) for action in ACTIONS + ('unchanged',)}
+    block = None
+    with open(change_file, 'wb') as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        out.write('<osmChange version="0.6" generator={0}>\n'.format(
+            quoteattr('osm_diff.py')).encode('utf-8'))
+        for action, elem in diff(old_file, new_file):
+            if action is None:
+                counts['unchanged'][elem.tag] += 1
+                continue
+            counts[action][elem.tag] += 1
+            if action != block:
+                if block is not None:
+                    out.write('</{0}>\n'.format(block).encode('utf-8'))
+                out.write('<{0}>\n'.format(action).encode('utf-8'))
+                block = action
+            elem.tail = '\n'
+            out.write(b'  ' + to_xml(elem))
+        if block is not None:
+            out.write('</{0}>\n'.format(block).encode('utf-8'))
+        out.write(b'</osmChange>\n')
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('old_file')
+    parser.add_argument('new_file')
+    parser.add_argument('change_file', help='osmChange (.osc) file to write')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    counts = write_change(args.old_file, args.new_file, args.change_file)
+    print('{0:<10} {1:>10} {2:>10} {3:>10}'.format('', *TYPES))
+    for action in ACTIONS + ('unchanged',):
+        print('{0:<10} {1:>10} {2:>10} {3:>10}'.format(
+            action, *[counts[action][kind] for kind in TYPES]))
+    print('Took {0:.1f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Parse-time filters for extracting a subset of an OSM file.
+
+An ElementFilter combines an optional area (a BBox or a Polygon) with tag
+predicates such as "amenity=*", "highway=primary" or
+"highway in (primary, secondary)". Predicates are or-ed together and and-ed
+with the area.
+
+Filtering keeps referential completeness: a way that passes pulls in every
+node it references, even nodes outside the area or without matching tags.
+That needs to know the selected ways before the nodes are written, so the
+filter makes a cheap first pass over the file that only looks at ids,
+coordinates and tags and records the selected node and way ids in
+IdBitmaps. A relation passes when its tags match and, with an area, one of
+its node or way members was selected; its other members are not pulled in,
+as relations in an extract are routinely incomplete. process_map then skips
+every other element before it reaches shape_element:
+
+    element_filter = ElementFilter(area=BBox(33.40, -112.10, 33.50, -111.95),
+                                   tags=['amenity=*'])
+    process_map(OSM_PATH, validate=False, element_filter=element_filter)
+"""
+import re
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from .id_bitmap import IdBitmap
+
+_PREDICATE_RE = re.compile(
+    r'^\s*([^=!\s]+)\s*(?:(=)\s*(.+?)|\s+in\s*\((.*)\))?\s*$')
+
+
+class BBox(object):
+    """Axis aligned lat/lon box"""
+
+    def __init__(self, minlat, minlon, maxlat, maxlon):
+        self.minlat, self.minlon = float(minlat), float(minlon)
+        self.maxlat, self.maxlon = float(maxlat), float(maxlon)
+
+    def contains(self, lat, lon):
+        return self.minlat <= lat <= self.maxlat and self.minlon <= lon <= self.maxlon
+
+
+class Polygon(object):
+    """Simple polygon given as a list of (lat, lon) vertices"""
+
+    def __init__(self, points):
+        self.points = [(float(lat), float(lon)) for lat, lon in points]
+        lats = [p[0] for p in self.points]
+        lons = [p[1] for p in self.points]
+        self.bbox = BBox(min(lats), min(lons), max(lats), max(lons))
+
+    def contains(self, lat, lon):
+        """Even-odd ray casting test, after a cheap bounding box check"""
+        if not self.bbox.contains(lat, lon):
+            return False
+        inside = False
+        points = self.points
+        j = len(points) - 1
+        for i in range(len(points)):
+            lat_i, lon_i = points[i]
+            lat_j, lon_j = points[j]
+            if (lat_i > lat) != (lat_j > lat):
+                cross = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+                if lon < cross:
+                    inside = not inside
+            j = i
+        return inside
+
+
+def parse_tag_predicate(text):
+    """Turn "key", "key=*", "key=value" or "key in (a, b)" into (key, values)
+
+    values is None when any value of the key matches.
+    """
+    m = _PREDICATE_RE.match(text)
+    if m is None:
+        raise ValueError("Cannot parse tag predicate {0!r}".format(text))
+    key, equals, value, choices = m.groups()
+    if equals and value != '*':
+        return key, frozenset([value])
+    if choices is not None:
+        return key, frozenset(v.strip() for v in choices.split(',') if v.strip())
+    return key, None
+
+
+class ElementFilter(object):
+    """Area and tag filter that selects a referentially complete subset"""
+
+    def __init__(self, area=None, tags=()):
+        self.area = area
+        self.predicates = [t if isinstance(t, tuple) else parse_tag_predicate(t)
+                           for t in tags]
+        self.nodes = None
+        self.ways = None
+        self.relations = None
+
+    def matches_tags(self, elem):
+        """True if any tag predicate matches (or there are no predicates)"""
+        if not self.predicates:
+            return True
+        tags = {}
+        for tag in elem.iter('tag'):
+            tags[tag.attrib['k']] = tag.attrib['v']
+        if not tags:
+            return False
+        for key, values in self.predicates:
+            value = tags.get(key)
+            if value is not None and (values is None or value in values):
+                return True
+        return False
+
+    def select(self, osm_file):
+        """First pass: collect the ids to keep and return a keep(elem) callable
+
+        Returns None when the filter is empty, so callers can skip the check.
+        """
+        if self.area is None and not self.predicates:
+            return None
+
+        area = self.area
+        inside = IdBitmap() if area is not None else None
+        nodes = IdBitmap()
+        ways = IdBitmap()
+        relations = IdBitmap()
+
+        context = ET.iterparse(osm_file, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end':
+                continue
+            if elem.tag == 'node':
+                node_id = int(elem.attrib['id'])
+                if area is not None:
+                    if not area.contains(float(elem.attrib['lat']), float(elem.attrib['lon'])):
+                        root.clear()
+                        continue
+                    inside.add(node_id)
+                if self.matches_tags(elem):
+                    nodes.add(node_id)
+                root.clear()
+            elif elem.tag == 'way':
+                refs = [int(nd.attrib['ref']) for nd in elem.iter('nd')]
+                if (inside is None or any(ref in inside for ref in refs)) \
+                        and self.matches_tags(elem):
+                    ways.add(int(elem.attrib['id']))
+                    nodes.update(refs)
+                root.clear()
+            elif elem.tag == 'relation':
+                if self.matches_tags(elem) and (inside is None or any(
+                        int(m.attrib['ref']) in (nodes if m.attrib['type'] == 'node' else ways)
+                        for m in elem.iter('member') if m.attrib['type'] != 'relation')):
+                    relations.add(int(elem.attrib['id']))
+                root.clear()
+
+        self.nodes, self.ways, self.relations = nodes, ways, relations
+        return self.keep
+
+    def keep(self, elem):
+        """Second pass check: True if the element was selected by select()"""
+        if elem.tag == 'node':
+            return int(elem.attrib['id']) in self.nodes
+        if elem.tag == 'way':
+            return int(elem.attrib['id']) in self.ways
+        if elem.tag == 'relation':
+            return int(elem.attrib['id']) in self.relations
+        return False
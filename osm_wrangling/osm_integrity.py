@@ -0,0 +1,142 @@
+"""
+Streaming referential-integrity checks for OSM data.
+
+IntegrityChecker looks at every element as it goes by and reports
+  - ways_nodes references to nodes that were never seen (dangling refs),
+  - node and way ids that appear more than once (duplicates),
+  - ids that are not strictly increasing within their type, and nodes that
+    show up after the first way (ordering violations).
+Seen ids are kept in IdBitmaps, one bit per id, so memory stays small even
+for extracts with 100M+ nodes.
+
+Run it inline with process_map:
+
+    checker = IntegrityChecker()
+    process_map(OSM_PATH, validate=False, integrity_checker=checker)
+    print(checker.summary())
+
+or on its own against a raw file:
+
+    python -m osm_wrangling.osm_integrity phoenix_arizona.osm
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from .id_bitmap import IdBitmap
+
+MAX_SAMPLES = 10
+PROBLEMS = ('dangling_refs', 'duplicate_nodes', 'duplicate_ways',
+            'unordered_nodes', 'unordered_ways', 'nodes_after_ways')
+
+
+class IntegrityChecker(object):
+    """Collect integrity problems with counts and a few samples of each"""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.nodes = IdBitmap()
+        self.ways = IdBitmap()
+        self.counts = dict.fromkeys(PROBLEMS, 0)
+        self.samples = {problem: [] for problem in PROBLEMS}
+        self._last_node = None
+        self._last_way = None
+
+    def _problem(self, problem, sample):
+        self.counts[problem] += 1
+        if len(self.samples[problem]) < self.max_samples:
+            self.samples[problem].append(sample)
+
+    def check_node(self, node_id):
+        if self._last_way is not None:
+            self._problem('nodes_after_ways', node_id)
+        if not self.nodes.add(node_id):
+            self._problem('duplicate_nodes', node_id)
+        if self._last_node is not None and node_id <= self._last_node:
+            self._problem('unordered_nodes', (self._last_node, node_id))
+        self._last_node = node_id
+
+    def check_way(self, way_id, refs):
+        if not self.ways.add(way_id):
+            self._problem('duplicate_ways', way_id)
+        if self._last_way is not None and way_id <= self._last_way:
+            self._problem('unordered_ways', (self._last_way, way_id))
+        self._last_way = way_id
+        nodes = self.nodes
+        for ref in refs:
+            if ref not in nodes:
+                self._problem('dangling_refs', (way_id, ref))
+
+    def check(self, el):
+        """Check one shape_element result"""
+        if 'node' in el:
+            self.check_node(int(el['node']['id']))
+        elif 'way' in el:
+            self.check_way(int(el['way']['id']),
+                           [int(nd['node_id']) for nd in el['way_nodes']])
+
+    def ok(self):
+        return not any(self.counts.values())
+
+    def report(self):
+        """Return {problem: {'count': n, 'samples': [...]}} plus element totals"""
+        result = {problem: {'count': self.counts[problem],
+                            'samples': list(self.samples[problem])}
+                  for problem in PROBLEMS}
+        result['nodes'] = len(self.nodes)
+        result['ways'] = len(self.ways)
+        return result
+
+    def summary(self):
+        lines = ['Checked {0} nodes and {1} ways ({2} KB of id bitmaps)'.format(
+            len(self.nodes), len(self.ways),
+            (self.nodes.memory() + self.ways.memory()) // 1024)]
+        for problem in PROBLEMS:
+            if self.counts[problem]:
+                lines.append('{0}: {1}  e.g. {2}'.format(
+                    problem, self.counts[problem], self.samples[problem][:3]))
+        if self.ok():
+            lines.append('No integrity problems found')
+        return '\n'.join(lines)
+
+
+def check_file(osm_file, checker=None):
+    """Run the checks over a raw OSM file without shaping the elements"""
+    checker = checker or IntegrityChecker()
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event != 'end':
+            continue
+        if elem.tag == 'node':
+            checker.check_node(int(elem.attrib['id']))
+            root.clear()
+        elif elem.tag == 'way':
+            checker.check_way(int(elem.attrib['id']),
+                              [int(nd.attrib['ref']) for nd in elem.iter('nd')])
+            root.clear()
+        elif elem.tag == 'relation':
+            root.clear()
+    return checker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('osm_file')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    checker = check_file(args.osm_file)
+    print(checker.summary())
+    print('Took {0:.1f}s'.format(time.time() - start))
+    return 0 if checker.ok() else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,125 @@
+"""
+Small I/O helpers shared by the tools built on top of the process_map output.
+
+process_map writes utf-8 encoded csv files through UnicodeDictWriter. The
+helpers here read those files back on python 2 and python 3 alike and hand
+out unicode values, pick array typecodes that are wide enough for OSM ids,
+convert OSM timestamps to the epoch seconds stored in the csv files,
+write / memory-map the flat binary arrays the index files are made of and
+stream the top level elements of an .osm file back out as xml.
+"""
+import array
+import calendar
+import csv
+import io
+import mmap
+import sys
+import time
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+PY2 = sys.version_info[0] == 2
+
+# OSM ids no longer fit into 32 bits; 'q' is missing from python 2's array
+# module, where 'l' is 64 bits wide on the platforms we run on.
+try:
+    array.array('q')
+    ID_TYPECODE = 'q'
+except ValueError:
+    ID_TYPECODE = 'l'
+
+
+def open_csv(path, mode='r'):
+    """Open a csv file the way the csv module expects on this python"""
+    if PY2:
+        return open(path, mode + 'b')
+    return io.open(path, mode, newline='', encoding='utf-8')
+
+
+def iter_csv(path):
+    """Yield each row of a process_map csv file as a dict of unicode values"""
+    with open_csv(path) as csv_file:
+        for row in csv.DictReader(csv_file):
+            if PY2:
+                row = {k: v.decode('utf-8') for k, v in row.items()}
+            yield row
+
+
+def id_array(values=()):
+    """Return a compact array of 64 bit integer ids"""
+    return array.array(ID_TYPECODE, values)
+
+
+def iter_top_level(osm_file):
+    """Yield (root, elem) for the root and then each finished top level element
+
+    Every element is cleared from the root once the caller is done with it,
+    so memory stays flat however large the file is.
+    """
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    yield root, root
+    for event, elem in context:
+        if event == 'end' and elem.tag in ('bounds', 'node', 'way', 'relation'):
+            yield root, elem
+            root.clear()
+
+
+def to_xml(elem):
+    """Serialise an element as utf-8, without the xml declaration python 3 adds"""
+    xml = ET.tostring(elem, encoding='utf-8')
+    if xml.startswith(b'<?xml'):
+        xml = xml.split(b'\n', 1)[1]
+    return xml
+
+
+def timestamp_to_epoch(timestamp):
+    """Convert an OSM timestamp ("2013-03-13T15:58:04Z") to integer epoch seconds"""
+    return calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+
+
+def epoch_to_timestamp(epoch):
+    """Inverse of timestamp_to_epoch"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def write_array(f, arr):
+    """Write an array little-endian, padded to a multiple of 8 bytes"""
+    if sys.byteorder == 'big':
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    arr.tofile(f)
+    f.write(b'\0' * (-len(arr) * arr.itemsize % 8))
+
+
+def read_arrays(f, offset, layout):
+    """Return ([arrays], mmap or None) for the (typecode, count) sections written
+    by write_array starting at offset
+
+    On python 3 (little-endian) the sections are zero-copy memoryviews of a
+    read-only mmap, which the caller keeps alive; otherwise they are read into
+    arrays.
+    """
+    if PY2 or sys.byteorder == 'big':
+        f.seek(offset)
+        sections = []
+        for typecode, count in layout:
+            arr = array.array(typecode)
+            arr.fromfile(f, count)
+            f.read(-count * arr.itemsize % 8)
+            if sys.byteorder == 'big':
+                arr.byteswap()
+            sections.append(arr)
+        return sections, None
+    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    sections = []
+    for typecode, count in layout:
+        size = count * array.array(typecode).itemsize
+        sections.append(view[offset:offset + size].cast(typecode))
+        offset += size + (-size % 8)
+    return sections, data
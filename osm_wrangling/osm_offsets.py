@@ -0,0 +1,276 @@
+"""
+Random access into a raw OSM XML file through a byte-offset index.
+
+build() scans the file once and records, for every top level node, way and
+relation, its id, byte offset and byte length. The index is stored as one
+sorted id array plus parallel offset/length arrays per element type, so a
+lookup is a binary search followed by a single seek:
+
+    index = OffsetIndex.build('phoenix_arizona.osm')
+    index.save('phoenix_arizona.osm.idx')
+    index = OffsetIndex.load('phoenix_arizona.osm.idx', 'phoenix_arizona.osm')
+    elem = index.get_raw_element('way', 209809850)
+
+The scan also keeps a file-order checkpoint every CHECKPOINT_EVERY
+elements. partitions() snaps byte ranges to those checkpoints, so parallel
+workers can each parse their own slice with iter_range() without the file
+being scanned again.
+"""
+from __future__ import division, print_function
+
+import argparse
+import array
+import bisect
+import mmap
+import os
+import re
+import struct
+import time
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from . import osm_io
+
+TYPES = ('node', 'way', 'relation')
+CHECKPOINT_EVERY = 1024
+
+_START_TAG = re.compile(br'<(node|way|relation)\s(?:[^>"]|"[^"]*")*?(/?)>')
+_ID_ATTR = re.compile(br'\sid="(-?\d+)"')
+_MAGIC = b'OSMX'
+_VERSION = 2
+_HEADER = struct.Struct('<4sHQQI')  # magic, version, file size, data end, checkpoints
+_COUNTS = struct.Struct('<3Q')  # nodes, ways, relations
+
+
+class OffsetIndex(object):
+    """Sorted (id -> offset, length) arrays for each OSM element type"""
+
+    def __init__(self, ids, offsets, lengths, checkpoints, file_size, data_end,
+                 osm_file=None, owner=None):
+        self.ids = ids              # type -> sorted id array
+        self.offsets = offsets      # type -> offset array, parallel to ids
+        self.lengths = lengths      # type -> length array, parallel to ids
+        self.checkpoints = checkpoints
+        self.file_size = file_size
+        self.data_end = data_end
+        self.osm_file = osm_file
+        self._owner = owner  # keeps the mmap alive for loaded indexes
+
+    # ================================================== #
+    #               Building and Storage                 #
+    # ================================================== #
+    @classmethod
+    def build(cls, osm_file):
+        """Scan osm_file once and index every top level element"""
+        ids = {t: osm_io.id_array() for t in TYPES}
+        offsets = {t: osm_io.id_array() for t in TYPES}
+        lengths = {t: array.array('I') for t in TYPES}
+        checkpoints = osm_io.id_array()
+        data_end = 0
+        count = 0
+        with open(osm_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:  # mmap refuses empty files
+                return cls(ids, offsets, lengths, checkpoints, 0, 0, osm_file)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                file_size = len(data)
+                pos = 0
+                while True:
+                    m = _START_TAG.search(data, pos)
+                    if m is None:
+                        break
+                    kind = m.group(1).decode('ascii')
+                    start = m.start()
+                    element_id = int(_ID_ATTR.search(m.group(0)).group(1))
+                    if m.group(2):
+                        end = m.end()
+                    else:
+                        close = b'</' + m.group(1) + b'>'
+                        end = data.find(close, m.end())
+                        if end < 0:
+                            raise ValueError("{0}: {1} {2} at byte {3} is never closed".format(
+                                osm_file, kind, element_id, start))
+                        end += len(close)
+                    if count % CHECKPOINT_EVERY == 0:
+                        checkpoints.append(start)
+                    ids[kind].append(element_id)
+                    offsets[kind].append(start)
+                    lengths[kind].append(end - start)
+                    data_end = pos = end
+                    count += 1
+            finally:
+                data.close()
+        for kind in TYPES:
+            cls._sort_by_id(ids, offsets, lengths, kind)
+        return cls(ids, offsets, lengths, checkpoints, file_size, data_end, osm_file)
+
+    @staticmethod
+    def _sort_by_id(ids, offsets, lengths, kind):
+        """OSM dumps are id-sorted already; only sort when they are not"""
+        arr = ids[kind]
+        if all(arr[i] < arr[i + 1] for i in range(len(arr) - 1)):
+            return
+        order = sorted(range(len(arr)), key=arr.__getitem__)
+        ids[kind] = osm_io.id_array(arr[i] for i in order)
+        offsets[kind] = osm_io.id_array(offsets[kind][i] for i in order)
+        lengths[kind] = array.array('I', (lengths[kind][i] for i in order))
+
+    def _sections(self):
+        sections = [self.checkpoints]
+        for kind in TYPES:
+            sections += [self.ids[kind], self.offsets[kind], self.lengths[kind]]
+        return sections
+
+    def save(self, path):
+        """Write the arrays little-endian, each section padded to 8 bytes"""
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self.file_size, self.data_end,
+                                 len(self.checkpoints)))
+            f.write(_COUNTS.pack(*(len(self.ids[t]) for t in TYPES)))
+            f.write(b'\0' * (-(_HEADER.size + _COUNTS.size) % 8))
+            for arr in self._sections():
+                osm_io.write_array(f, arr)
+
+    @classmethod
+    def load(cls, path, osm_file=None):
+        """Memory-map a saved index (python 3) or read it into arrays (python 2)"""
+        with open(path, 'rb') as f:
+            magic, version, file_size, data_end, n_checkpoints = _HEADER.unpack(
+                f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("{0} is not an OSM offset index".format(path))
+            counts = _COUNTS.unpack(f.read(_COUNTS.size))
+            layout = [(osm_io.ID_TYPECODE, n_checkpoints)]
+            for n in counts:
+                layout += [(osm_io.ID_TYPECODE, n), (osm_io.ID_TYPECODE, n), ('I', n)]
+            size = _HEADER.size + _COUNTS.size
+            sections, data = osm_io.read_arrays(f, size + (-size % 8), layout)
+        ids, offsets, lengths = {}, {}, {}
+        for i, kind in enumerate(TYPES):
+            ids[kind], offsets[kind], lengths[kind] = sections[1 + 3 * i:4 + 3 * i]
+        return cls(ids, offsets, lengths, sections[0], file_size, data_end, osm_file,
+                   owner=data)
+
+    # ================================================== #
+    #               Lookups                              #
+    # ================================================== #
+    def locate(self, kind, element_id):
+        """Return (offset, length) of an element, or None if it is not indexed"""
+        ids = self.ids[kind]
+        i = bisect.bisect_left(ids, element_id)
+        if i == len(ids) or ids[i] != element_id:
+            return None
+        return self.offsets[kind][i], self.lengths[kind][i]
+
+    def get_raw_bytes(self, kind, element_id):
+        """Return the raw XML of an element as bytes, or None"""
+        location = self.locate(kind, element_id)
+        if location is None:
+            return None
+        with open(self.osm_file, 'rb') as f:
+            f.seek(location[0])
+            return f.read(location[1])
+
+    def get_raw_element(self, kind, element_id):
+        """Seek to an element and parse just that element"""
+        raw = self.get_raw_bytes(kind, element_id)
+        return ET.fromstring(raw) if raw is not None else None
+
+    # ================================================== #
+    #               Partitioning                         #
+    # ================================================== #
+    def partitions(self, n):
+        """Split the element data into n byte ranges on element boundaries"""
+        if not self.checkpoints:
+            return []
+        first, last = self.checkpoints[0], self.data_end
+        bounds = [first]
+        for i in range(1, n):
+            target = first + (last - first) * i // n
+            j = bisect.bisect_left(self.checkpoints, target)
+            if j < len(self.checkpoints) and self.checkpoints[j] > bounds[-1]:
+                bounds.append(self.checkpoints[j])
+        bounds.append(last)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def iter_range(self, start, end, tags=TYPES):
+        """Yield the top level elements inside one partitions() byte range"""
+        return iter_range(self.osm_file, start, end, tags)
+
+
+def iter_range(osm_file, start, end, tags=TYPES):
+    """iter_range without the index, for workers that were only handed a range"""
+    with open(osm_file, 'rb') as f:
+        f.seek(start)
+        context = ET.iterparse(_RangeReader(f, end - start), events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in tags:
+                yield elem
+                root.clear()
+
+
+class _RangeReader(object):
+    """File-like view of a byte range, wrapped in an <osm> root element"""
+
+    def __init__(self, f, length):
+        self._f = f
+        self._left = length
+        self._pending = [b'<osm>']
+        self._closed = False
+
+    def read(self, size=65536):
+        if self._pending:
+            return self._pending.pop()
+        if self._left > 0:
+            chunk = self._f.read(min(size, self._left))
+            self._left -= len(chunk)
+            if chunk:
+                return chunk
+            self._left = 0
+        if not self._closed:
+            self._closed = True
+            return b'</osm>'
+        return b''
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('osm_file')
+    parser.add_argument('--index', help='index path (default: <osm_file>.idx)')
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('build', help='scan the file and write the index')
+    get = sub.add_parser('get', help='print the raw XML of one element')
+    get.add_argument('type', choices=TYPES)
+    get.add_argument('id', type=int)
+    parts = sub.add_parser('partitions', help='print byte ranges for parallel workers')
+    parts.add_argument('n', type=int)
+    args = parser.parse_args(argv)
+    index_path = args.index or args.osm_file + '.idx'
+
+    if args.command == 'build':
+        start = time.time()
+        index = OffsetIndex.build(args.osm_file)
+        index.save(index_path)
+        print('Indexed', ', '.join('{0} {1}s'.format(len(index.ids[t]), t) for t in TYPES),
+              'in {0:.1f}s'.format(time.time() - start))
+        return 0
+
+    index = OffsetIndex.load(index_path, args.osm_file)
+    if args.command == 'get':
+        raw = index.get_raw_bytes(args.type, args.id)
+        if raw is None:
+            print('{0} {1} not found'.format(args.type, args.id))
+            return 1
+        print(raw.decode('utf-8'))
+    elif args.command == 'partitions':
+        for start, end in index.partitions(args.n):
+            print(start, end)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,120 @@
+"""
+Write a small, referentially consistent sample of an OSM file.
+
+Taking every k-th element of the file breaks way -> node references, so the
+sampler picks ways first (every k-th way, or a fraction chosen by a hash of
+the way id) and then keeps every node those ways reference, tracked in an
+IdBitmap. Nodes that are sampled on their own (same rule, applied to the
+node id) are kept as well so that standalone POIs stay represented.
+Relations are kept only when all of their members made it into the sample.
+
+OSM files list all nodes before the ways, so the way selection is made in a
+first, read-only pass and the sample is written in a second one.
+
+    python -m osm_wrangling.osm_sample phoenix_arizona.osm sample.osm --fraction 0.01
+"""
+from __future__ import division, print_function
+
+import argparse
+import time
+from xml.sax.saxutils import quoteattr
+
+from .id_bitmap import IdBitmap
+from .osm_io import iter_top_level, to_xml
+
+_HASH_MULTIPLIER = 2654435761  # Knuth's multiplicative hash
+_HASH_RANGE = 1 << 32
+
+
+def hash_sampled(element_id, fraction):
+    """True if element_id falls into the sampled fraction of the id space"""
+    return (element_id * _HASH_MULTIPLIER) % _HASH_RANGE < fraction * _HASH_RANGE
+
+
+def _picked(element_id, position, every, fraction):
+    if every is not None:
+        return position % every == 0
+    return hash_sampled(element_id, fraction)
+
+
+def select_ways(osm_file, every=None, fraction=None):
+    """First pass: return IdBitmaps of the sampled ways and the nodes they use"""
+    nodes = IdBitmap()
+    ways = IdBitmap()
+    position = 0
+    for _, elem in iter_top_level(osm_file):
+        if elem.tag == 'way':
+            way_id = int(elem.attrib['id'])
+            if _picked(way_id, position, every, fraction):
+                ways.add(way_id)
+                for nd in elem.iter('nd'):
+                    nodes.add(int(nd.attrib['ref']))
+            position += 1
+    return nodes, ways
+
+
+def _members_kept(relation, nodes, ways):
+    for member in relation.iter('member'):
+        kind, ref = member.attrib['type'], int(member.attrib['ref'])
+        if kind == 'node' and ref not in nodes:
+            return False
+        if kind == 'way' and ref not in ways:
+            return False
+        if kind == 'relation':
+            return False
+    return True
+
+
+def sample(osm_in, osm_out, every=None, fraction=None):
+    """Write the sample of osm_in to osm_out; return element counts"""
+    if (every is None) == (fraction is None):
+        raise ValueError("Pass exactly one of every or fraction")
+    nodes, ways = select_ways(osm_in, every, fraction)
+    counts = {'node': 0, 'way': 0, 'relation': 0}
+    position = 0
+    with open(osm_out, 'wb') as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        for root, elem in iter_top_level(osm_in):
+            if elem is root:
+                attrs = ''.join(' {0}={1}'.format(k, quoteattr(v)) for k, v in sorted(root.attrib.items()))
+                out.write('<osm{0}>\n'.format(attrs).encode('utf-8'))
+                continue
+            if elem.tag == 'node':
+                node_id = int(elem.attrib['id'])
+                keep = node_id in nodes
+                if not keep and _picked(node_id, position, every, fraction):
+                    nodes.add(node_id)
+                    keep = True
+                position += 1
+            elif elem.tag == 'way':
+                keep = int(elem.attrib['id']) in ways
+            elif elem.tag == 'relation':
+                keep = _members_kept(elem, nodes, ways)
+            else:
+                keep = True
+            if keep:
+                elem.tail = '\n'
+                out.write(b' ' + to_xml(elem))
+                if elem.tag in counts:
+                    counts[elem.tag] += 1
+        out.write(b'</osm>\n')
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('osm_in')
+    parser.add_argument('osm_out')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-k', '--every', type=int, help='keep every k-th way')
+    group.add_argument('--fraction', type=float, help='keep this fraction of ways, by id hash')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    counts = sample(args.osm_in, args.osm_out, args.every, args.fraction)
+    print('Wrote {node} nodes, {way} ways, {relation} relations'.format(**counts),
+          'in {0:.1f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""
+Fixed-memory streaming statistics over an OSM extract.
+
+StreamStats answers "how many unique users" and "who are the top
+contributors / most used tag keys and values" in the same pass that parses
+the file, without keeping the full users set and without loading SQLite:
+
+  - HyperLogLog      distinct uids, relative error ~ 1.04 / sqrt(registers)
+  - SpaceSaving      top users, tag keys and tag values; every reported count
+                     is at most N * error too high
+  - CountMin         point estimates of edits per user, never too low, too
+                     high by at most N * error with probability 1 - delta
+
+All sketches are mergeable, so chunks parsed in parallel (see
+osm_offsets.OffsetIndex.partitions) can be combined into one report.
+
+    python -m osm_wrangling.osm_sketches phoenix_arizona.osm --error 0.01 --top 10 --workers 4
+
+StreamStats can also ride along with process_map:
+
+    stats = StreamStats()
+    process_map(OSM_PATH, validate=False, stream_stats=stats)
+    pprint.pprint(stats.report())
+"""
+from __future__ import division, print_function
+
+import argparse
+import hashlib
+import heapq
+import math
+import pprint
+import struct
+import time
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from . import osm_io
+
+DEFAULT_ERROR = 0.01
+DEFAULT_DELTA = 0.01
+_MASK64 = (1 << 64) - 1
+
+
+def _hash64(value):
+    """Stable 64 bit hash: splitmix64 for ints, md5 for strings"""
+    if isinstance(value, int):
+        x = (value + 0x9E3779B97F4A7C15) & _MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return x ^ (x >> 31)
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return struct.unpack('<Q', hashlib.md5(value).digest()[:8])[0]
+
+
+class HyperLogLog(object):
+    """Distinct count estimate in 2**p one-byte registers"""
+
+    def __init__(self, error=DEFAULT_ERROR):
+        self.p = min(max(int(math.ceil(math.log((1.04 / error) ** 2, 2))), 4), 18)
+        self.m = 1 << self.p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        h = _hash64(value)
+        index = h & (self.m - 1)
+        rank = 64 - self.p - (h >> self.p).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(b"\x00")
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # linear counting for small cardinalities
+        return raw
+
+
+class SpaceSaving(object):
+    """Top-k heavy hitters in a fixed number of counters"""
+
+    def __init__(self, error=DEFAULT_ERROR):
+        self.capacity = int(math.ceil(1 / error))
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        self._heap = []
+
+    def add(self, item, count=1):
+        counts = self.counts
+        self.total += count
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+        else:
+            victim, floor = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[item] = floor + count
+            self.errors[item] = floor
+        heapq.heappush(self._heap, (counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heapify()
+
+    def _heapify(self):
+        self._heap = [(c, item) for item, c in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        """Pop the item with the smallest count, skipping stale heap entries"""
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def _floor(self):
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other):
+        floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, floor) + other.counts.get(item, other_floor)
+            errors[item] = (self.errors.get(item, floor) +
+                            other.errors.get(item, other_floor))
+        keep = heapq.nlargest(self.capacity, counts, key=counts.get)
+        self.counts = {item: counts[item] for item in keep}
+        self.errors = {item: errors[item] for item in keep}
+        self.total += other.total
+        self._heapify()
+
+    def top(self, n=10):
+        """Return [(item, count, max_overcount)] for the n largest counts"""
+        items = heapq.nlargest(n, self.counts, key=self.counts.get)
+        return [(item, self.counts[item], self.errors[item]) for item in items]
+
+
+class CountMin(object):
+    """Frequency estimates that never undercount"""
+
+    def __init__(self, error=DEFAULT_ERROR, delta=DEFAULT_DELTA):
+        self.width = int(math.ceil(math.e / error))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.rows = [osm_io.id_array([0] * self.width) for _ in range(self.depth)]
+        self.total = 0
+
+    def _cells(self, item):
+        h = _hash64(item)
+        h1, h2 = h & 0xFFFFFFFF, h >> 32
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, count=1):
+        self.total += count
+        for row, cell in zip(self.rows, self._cells(item)):
+            row[cell] += count
+
+    def estimate(self, item):
+        return min(row[cell] for row, cell in zip(self.rows, self._cells(item)))
+
+    def overcount(self):
+        """Bound on how far any estimate is too high, with probability 1 - delta"""
+        return int(math.ceil(self.total * math.e / self.width))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge CountMin sketches of different shape")
+        for row, other_row in zip(self.rows, other.rows):
+            for i, value in enumerate(other_row):
+                if value:
+                    row[i] += value
+        self.total += other.total
+
+
+class StreamStats(object):
+    """The sketches behind the user and tag reports, fed one element at a time"""
+
+    def __init__(self, error=DEFAULT_ERROR, delta=DEFAULT_DELTA):
+        self.error = error
+        self.uids = HyperLogLog(error)
+        self.users = SpaceSaving(error)
+        self.user_edits = CountMin(error, delta)
+        self.tag_keys = SpaceSaving(error)
+        self.tag_values = SpaceSaving(error)
+        self.elements = {'node': 0, 'way': 0, 'relation': 0}
+
+    def _add(self, kind, uid, user, tags):
+        self.elements[kind] += 1
+        if uid is not None:
+            self.uids.add(int(uid))
+        if user is not None:
+            self.users.add(user)
+            self.user_edits.add(user)
+        for key, value in tags:
+            self.tag_keys.add(key)
+            self.tag_values.add(value)
+
+    def add_element(self, elem):
+        """Feed one raw node/way/relation element"""
+        self._add(elem.tag, elem.attrib.get('uid'), elem.attrib.get('user'),
+                  [(t.attrib['k'], t.attrib['v']) for t in elem.iter('tag')])
+
+    def add_shaped(self, el):
+        """Feed one shape_element result"""
+        kind = 'node' if 'node' in el else 'way' if 'way' in el else 'relation'
+        attribs = el[kind]
+        tags = [(t['key'] if t['type'] == 'regular' else t['type'] + ':' + t['key'], t['value'])
+                for t in el[kind + '_tags']]
+        self._add(kind, attribs.get('uid'), attribs.get('user'), tags)
+
+    def merge(self, other):
+        self.uids.merge(other.uids)
+        self.users.merge(other.users)
+        self.user_edits.merge(other.user_edits)
+        self.tag_keys.merge(other.tag_keys)
+        self.tag_values.merge(other.tag_values)
+        for kind, n in other.elements.items():
+            self.elements[kind] += n
+        return self
+
+    def report(self, top=10):
+        """Sketch estimates; top_user_edits cross-checks top_users with CountMin"""
+        top_users = self.users.top(top)
+        return {
+            'elements': dict(self.elements),
+            'unique_users': int(round(self.uids.estimate())),
+            'unique_users_error': self.uids.error(),
+            'top_users': top_users,
+            'top_user_edits': [(user, self.user_edits.estimate(user))
+                               for user, _, _ in top_users],
+            'top_user_edits_error': self.user_edits.overcount(),
+            'top_tag_keys': self.tag_keys.top(top),
+            'top_tag_values': self.tag_values.top(top),
+        }
+
+
+# ================================================== #
+#               Collecting                           #
+# ================================================== #
+def collect(osm_file, error=DEFAULT_ERROR, tags=('node', 'way', 'relation')):
+    """One pass over osm_file; returns the filled StreamStats"""
+    stats = StreamStats(error)
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            stats.add_element(elem)
+            root.clear()
+    return stats
+
+
+def _collect_range(args):
+    osm_file, start, end, error = args
+    from .osm_offsets import iter_range
+    stats = StreamStats(error)
+    for elem in iter_range(osm_file, start, end):
+        stats.add_element(elem)
+    return stats
+
+
+def collect_parallel(osm_file, index_path, workers, error=DEFAULT_ERROR):
+    """Collect per byte range on a process pool and merge the sketches"""
+    import multiprocessing
+    from .osm_offsets import OffsetIndex
+    index = OffsetIndex.load(index_path, osm_file)
+    jobs = [(osm_file, start, end, error)
+            for start, end in index.partitions(workers)]
+    if not jobs:  # no elements in the file
+        return StreamStats(error)
+    pool = multiprocessing.Pool(min(max(1, workers), len(jobs)))
+    try:
+        parts = pool.map(_collect_range, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    stats = parts[0]
+    for part in parts[1:]:
+        stats.merge(part)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('osm_file')
+    parser.add_argument('--error', type=float, default=DEFAULT_ERROR)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--index', help='osm_offsets index (default: <osm_file>.idx)')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.workers > 1:
+        stats = collect_parallel(args.osm_file, args.index or args.osm_file + '.idx',
+                                 args.workers, args.error)
+    else:
+        stats = collect(args.osm_file, args.error)
+    pprint.pprint(stats.report(args.top))
+    print('Took {0:.1f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
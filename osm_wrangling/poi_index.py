@@ -0,0 +1,369 @@
+"""
+In-memory nearest-neighbour index over tagged POI nodes.
+
+Nodes carrying a POI key ("amenity" by default) are grouped by tag value and
+each group is placed on its own uniform lat/lon grid, sized so that a cell
+holds a handful of points. A kNN query visits the cells ring by ring around
+the query point and stops as soon as no unvisited ring can hold anything
+closer than the k-th best hit, so a lookup only touches a few cells no matter
+how large the extract is. Distances are great-circle distances in metres.
+
+The index is built from the shaped node / node_tags records produced by
+shape_element (or the nodes.csv / nodes_tags.csv files written by
+process_map) and can be saved to a compact binary file for a fast cold start:
+
+    index = POIIndex.from_csv('nodes.csv', 'nodes_tags.csv')
+    index.save('amenity.poi')
+    index = POIIndex.load('amenity.poi')
+    index.nearest('pharmacy', 33.4484, -112.0740, k=5)
+"""
+from __future__ import division, print_function
+
+import argparse
+import array
+import heapq
+import math
+import random
+import struct
+import sys
+import time
+
+from . import osm_io
+
+EARTH_RADIUS = 6371008.8  # mean earth radius in metres
+POI_KEY = 'amenity'
+POINTS_PER_CELL = 4
+MIN_CELL_SIZE = 0.0005  # degrees, roughly 50m
+
+_MAGIC = b'POIX'
+_VERSION = 1
+_FILE_HEADER = struct.Struct('<4sHIH')   # magic, version, groups, key length
+_GROUP_HEADER = struct.Struct('<HdII')   # name length, cell size, points, cells
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres between two lat/lon points"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlam = math.radians(lon2 - lon1)
+    a = (math.sin(dphi / 2) ** 2 +
+         math.cos(phi1) * math.cos(phi2) * math.sin(dlam / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def full_key(tag):
+    """Rebuild the original "k" attribute from a shaped tag dict"""
+    if tag['type'] == 'regular':
+        return tag['key']
+    return tag['type'] + ':' + tag['key']
+
+
+def _cell_size(lats, lons):
+    """Pick a grid cell size that puts about POINTS_PER_CELL points in a cell"""
+    area = (max(lats) - min(lats)) * (max(lons) - min(lons))
+    if area <= 0:
+        return 1.0
+    return max(math.sqrt(area * POINTS_PER_CELL / len(lats)), MIN_CELL_SIZE)
+
+
+def _ring(row, col, radius):
+    """Yield the grid cells at Chebyshev distance radius from (row, col)"""
+    if radius == 0:
+        yield row, col
+        return
+    for c in range(col - radius, col + radius + 1):
+        yield row - radius, c
+        yield row + radius, c
+    for r in range(row - radius + 1, row + radius):
+        yield r, col - radius
+        yield r, col + radius
+
+
+class _Group(object):
+    """Points sharing one tag value, stored cell by cell in flat arrays"""
+
+    __slots__ = ('cell_size', 'ids', 'lats', 'lons', 'cells',
+                 'min_row', 'max_row', 'min_col', 'max_col')
+
+    def __init__(self, cell_size, ids, lats, lons, cells):
+        self.cell_size = cell_size
+        self.ids = ids
+        self.lats = lats
+        self.lons = lons
+        self.cells = cells  # (row, col) -> (start, stop) into the arrays
+        rows = [r for r, _ in cells] or [0]
+        cols = [c for _, c in cells] or [0]
+        self.min_row, self.max_row = min(rows), max(rows)
+        self.min_col, self.max_col = min(cols), max(cols)
+
+    @classmethod
+    def build(cls, points):
+        """Build a group from a list of (id, lat, lon) tuples"""
+        lats = [p[1] for p in points]
+        lons = [p[2] for p in points]
+        size = _cell_size(lats, lons)
+        keyed = sorted(
+            ((int(math.floor(lat / size)), int(math.floor(lon / size))), node_id, lat, lon)
+            for node_id, lat, lon in points
+        )
+        ids = osm_io.id_array(p[1] for p in keyed)
+        lats = array.array('d', (p[2] for p in keyed))
+        lons = array.array('d', (p[3] for p in keyed))
+        cells = {}
+        for i, p in enumerate(keyed):
+            start, _ = cells.get(p[0], (i, i))
+            cells[p[0]] = (start, i + 1)
+        return cls(size, ids, lats, lons, cells)
+
+    def cell_of(self, lat, lon):
+        return (int(math.floor(lat / self.cell_size)),
+                int(math.floor(lon / self.cell_size)))
+
+    def nearest(self, lat, lon, k):
+        row, col = self.cell_of(lat, lon)
+        last_ring = max(abs(row - self.min_row), abs(row - self.max_row),
+                        abs(col - self.min_col), abs(col - self.max_col))
+        cells, lats, lons = self.cells, self.lats, self.lons
+        best = []  # max-heap of (-distance, position), at most k long
+        for radius in range(last_ring + 1):
+            for cell in _ring(row, col, radius):
+                span = cells.get(cell)
+                if span is None:
+                    continue
+                for i in range(span[0], span[1]):
+                    d = haversine(lat, lon, lats[i], lons[i])
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, i))
+            if len(best) == k and -best[0][0] <= self._ring_bound(lat, radius):
+                break
+        return sorted((-d, i) for d, i in best)
+
+    def within(self, lat, lon, radius):
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        coslat = math.cos(math.radians(min(abs(lat) + dlat, 89.9)))
+        dlon = dlat / coslat
+        row0, col0 = self.cell_of(lat - dlat, lon - dlon)
+        row1, col1 = self.cell_of(lat + dlat, lon + dlon)
+        row0, row1 = max(row0, self.min_row), min(row1, self.max_row)
+        col0, col1 = max(col0, self.min_col), min(col1, self.max_col)
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > len(self.cells):
+            spans = [span for (r, c), span in self.cells.items()
+                     if row0 <= r <= row1 and col0 <= c <= col1]
+        else:
+            spans = [self.cells[(r, c)]
+                     for r in range(row0, row1 + 1)
+                     for c in range(col0, col1 + 1)
+                     if (r, c) in self.cells]
+        hits = []
+        for start, stop in spans:
+            for i in range(start, stop):
+                d = haversine(lat, lon, self.lats[i], self.lons[i])
+                if d <= radius:
+                    hits.append((d, i))
+        hits.sort()
+        return hits
+
+    def _ring_bound(self, lat, radius):
+        """Smallest distance from the query to any cell outside the ring"""
+        far_lat = min(abs(lat) + (radius + 1) * self.cell_size, 90.0)
+        return (EARTH_RADIUS * math.radians(radius * self.cell_size) *
+                math.cos(math.radians(far_lat)))
+
+
+class POIIndex(object):
+    """Nearest-neighbour and radius lookups over POI nodes grouped by tag value"""
+
+    def __init__(self, groups, key=POI_KEY):
+        self.key = key
+        self.groups = groups
+
+    # ================================================== #
+    #               Building                             #
+    # ================================================== #
+    @classmethod
+    def from_shaped(cls, elements, key=POI_KEY):
+        """Build the index in one pass over shape_element output"""
+        points = {}
+        for el in elements:
+            if 'node' not in el:
+                continue
+            for tag in el['node_tags']:
+                if full_key(tag) == key:
+                    node = el['node']
+                    points.setdefault(tag['value'], []).append(
+                        (int(node['id']), float(node['lat']), float(node['lon'])))
+                    break
+        return cls._from_points(points, key)
+
+    @classmethod
+    def from_records(cls, nodes, node_tags, key=POI_KEY):
+        """Build the index from separate node and node_tags record streams"""
+        values = {}
+        for tag in node_tags:
+            if full_key(tag) == key:
+                values.setdefault(int(tag['id']), tag['value'])
+        points = {}
+        for node in nodes:
+            value = values.get(int(node['id']))
+            if value is not None:
+                points.setdefault(value, []).append(
+                    (int(node['id']), float(node['lat']), float(node['lon'])))
+        return cls._from_points(points, key)
+
+    @classmethod
+    def from_csv(cls, nodes_path, node_tags_path, key=POI_KEY):
+        """Build the index from the nodes / nodes_tags csv files"""
+        return cls.from_records(osm_io.iter_csv(nodes_path),
+                                osm_io.iter_csv(node_tags_path), key)
+
+    @classmethod
+    def _from_points(cls, points, key):
+        return cls({value: _Group.build(pts) for value, pts in points.items()}, key)
+
+    # ================================================== #
+    #               Queries                              #
+    # ================================================== #
+    def values(self):
+        """Sorted list of indexed tag values"""
+        return sorted(self.groups)
+
+    def count(self, value):
+        group = self.groups.get(value)
+        return len(group.ids) if group else 0
+
+    def nearest(self, value, lat, lon, k=5):
+        """Return the k closest nodes as (distance_m, id, lat, lon), closest first"""
+        group = self.groups.get(value)
+        if group is None or k <= 0:
+            return []
+        return [(d, group.ids[i], group.lats[i], group.lons[i])
+                for d, i in group.nearest(lat, lon, k)]
+
+    def within(self, value, lat, lon, radius):
+        """Return all nodes within radius metres as (distance_m, id, lat, lon)"""
+        group = self.groups.get(value)
+        if group is None:
+            return []
+        return [(d, group.ids[i], group.lats[i], group.lons[i])
+                for d, i in group.within(lat, lon, radius)]
+
+    def nearest_batch(self, value, points, k=5):
+        """Run nearest() for every (lat, lon) in points"""
+        return [self.nearest(value, lat, lon, k) for lat, lon in points]
+
+    def within_batch(self, value, points, radius):
+        """Run within() for every (lat, lon) in points"""
+        return [self.within(value, lat, lon, radius) for lat, lon in points]
+
+    # ================================================== #
+    #               Binary Format                        #
+    # ================================================== #
+    def save(self, path):
+        """Write the index to a compact little-endian binary file"""
+        key = self.key.encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(_FILE_HEADER.pack(_MAGIC, _VERSION, len(self.groups), len(key)))
+            f.write(key)
+            for value in self.values():
+                group = self.groups[value]
+                name = value.encode('utf-8')
+                cells = sorted(group.cells.items())
+                f.write(_GROUP_HEADER.pack(len(name), group.cell_size,
+                                           len(group.ids), len(cells)))
+                f.write(name)
+                for arr in (osm_io.id_array(group.ids), group.lats, group.lons,
+                            array.array('i', (c[0][0] for c in cells)),
+                            array.array('i', (c[0][1] for c in cells)),
+                            array.array('I', (c[1][0] for c in cells)),
+                            array.array('I', (c[1][1] for c in cells))):
+                    if sys.byteorder == 'big':
+                        arr = array.array(arr.typecode, arr)
+                        arr.byteswap()
+                    arr.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()"""
+        with open(path, 'rb') as f:
+            magic, version, n_groups, key_len = _FILE_HEADER.unpack(
+                f.read(_FILE_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("{0} is not a POI index file".format(path))
+            key = f.read(key_len).decode('utf-8')
+            groups = {}
+            for _ in range(n_groups):
+                name_len, size, n_points, n_cells = _GROUP_HEADER.unpack(
+                    f.read(_GROUP_HEADER.size))
+                name = f.read(name_len).decode('utf-8')
+                arrays = []
+                for typecode, n in ((osm_io.ID_TYPECODE, n_points), ('d', n_points),
+                                    ('d', n_points), ('i', n_cells), ('i', n_cells),
+                                    ('I', n_cells), ('I', n_cells)):
+                    arr = array.array(typecode)
+                    arr.fromfile(f, n)
+                    if sys.byteorder == 'big':
+                        arr.byteswap()
+                    arrays.append(arr)
+                ids, lats, lons, rows, cols, starts, stops = arrays
+                cells = {(rows[i], cols[i]): (starts[i], stops[i]) for i in range(n_cells)}
+                groups[name] = _Group(size, ids, lats, lons, cells)
+        return cls(groups, key)
+
+
+# ================================================== #
+#               Benchmark                            #
+# ================================================== #
+def benchmark(index, values=None, queries=10000, k=5, radius=1000, seed=0):
+    """Time kNN and radius lookups at random points inside each group's bbox"""
+    rng = random.Random(seed)
+    results = []
+    for value in values or index.values():
+        group = index.groups[value]
+        lat0, lat1 = min(group.lats), max(group.lats)
+        lon0, lon1 = min(group.lons), max(group.lons)
+        points = [(rng.uniform(lat0, lat1), rng.uniform(lon0, lon1))
+                  for _ in range(queries)]
+        start = time.time()
+        index.nearest_batch(value, points, k)
+        knn = time.time() - start
+        start = time.time()
+        index.within_batch(value, points, radius)
+        rad = time.time() - start
+        results.append({'value': value, 'points': len(group.ids),
+                        'knn_us': knn / queries * 1e6,
+                        'radius_us': rad / queries * 1e6})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', default='nodes.csv')
+    parser.add_argument('--node-tags', default='nodes_tags.csv')
+    parser.add_argument('--key', default=POI_KEY)
+    parser.add_argument('--out', default=None, help='write the binary index here')
+    parser.add_argument('--index', default=None, help='load a saved index instead')
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--radius', type=float, default=1000)
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.index:
+        index = POIIndex.load(args.index)
+        print('Loaded {0} in {1:.3f}s'.format(args.index, time.time() - start))
+    else:
+        index = POIIndex.from_csv(args.nodes, args.node_tags, args.key)
+        print('Built index in {0:.3f}s'.format(time.time() - start))
+    if args.out:
+        index.save(args.out)
+
+    for row in benchmark(index, queries=args.queries, k=args.k, radius=args.radius):
+        print('{value:<24} {points:>8} pts  knn {knn_us:8.1f} us/query  '
+              'radius {radius_us:8.1f} us/query'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
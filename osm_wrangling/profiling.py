@@ -0,0 +1,256 @@
+"""
+Opt-in profiling of the ingest stages, without editing the code.
+
+Set OSM_PROFILE (or pass --profile to python -m osm_wrangling) to a comma
+separated list of modes:
+
+    cprofile      deterministic cProfile, one profile per stage
+    tracemalloc   top allocations every OSM_PROFILE_EVERY elements (python 3)
+    sample        low-overhead stack sampling every OSM_PROFILE_INTERVAL
+                  seconds, written as folded stacks for flamegraph tools
+
+process_map and load time their stages - get_element, shape_element,
+validate_element, write, load and load_indexes - and switch the per-stage
+cProfile on and off around them. With profiling off they run exactly as
+before. Every run writes into its own directory under OSM_PROFILE_DIR
+(default: profiles):
+
+    profiles/shape-20240101-120000-4242/
+        stages.json                    seconds and calls per stage
+        shape_element.pstats / .txt    cProfile per stage (pstats / top functions)
+        tracemalloc.txt                top allocations per snapshot
+        samples.folded                 "stage;outer;...;inner count" lines
+
+    OSM_PROFILE=sample python -m osm_wrangling shape phoenix_arizona.osm
+    flamegraph.pl profiles/shape-*/samples.folded > shape.svg
+    python -m osm_wrangling --profile cprofile,tracemalloc load
+"""
+from __future__ import print_function
+
+import cProfile
+import contextlib
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_DIR = 'profiles'
+MODES = ('cprofile', 'tracemalloc', 'sample')
+SNAPSHOT_EVERY = 100000     # elements between tracemalloc snapshots
+SAMPLE_INTERVAL = 0.005     # seconds between stack samples
+TOP_ALLOCATIONS = 15
+TOP_FUNCTIONS = 30
+
+_active = None
+
+
+def parse_modes(text):
+    """'cprofile, sample' -> ('cprofile', 'sample'); ValueError for unknown modes"""
+    modes = tuple(m.strip() for m in text.split(',') if m.strip())
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise ValueError('unknown profile mode(s) {0}, expected {1}'.format(
+            ', '.join(sorted(unknown)), ', '.join(MODES)))
+    return modes
+
+
+def from_env(label, environ=os.environ):
+    """A Profiler configured by the OSM_PROFILE* variables, or None if OSM_PROFILE is unset"""
+    modes = environ.get('OSM_PROFILE')
+    if not modes:
+        return None
+    return Profiler(parse_modes(modes), environ.get('OSM_PROFILE_DIR', PROFILE_DIR), label,
+                    int(environ.get('OSM_PROFILE_EVERY', SNAPSHOT_EVERY)),
+                    float(environ.get('OSM_PROFILE_INTERVAL', SAMPLE_INTERVAL)))
+
+
+def active():
+    """The running Profiler, or None"""
+    return _active
+
+
+@contextlib.contextmanager
+def profiled(label):
+    """Yield the running Profiler, else one started from OSM_PROFILE for this run, else None"""
+    if _active is not None:
+        yield _active
+        return
+    profiler = from_env(label)
+    if profiler is None:
+        yield None
+        return
+    with profiler:
+        yield profiler
+
+
+@contextlib.contextmanager
+def stage(profiler, name):
+    """profiler.stage(name), or nothing when profiler is None"""
+    if profiler is None:
+        yield
+        return
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit(name)
+
+
+class Profiler(object):
+    """Per-stage timing plus the cProfile / tracemalloc / sampling modes of one run"""
+
+    def __init__(self, modes=('cprofile',), out_dir=PROFILE_DIR, label='run',
+                 every=SNAPSHOT_EVERY, interval=SAMPLE_INTERVAL):
+        self.modes = tuple(modes)
+        self.out_dir = out_dir
+        self.label = label
+        self.every = every
+        self.interval = interval
+        self.run_dir = None
+        self.seconds = {}
+        self.calls = {}
+        self.elements = 0
+        self.profiles = {}
+        self.samples = {}
+        self._stack = []
+        self._started = {}
+        self._sampler = None
+        self._stop = threading.Event()
+        self._tracemalloc = None
+
+    # ---- lifecycle ---------------------------------------------------------
+    def start(self):
+        global _active
+        self.run_dir = os.path.join(self.out_dir, '{0}-{1}-{2}'.format(
+            self.label, time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+        os.makedirs(self.run_dir)
+        self._start_time = time.time()
+        if 'tracemalloc' in self.modes:
+            try:
+                import tracemalloc
+            except ImportError:
+                print('tracemalloc needs python 3; skipping it', file=sys.stderr)
+            else:
+                self._tracemalloc = tracemalloc
+                tracemalloc.start()
+                self._snapshot_file = open(os.path.join(self.run_dir, 'tracemalloc.txt'), 'w')
+        if 'sample' in self.modes:
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, args=(threading.current_thread().ident,))
+            self._sampler.daemon = True
+            self._sampler.start()
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        _active = None
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+            with open(os.path.join(self.run_dir, 'samples.folded'), 'w') as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write('{0} {1}\n'.format(stack, count))
+        if self._tracemalloc is not None:
+            self.snapshot('end')
+            self._tracemalloc.stop()
+            self._snapshot_file.close()
+            self._tracemalloc = None
+        for name, profile in self.profiles.items():
+            path = os.path.join(self.run_dir, name)
+            profile.dump_stats(path + '.pstats')
+            with open(path + '.txt', 'w') as f:
+                pstats.Stats(path + '.pstats', stream=f).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        summary = {'label': self.label, 'modes': list(self.modes), 'elements': self.elements,
+                   'seconds': time.time() - self._start_time,
+                   'stages': dict((name, {'seconds': self.seconds[name], 'calls': self.calls[name]})
+                                  for name in self.seconds)}
+        with open(os.path.join(self.run_dir, 'stages.json'), 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        print('profile written to {0}'.format(self.run_dir), file=sys.stderr)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- stages ------------------------------------------------------------
+    def enter(self, name):
+        if self._stack and self._stack[-1] in self.profiles:
+            self.profiles[self._stack[-1]].disable()
+        self._stack.append(name)
+        self._started[name] = time.time()
+        if 'cprofile' in self.modes:
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = self.profiles[name] = cProfile.Profile()
+            profile.enable()
+
+    def exit(self, name):
+        if name in self.profiles:
+            self.profiles[name].disable()
+        self.seconds[name] = self.seconds.get(name, 0.0) + time.time() - self._started.pop(name)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._stack.pop()
+        if self._stack and self._stack[-1] in self.profiles:
+            self.profiles[self._stack[-1]].enable()
+
+    def wrap(self, name, func):
+        """func, timed (and profiled) as stage name on every call"""
+        enter, exit = self.enter, self.exit
+
+        def staged(*args, **kwargs):
+            enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                exit(name)
+        return staged
+
+    def iterate(self, name, iterable):
+        """Yield from iterable, timing each next() as stage name and counting elements"""
+        iterator = iter(iterable)
+        while True:
+            self.enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit(name)
+            self.elements += 1
+            if self._tracemalloc is not None and self.elements % self.every == 0:
+                self.snapshot('{0} elements'.format(self.elements))
+            yield item
+
+    # ---- tracemalloc -------------------------------------------------------
+    def snapshot(self, title):
+        """Append the top allocations so far to tracemalloc.txt"""
+        current, peak = self._tracemalloc.get_traced_memory()
+        f = self._snapshot_file
+        f.write('== {0} (stage {1}): current {2:.1f} MB, peak {3:.1f} MB\n'.format(
+            title, self._stack[-1] if self._stack else self.label, current / 1e6, peak / 1e6))
+        stats = self._tracemalloc.take_snapshot().filter_traces((
+            self._tracemalloc.Filter(False, self._tracemalloc.__file__),
+        )).statistics('lineno')
+        for stat in stats[:TOP_ALLOCATIONS]:
+            f.write('  {0}\n'.format(stat))
+        f.flush()
+
+    # ---- sampling ----------------------------------------------------------
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append('{0} ({1}:{2})'.format(
+                    code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            stack_label = self._stack[-1] if self._stack else self.label
+            stack = ';'.join([stack_label] + frames[::-1])
+            self.samples[stack] = self.samples.get(stack, 0) + 1
@@ -0,0 +1,512 @@
+"""
+Latency of the REPORTS queries across dataset sizes, checked against a baseline.
+
+Databases are built at several scale factors by the regular loader (load.py)
+from one of two sources:
+
+  synthetic   generated elements, SYNTHETIC_NODES nodes per unit of scale with
+              ways, relations and the tags the reports look at (addresses with
+              cities, places of worship, restaurants); edits are spread over the
+              users by a Zipf law. The same seed gives the same database.
+  CSV_DIR     an existing process_map output, thinned by element id below
+              scale 1 and replicated with shifted ids above it.
+
+The databases are kept in --bench-dir under names that carry a hash of the
+generator and loader code, so editing either builds new ones, and are
+reused until --rebuild (or, for a CSV_DIR, until its csv files change).
+Every report then runs --runs times on each database, twice over:
+
+  warm   on one connection, after an untimed run
+  cold   on a new connection each time, with the database file dropped from
+         the OS page cache first (posix_fadvise: python 3 on Linux; elsewhere
+         only SQLite's own cache starts empty and the results say so)
+
+p50/p95/p99 (nearest rank), the number of result rows and the EXPLAIN QUERY
+PLAN of every report are written to --out, together with how the warm p50
+grows with the scale (1 is linear). With --baseline, a report whose p50 is
+more than --tolerance slower than the baseline's, and at least --min-ms
+slower so that sub-millisecond noise does not count, is a regression and the
+run exits with 1. Changed query plans are listed as well.
+
+    python -m osm_wrangling.query_bench --scale 1,4,16 --save-baseline bench/baseline.json
+    python -m osm_wrangling.query_bench --scale 1,4,16 --baseline bench/baseline.json
+    python -m osm_wrangling.query_bench --source phoenix --scale 0.25,1,4 --runs 50 cities
+"""
+from __future__ import division, print_function
+
+import argparse
+import bisect
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from glob import glob
+
+from . import address_index, edit_history, load, osm_io, osm_sample, relations, shape, tag_search
+from .osm_io import iter_csv, open_csv
+from .osm_sample import hash_sampled
+from .reports import REPORTS
+from .shape import OUTPUTS, CsvWriters, UnicodeDictWriter
+from .stage_cache import code_version
+
+SYNTHETIC = 'synthetic'
+SYNTHETIC_NODES = 20000     # nodes at scale 1
+SYNTHETIC_USERS = 500       # users at scale 1
+NODES_PER_WAY = 8
+WAYS_PER_RELATION = 150
+ZIPF_EXPONENT = 1.1
+SEED = 42
+FIRST_EDIT, LAST_EDIT = 1199145600, 1514764800  # 2008-01-01 .. 2018-01-01
+BBOX = (33.2, -112.5, 33.9, -111.6)             # the Phoenix extract
+
+BENCH_DIR = 'bench'
+SCALES = (1, 4, 16)
+RUNS = 20
+TOLERANCE = 0.25
+MIN_MS = 1.0
+PERCENTILES = (50, 95, 99)
+
+CITIES = ['Phoenix', 'Mesa', 'Chandler', 'Scottsdale', 'Glendale', 'Gilbert', 'Tempe', 'Peoria',
+          'Surprise', 'Avondale', 'Goodyear', 'Buckeye', 'Fountain Hills', 'Cave Creek']
+RELIGIONS = ['christian', 'muslim', 'jewish', 'buddhist', 'hindu', 'sikh', 'unitarian_universalist']
+CUISINES = ['mexican', 'pizza', 'american', 'chinese', 'burger', 'sandwich', 'italian', 'japanese',
+            'thai', 'indian', 'vietnamese', 'sushi', 'greek']
+STREETS = ['Central', 'McDowell', 'Indian School', 'Camelback', 'Thomas', 'Baseline', 'Southern',
+           'Broadway', 'University', 'Apache', 'Scottsdale', 'Mill', 'Rural', 'Priest', 'Dobson']
+
+# columns besides id that hold element ids and move along when a csv is replicated
+ID_COLUMNS = {'ways_nodes.csv': ('node_id',), 'relations_members.csv': ('member_id',)}
+ELEMENT_FILES = ('nodes.csv', 'ways.csv', 'relations.csv')
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+# ================================================== #
+#               Building Databases                   #
+# ================================================== #
+class _Zipf(object):
+    """Draws items, the k-th one with probability proportional to 1 / k ** exponent"""
+
+    def __init__(self, items, exponent, rng):
+        self.items = list(items)
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.items) + 1):
+            total += rank ** -exponent
+            self.cumulative.append(total)
+
+    def draw(self):
+        i = bisect.bisect(self.cumulative, self.rng.random() * self.cumulative[-1])
+        return self.items[min(i, len(self.items) - 1)]
+
+
+def _tag(element_id, key, value):
+    # the same key split as shape_tags: 'addr:city' -> type addr, key city
+    tag_type, _, rest = key.partition(':')
+    if rest:
+        return {'id': element_id, 'key': rest, 'value': value, 'type': tag_type}
+    return {'id': element_id, 'key': key, 'value': value, 'type': 'regular'}
+
+
+def write_synthetic(out_dir, scale=1, seed=SEED):
+    """Write process_map csv files of a generated extract of about scale * SYNTHETIC_NODES nodes"""
+    rng = random.Random(seed)
+    n_nodes = max(NODES_PER_WAY, int(SYNTHETIC_NODES * scale))
+    n_ways = max(1, n_nodes // NODES_PER_WAY)
+    n_relations = max(1, n_ways // WAYS_PER_RELATION)
+    users = _Zipf(range(1, max(2, int(SYNTHETIC_USERS * scale)) + 1), ZIPF_EXPONENT, rng)
+    cities = _Zipf(CITIES, 1.0, rng)
+    religions = _Zipf(RELIGIONS, 2.0, rng)
+    cuisines = _Zipf(CUISINES, 0.8, rng)
+
+    def edit(element_id):
+        uid = users.draw()
+        return {'id': element_id, 'user': 'user{0}'.format(uid), 'uid': uid,
+                'version': rng.randint(1, 6), 'changeset': rng.randint(1, 50000000),
+                'timestamp': rng.randint(FIRST_EDIT, LAST_EDIT)}
+
+    def address(element_id):
+        return [_tag(element_id, 'addr:housenumber', str(rng.randint(1, 9999))),
+                _tag(element_id, 'addr:street', 'E {0} Rd'.format(rng.choice(STREETS))),
+                _tag(element_id, 'addr:city', cities.draw()),
+                _tag(element_id, 'addr:postcode', str(rng.randint(85001, 85399)))]
+
+    with CsvWriters(out_dir) as writer:
+        for node_id in range(1, n_nodes + 1):
+            node = edit(node_id)
+            node['lat'] = '{0:.7f}'.format(rng.uniform(BBOX[0], BBOX[2]))
+            node['lon'] = '{0:.7f}'.format(rng.uniform(BBOX[1], BBOX[3]))
+            r = rng.random()
+            if r < 0.004:
+                tags = [_tag(node_id, 'amenity', 'place_of_worship'),
+                        _tag(node_id, 'religion', religions.draw())]
+            elif r < 0.014:
+                tags = [_tag(node_id, 'amenity', 'restaurant')]
+                if rng.random() < 0.8:
+                    tags.append(_tag(node_id, 'cuisine', cuisines.draw()))
+            elif r < 0.12:
+                tags = address(node_id)
+            elif r < 0.15:
+                tags = [_tag(node_id, 'highway', rng.choice(['traffic_signals', 'crossing', 'stop']))]
+            else:
+                tags = []
+            writer.write({'node': node, 'node_tags': tags})
+
+        for way_id in range(1, n_ways + 1):
+            length = rng.randint(2, 2 * NODES_PER_WAY)
+            first = rng.randint(1, max(1, n_nodes - length))
+            way_nodes = [{'id': way_id, 'node_id': first + i, 'position': i} for i in range(length)]
+            if rng.random() < 0.15:
+                tags = [_tag(way_id, 'building', 'yes')] + address(way_id)
+            else:
+                tags = [_tag(way_id, 'highway', 'residential'),
+                        _tag(way_id, 'name', 'E {0} Rd'.format(rng.choice(STREETS)))]
+            writer.write({'way': edit(way_id), 'way_nodes': way_nodes, 'way_tags': tags})
+
+        for relation_id in range(1, n_relations + 1):
+            if rng.random() < 0.5:
+                tags = [_tag(relation_id, 'type', 'multipolygon')]
+                members = [('way', rng.randint(1, n_ways), 'inner' if i else 'outer')
+                           for i in range(rng.randint(1, 4))]
+            else:
+                tags = [_tag(relation_id, 'type', 'route'), _tag(relation_id, 'route', 'bus')]
+                members = [('way', rng.randint(1, n_ways), '') for _ in range(rng.randint(2, 8))]
+                members += [('node', rng.randint(1, n_nodes), 'stop') for _ in range(rng.randint(2, 8))]
+            writer.write({
+                'relation': edit(relation_id),
+                'relation_members': [{'id': relation_id, 'member_type': member_type,
+                                      'member_id': member_id, 'role': role, 'position': position}
+                                     for position, (member_type, member_id, role) in enumerate(members)],
+                'relation_tags': tags})
+
+
+def write_scaled(csv_dir, out_dir, scale):
+    """Write csv_dir's process_map files to out_dir, thinned or replicated to scale times the rows
+
+    Whole elements are kept or dropped (by a hash of their id), so an element
+    keeps all of its tags and way nodes. Copy k of a replicated extract has
+    its ids shifted by k times the largest id.
+    """
+    stride = 1
+    for name in ELEMENT_FILES:
+        path = os.path.join(csv_dir, name)
+        if os.path.exists(path):
+            for row in iter_csv(path):
+                stride = max(stride, int(row['id']) + 1)
+    copies = int(math.ceil(scale))
+    for name, fields, _ in OUTPUTS:
+        source = os.path.join(csv_dir, name)
+        with open_csv(os.path.join(out_dir, name), 'w') as f:
+            writer = UnicodeDictWriter(f, fields)
+            writer.writeheader()
+            if not os.path.exists(source):  # an output from before the relation files
+                continue
+            for copy in range(copies):
+                fraction, offset = min(1.0, scale - copy), copy * stride
+                for row in iter_csv(source):
+                    element_id = int(row['id'])
+                    if fraction < 1 and not hash_sampled(element_id, fraction):
+                        continue
+                    if offset:
+                        row['id'] = element_id + offset
+                        for column in ID_COLUMNS.get(name, ()):
+                            row[column] = int(row[column]) + offset
+                    writer.writerow(row)
+
+
+def build_version():
+    """Short hash of the code that generates and loads the databases"""
+    return code_version([sys.modules[__name__], shape, osm_io, osm_sample, load, tag_search,
+                         address_index, edit_history, relations])[:10]
+
+
+def _database_prefix(bench_dir, source, scale, seed):
+    if source == SYNTHETIC:
+        name = 'synthetic-seed{0}'.format(seed)
+    else:
+        name = os.path.basename(os.path.normpath(source))
+    return os.path.join(bench_dir, '{0}-sf{1:g}-'.format(name, scale))
+
+
+def database_path(bench_dir, source, scale, seed=SEED):
+    return _database_prefix(bench_dir, source, scale, seed) + build_version() + '.db'
+
+
+def _up_to_date(db_path, source):
+    if not os.path.exists(db_path):
+        return False
+    if source == SYNTHETIC:
+        return True
+    built = os.path.getmtime(db_path)
+    return all(os.path.getmtime(os.path.join(source, name)) <= built
+               for name, _, _ in OUTPUTS if os.path.exists(os.path.join(source, name)))
+
+
+def build_database(db_path, source=SYNTHETIC, scale=1, seed=SEED):
+    """Build db_path at scale from the synthetic generator or a csv directory; return the row counts"""
+    csv_dir = tempfile.mkdtemp(prefix='query_bench-')
+    try:
+        if source == SYNTHETIC:
+            write_synthetic(csv_dir, scale, seed)
+        else:
+            write_scaled(source, csv_dir, scale)
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return load.load(db_path, csv_dir)
+    finally:
+        shutil.rmtree(csv_dir, ignore_errors=True)
+
+
+def table_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict((table, conn.execute('SELECT COUNT(*) FROM {0}'.format(table)).fetchone()[0])
+                    for table in load.TABLES)
+    finally:
+        conn.close()
+
+
+# ================================================== #
+#               Timing                               #
+# ================================================== #
+def evict(path):
+    """Drop path's pages from the OS page cache; False where that is not possible"""
+    fadvise = getattr(os, 'posix_fadvise', None)
+    if fadvise is None:
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def percentile(values, p):
+    """Nearest-rank percentile p (0-100) of values"""
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(p / 100 * len(ordered))) - 1)]
+
+
+def summarise(seconds):
+    """Milliseconds: the PERCENTILES plus min, mean and max"""
+    ms = [s * 1000 for s in seconds]
+    summary = OrderedDict(('p{0}'.format(p), percentile(ms, p)) for p in PERCENTILES)
+    summary['min'], summary['mean'], summary['max'] = min(ms), sum(ms) / len(ms), max(ms)
+    return summary
+
+
+def time_warm(db_path, sql, runs=RUNS):
+    """Seconds of each of runs executions on one connection, after an untimed one"""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(sql).fetchall()
+        seconds = []
+        for _ in range(runs):
+            start = _timer()
+            conn.execute(sql).fetchall()
+            seconds.append(_timer() - start)
+        return seconds
+    finally:
+        conn.close()
+
+
+def time_cold(db_path, sql, runs=RUNS):
+    """Seconds of each of runs executions, each on a new connection to an evicted file"""
+    seconds = []
+    for _ in range(runs):
+        evict(db_path)
+        conn = sqlite3.connect(db_path)
+        try:
+            start = _timer()
+            conn.execute(sql).fetchall()
+            seconds.append(_timer() - start)
+        finally:
+            conn.close()
+    return seconds
+
+
+def query_plan(conn, sql):
+    """EXPLAIN QUERY PLAN of sql as lines, indented by depth"""
+    depth, lines = {}, []
+    for node_id, parent, _, detail in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+def bench_database(db_path, names=None, runs=RUNS):
+    """{report: {rows, plan, warm, cold}} for the named (default: all) reports on db_path"""
+    conn = sqlite3.connect(db_path)
+    try:
+        results = OrderedDict()
+        for name in names or REPORTS:
+            sql = REPORTS[name][1]
+            results[name] = OrderedDict([
+                ('rows', len(conn.execute(sql).fetchall())),
+                ('plan', query_plan(conn, sql)),
+                ('warm', summarise(time_warm(db_path, sql, runs))),
+                ('cold', summarise(time_cold(db_path, sql, runs))),
+            ])
+        return results
+    finally:
+        conn.close()
+
+
+def run(source=SYNTHETIC, scales=SCALES, names=None, runs=RUNS, bench_dir=BENCH_DIR, seed=SEED,
+        rebuild=False):
+    """Build (or reuse) a database per scale and time the reports on each; return the results dict"""
+    if not os.path.isdir(bench_dir):
+        os.makedirs(bench_dir)
+    results = OrderedDict([
+        ('source', source), ('seed', seed if source == SYNTHETIC else None), ('runs', runs),
+        ('sqlite', sqlite3.sqlite_version), ('python', platform.python_version()),
+        ('evicts_os_cache', hasattr(os, 'posix_fadvise')),
+        ('scales', OrderedDict()),
+    ])
+    for scale in sorted(scales):
+        db_path = database_path(bench_dir, source, scale, seed)
+        if rebuild or not _up_to_date(db_path, source):
+            start = time.time()
+            build_database(db_path, source, scale, seed)
+            print('built {0} in {1:.1f}s'.format(db_path, time.time() - start))
+            for stale in glob(_database_prefix(bench_dir, source, scale, seed) + '*.db'):
+                if stale != db_path:  # built by other code
+                    os.remove(stale)
+        results['scales']['{0:g}'.format(scale)] = OrderedDict([
+            ('db', db_path), ('tables', table_rows(db_path)),
+            ('reports', bench_database(db_path, names, runs))])
+    results['scaling'] = scaling(results)
+    return results
+
+
+def scaling(results):
+    """{report: exponent k of warm p50 ~ scale ** k between the smallest and largest scale}"""
+    scales = sorted(results['scales'], key=float)
+    if len(scales) < 2:
+        return {}
+    low, high = results['scales'][scales[0]], results['scales'][scales[-1]]
+    ratio = math.log(float(scales[-1]) / float(scales[0]))
+    exponents = OrderedDict()
+    for name, report in high['reports'].items():
+        before, after = low['reports'][name]['warm']['p50'], report['warm']['p50']
+        exponents[name] = math.log(after / before) / ratio if before > 0 and after > 0 else None
+    return exponents
+
+
+# ================================================== #
+#               Baseline                             #
+# ================================================== #
+def compare(baseline, results, tolerance=TOLERANCE, min_ms=MIN_MS):
+    """Return (regressions, plan changes) of results against baseline
+
+    A regression is (scale, report, cache, baseline p50, p50) where p50 grew
+    by more than tolerance and by at least min_ms; a plan change is
+    (scale, report, baseline plan, plan). Scales and reports missing from
+    either side are not compared, nor are cold timings when only one side
+    could evict the OS page cache.
+    """
+    caches = ['warm']
+    if baseline.get('evicts_os_cache') == results.get('evicts_os_cache'):
+        caches.append('cold')
+    regressions, plan_changes = [], []
+    for scale, current in results['scales'].items():
+        before = baseline['scales'].get(scale)
+        if before is None:
+            continue
+        for name, report in current['reports'].items():
+            old = before['reports'].get(name)
+            if old is None:
+                continue
+            for cache in caches:
+                was, now = old[cache]['p50'], report[cache]['p50']
+                if now > was * (1 + tolerance) and now - was >= min_ms:
+                    regressions.append((scale, name, cache, was, now))
+            if old['plan'] != report['plan']:
+                plan_changes.append((scale, name, old['plan'], report['plan']))
+    return regressions, plan_changes
+
+
+def print_results(results):
+    print('{0:>6} {1:<18} {2:>6}  {3:>27}  {4:>27}'.format(
+        'scale', 'report', 'rows', 'warm p50 / p95 / p99 ms', 'cold p50 / p95 / p99 ms'))
+    for scale, current in results['scales'].items():
+        for name, report in current['reports'].items():
+            print('{0:>6} {1:<18} {2:>6}  {3}  {4}'.format(
+                scale, name, report['rows'],
+                ' '.join('{0:>8.2f}'.format(report['warm'][p]) for p in ('p50', 'p95', 'p99')),
+                ' '.join('{0:>8.2f}'.format(report['cold'][p]) for p in ('p50', 'p95', 'p99'))))
+    if results['scaling']:
+        print('warm p50 ~ scale ** k (1 is linear):')
+        for name, exponent in results['scaling'].items():
+            print('  {0:<18} {1}'.format(name, '-' if exponent is None else '{0:.2f}'.format(exponent)))
+    if not results['evicts_os_cache']:
+        print('note: the OS page cache could not be dropped; cold only means a new connection')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('reports', nargs='*', help='reports to time (default: all): ' + ', '.join(REPORTS))
+    parser.add_argument('--source', default=SYNTHETIC,
+                        help='"synthetic" or a directory of process_map csv files (default: %(default)s)')
+    parser.add_argument('--scale', default=','.join(str(s) for s in SCALES),
+                        help='comma separated scale factors (default: %(default)s)')
+    parser.add_argument('--runs', type=int, default=RUNS, help='timed runs per report and cache')
+    parser.add_argument('--seed', type=int, default=SEED, help='synthetic data seed')
+    parser.add_argument('--bench-dir', default=BENCH_DIR, help='where the databases are kept')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the databases')
+    parser.add_argument('--out', help='results file (default: BENCH_DIR/results.json)')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--save-baseline', metavar='PATH', help='also write the results to PATH')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed p50 slowdown, as a fraction (default: %(default)s)')
+    parser.add_argument('--min-ms', type=float, default=MIN_MS,
+                        help='smaller slowdowns never count (default: %(default)s)')
+    parser.add_argument('--fail-on-plan-change', action='store_true')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.reports if name not in REPORTS]
+    if unknown:
+        parser.error('unknown report(s): ' + ', '.join(unknown))
+    try:
+        scales = [float(s) for s in args.scale.split(',')]
+    except ValueError:
+        parser.error('--scale takes numbers, e.g. 1,4,16')
+    if not scales or min(scales) <= 0:
+        parser.error('scale factors must be positive')
+    if args.source != SYNTHETIC and not os.path.isdir(args.source):
+        parser.error('no csv directory {0}'.format(args.source))
+
+    results = run(args.source, scales, args.reports, args.runs, args.bench_dir, args.seed, args.rebuild)
+    print_results(results)
+    for path in (args.out or os.path.join(args.bench_dir, 'results.json'), args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=1)
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions, plan_changes = compare(baseline, results, args.tolerance, args.min_ms)
+    for scale, name, was, plan in plan_changes:
+        print('plan changed: {0} at scale {1}\n  was: {2}\n  now: {3}'.format(
+            name, scale, '\n       '.join(was), '\n       '.join(plan)))
+    for scale, name, cache, was, now in regressions:
+        print('REGRESSION: {0} at scale {1} ({2}): p50 {3:.2f} -> {4:.2f} ms'.format(
+            name, scale, cache, was, now))
+    if regressions or (plan_changes and args.fail_on_plan_change):
+        return 1
+    print('no regressions against {0}'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
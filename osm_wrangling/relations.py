@@ -0,0 +1,107 @@
+"""
+Relation lookups over the relations, relations_tags and relations_members tables.
+
+process_map shapes relations (boundaries, routes, multipolygons, ...) in the
+same pass as nodes and ways, and the loader indexes their members by
+relation, by role and by member, and their tags by (key, value). None of
+these lookups scans a table:
+
+    find_relations(conn, 'boundary', 'administrative')   ids of the boundaries
+    members(conn, relation_id, role='outer')             a relation's members in order
+    with_role(conn, 'stop', 'node')                       every stop of every route
+    parents(conn, 'way', way_id)                          relations a way belongs to
+
+    python -m osm_wrangling.relations OpenStreetMap2.db --tag type=route
+    python -m osm_wrangling.relations OpenStreetMap2.db --members 1234 --role outer
+    python -m osm_wrangling.relations OpenStreetMap2.db --parents way:5678
+"""
+from __future__ import print_function
+
+import argparse
+import sqlite3
+from pprint import pprint
+
+from .reports import SQLITE_FILE
+
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS relations_id ON relations(id)',
+    'CREATE INDEX IF NOT EXISTS relations_tags_key_value ON relations_tags(key, value)',
+    'CREATE INDEX IF NOT EXISTS relations_members_id ON relations_members(id, position)',
+    'CREATE INDEX IF NOT EXISTS relations_members_role ON relations_members(role, member_type, member_id)',
+    'CREATE INDEX IF NOT EXISTS relations_members_member ON relations_members(member_type, member_id, id, role)',
+]
+
+
+def create_indexes(conn):
+    """Create the relation access paths (after the bulk insert is faster)"""
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.commit()
+
+
+def find_relations(conn, key, value=None):
+    """Ids of the relations tagged key (=value), e.g. ('type', 'route')"""
+    if value is None:
+        sql, params = 'SELECT DISTINCT id FROM relations_tags WHERE key = ?', (key,)
+    else:
+        sql, params = 'SELECT DISTINCT id FROM relations_tags WHERE key = ? AND value = ?', (key, value)
+    return [row[0] for row in conn.execute(sql + ' ORDER BY id', params)]
+
+
+def members(conn, relation_id, role=None):
+    """[(member_type, member_id, role)] of a relation, in member order"""
+    sql = 'SELECT member_type, member_id, role FROM relations_members WHERE id = ?'
+    params = (relation_id,)
+    if role is not None:
+        sql += ' AND role = ?'
+        params += (role,)
+    return conn.execute(sql + ' ORDER BY position', params).fetchall()
+
+
+def with_role(conn, role, member_type=None):
+    """[(relation id, member_type, member_id)] of every member with role"""
+    sql = 'SELECT id, member_type, member_id FROM relations_members WHERE role = ?'
+    params = (role,)
+    if member_type is not None:
+        sql += ' AND member_type = ?'
+        params += (member_type,)
+    return conn.execute(sql, params).fetchall()
+
+
+def parents(conn, member_type, member_id):
+    """[(relation id, role)] of the relations member_type member_id belongs to"""
+    return conn.execute(
+        'SELECT id, role FROM relations_members WHERE member_type = ? AND member_id = ? ORDER BY id',
+        (member_type, member_id)).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('sqlite_file', nargs='?', default=SQLITE_FILE)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--tag', help='key or key=value, e.g. boundary=administrative')
+    group.add_argument('--members', type=int, metavar='RELATION_ID')
+    group.add_argument('--with-role', metavar='ROLE')
+    group.add_argument('--parents', metavar='TYPE:ID', help='e.g. way:5678')
+    parser.add_argument('--role', help='only members with this role (--members)')
+    parser.add_argument('--type', dest='member_type', help='only members of this type (--with-role)')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.sqlite_file)
+    try:
+        if args.tag:
+            key, _, value = args.tag.partition('=')
+            pprint(find_relations(conn, key, value or None))
+        elif args.members is not None:
+            pprint(members(conn, args.members, args.role))
+        elif args.with_role:
+            pprint(with_role(conn, args.with_role, args.member_type))
+        else:
+            member_type, _, member_id = args.parents.partition(':')
+            pprint(parents(conn, member_type, int(member_id)))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Run the report catalog from a pool of read-only SQLite connections.
+
+The SQL cells of OSM_Code.py each opened a new connection, ran one query,
+committed after a SELECT and never closed it. ReportRunner instead
+
+  - switches the database to WAL once, so readers never block each other or
+    a writer, and opens `size` read-only connections to it;
+  - keeps every catalog query in each connection's statement cache, so a
+    query is prepared once per connection and reused after that;
+  - runs independent reports concurrently on those connections (sqlite3
+    releases the GIL while a query runs);
+  - caches results keyed by SQLite's data_version, which changes whenever
+    another connection commits: repeated loads are answered from memory
+    until the database is modified.
+
+    runner = ReportRunner('OpenStreetMap2.db')
+    rows = runner.run('top_users')
+    everything = runner.run_many()
+    runner.close()
+"""
+from __future__ import print_function
+
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from .reports import REPORTS, SQLITE_FILE
+
+POOL_SIZE = 4
+
+
+def enable_wal(sqlite_file):
+    """Switch the database to write-ahead logging (persistent, a no-op when set)"""
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        return conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def connect_read_only(sqlite_file, cached_statements=100):
+    """Open a read-only connection that may be handed between threads"""
+    if sys.version_info >= (3, 4):
+        conn = sqlite3.connect('file:{0}?mode=ro'.format(sqlite_file), uri=True,
+                               check_same_thread=False, cached_statements=cached_statements)
+    else:
+        conn = sqlite3.connect(sqlite_file, check_same_thread=False,
+                               cached_statements=cached_statements)
+    conn.execute('PRAGMA query_only = ON')
+    return conn
+
+
+class ReportRunner(object):
+    """Pooled, cached execution of the report catalog"""
+
+    def __init__(self, sqlite_file=SQLITE_FILE, size=POOL_SIZE, reports=REPORTS):
+        self.reports = reports
+        self.size = size
+        enable_wal(sqlite_file)
+        statements = len(reports) + 10
+        self._idle = Queue()
+        self._connections = [connect_read_only(sqlite_file, statements) for _ in range(size)]
+        for conn in self._connections:
+            self._idle.put(conn)
+        # data_version is per connection, so one connection is kept to watch it
+        self._watcher = connect_read_only(sqlite_file)
+        self._lock = threading.Lock()
+        self._version = self._read_version()
+        self._cache = {}
+        self.hits = self.misses = 0
+        self._threads = None
+
+    def _read_version(self):
+        return self._watcher.execute('PRAGMA data_version').fetchone()[0]
+
+    def data_version(self):
+        """Current data version; drops the cached results when it changed"""
+        with self._lock:
+            version = self._read_version()
+            if version != self._version:
+                self._version = version
+                self._cache.clear()
+            return version
+
+    def acquire(self):
+        """Take a connection from the pool, waiting for one to be free"""
+        return self._idle.get()
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def execute(self, sql, params=()):
+        """Run any read-only query on a pooled connection (not cached)"""
+        conn = self.acquire()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.release(conn)
+
+    def run(self, name, params=()):
+        """Rows of one catalog report, from the cache while the data is unchanged"""
+        version = self.data_version()
+        key = (name, tuple(params))
+        with self._lock:
+            if key in self._cache:
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+        rows = self.execute(self.reports[name][1], params)
+        with self._lock:
+            if self._version == version:
+                self._cache[key] = rows
+        return rows
+
+    def run_many(self, names=None):
+        """Run several reports concurrently; return {name: rows} in catalog order"""
+        names = list(names or self.reports)
+        if self._threads is None:
+            self._threads = ThreadPool(self.size)
+        return OrderedDict(zip(names, self._threads.map(self.run, names)))
+
+    def close(self):
+        if self._threads is not None:
+            self._threads.close()
+            self._threads.join()
+        for conn in self._connections + [self._watcher]:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('sqlite_file', nargs='?', default=SQLITE_FILE)
+    parser.add_argument('--size', type=int, default=POOL_SIZE, help='number of connections')
+    parser.add_argument('--loads', type=int, default=3, help='dashboard loads to time')
+    args = parser.parse_args(argv)
+
+    with ReportRunner(args.sqlite_file, args.size) as runner:
+        for load in range(args.loads):
+            start = time.time()
+            runner.run_many()
+            print('load {0}: {1:.4f}s'.format(load + 1, time.time() - start))
+        print('cache hits {0}, misses {1}'.format(runner.hits, runner.misses))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+asyncio HTTP service over OpenStreetMap2.db, with a load generator.
+
+Python 3.7+ only (the rest of the tools still run on python 2.7).
+
+Endpoints, all answering JSON:
+
+    GET /reports                       names of the catalog reports
+    GET /reports/<name>                rows of one report (cached by ReportRunner)
+    GET /tags/<key>                    value counts of a tag, e.g. /tags/addr:city
+    GET /elements?key=cuisine&value=pizza
+                                       (type, id) of every element with that
+                                       tag, streamed in chunks
+    GET /near?amenity=cafe&lat=..&lon=..&k=5 (or &radius=metres)
+                                       amenities near a point (needs --poi-index)
+
+SQLite calls - taking a pooled connection included - and the /near index
+searches run in a thread pool the size of the connection pool, so the event
+loop never blocks on them, and at most that many queries run at once. An
+unexpected error is logged to stderr and answered with a 500, or, when a
+streamed response has already started, ends the connection. /elements
+streams its rows with chunked transfer encoding, fetching STREAM_ROWS at a
+time, so a large result is never held in memory.
+
+    python -m osm_wrangling.report_service serve OpenStreetMap2.db --poi-index amenity.poi
+    python -m osm_wrangling.report_service load /reports/top_users /tags/cuisine --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .report_runner import POOL_SIZE, ReportRunner
+from .reports import SQLITE_FILE
+
+HOST = '127.0.0.1'
+PORT = 8008
+STREAM_ROWS = 1000
+
+TAG_COUNTS = '''
+    SELECT value, COUNT(*) AS num
+    FROM (SELECT value FROM nodes_tags WHERE key = ? AND type = ?
+          UNION ALL
+          SELECT value FROM ways_tags WHERE key = ? AND type = ?)
+    GROUP BY value
+    ORDER BY num DESC
+'''
+TAG_ELEMENTS = '''
+    SELECT 'node', id FROM nodes_tags WHERE key = ? AND type = ? AND value = ?
+    UNION ALL
+    SELECT 'way', id FROM ways_tags WHERE key = ? AND type = ? AND value = ?
+'''
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class _ResponseStarted(Exception):
+    """An error after the response headers went out: all that is left is closing the connection"""
+
+
+def split_key(full_key):
+    """Tag key as stored by shape_element: ("addr:street") -> ("street", "addr")"""
+    if ':' in full_key:
+        kind, key = full_key.split(':', 1)
+        return key, kind
+    return full_key, 'regular'
+
+
+def _param(query, name, convert=str, default=None):
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise HTTPError(400, 'missing parameter {0}'.format(name))
+        return default
+    try:
+        return convert(values[0])
+    except ValueError:
+        raise HTTPError(400, 'bad value for {0}'.format(name))
+
+
+# ================================================== #
+#               HTTP Plumbing                        #
+# ================================================== #
+async def _read_request(reader):
+    """Return (method, target, headers) or None when the client is done"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HTTPError(400, 'malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, 'bad Content-Length')
+    if length:
+        await reader.readexactly(length)
+    return method, target, headers
+
+
+def _head(status, keep_alive, extra):
+    lines = ['HTTP/1.1 {0} {1}'.format(status, _REASONS.get(status, '')),
+             'Content-Type: application/json',
+             'Connection: {0}'.format('keep-alive' if keep_alive else 'close')] + extra
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def _send(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(_head(status, keep_alive, ['Content-Length: {0}'.format(len(body))]) + body)
+    await writer.drain()
+
+
+async def _send_chunk(writer, data):
+    writer.write('{0:x}\r\n'.format(len(data)).encode('latin-1') + data + b'\r\n')
+    await writer.drain()
+
+
+def _log_error(method, target):
+    print('{0} {1} failed:'.format(method, target), file=sys.stderr)
+    traceback.print_exc()
+
+
+# ================================================== #
+#               Service                              #
+# ================================================== #
+class ReportService(object):
+    """Routes requests to the report runner and the POI index"""
+
+    def __init__(self, runner, poi_index=None):
+        self.runner = runner
+        self.poi_index = poi_index
+        self.executor = ThreadPoolExecutor(runner.size)
+        # one slot per pooled connection: a query thread only starts once a
+        # connection is free, so threads never sit waiting on the pool while a
+        # stream that holds a connection waits for a thread
+        self.slots = asyncio.Semaphore(runner.size)
+
+    async def _in_pool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _query(self, func, *args):
+        async with self.slots:
+            return await self._in_pool(func, *args)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                method = target = None
+                keep_alive = False  # a request that cannot be read leaves the stream in an unknown state
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    if method != 'GET':
+                        raise HTTPError(405, 'only GET is supported')
+                    await self.dispatch(target, writer, keep_alive)
+                except HTTPError as e:
+                    await _send(writer, e.status, {'error': str(e)}, keep_alive)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except _ResponseStarted:
+                    _log_error(method, target)
+                    break
+                except Exception:
+                    _log_error(method, target)
+                    await _send(writer, 500, {'error': 'internal server error'}, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, target, writer, keep_alive):
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.strip('/').split('/')]
+        query = parse_qs(url.query)
+        if parts == ['reports']:
+            return await _send(writer, 200, list(self.runner.reports), keep_alive)
+        if len(parts) == 2 and parts[0] == 'reports':
+            if parts[1] not in self.runner.reports:
+                raise HTTPError(404, 'no report {0}'.format(parts[1]))
+            rows = await self._query(self.runner.run, parts[1])
+            return await _send(writer, 200, {'report': parts[1], 'rows': rows}, keep_alive)
+        if len(parts) == 2 and parts[0] == 'tags':
+            key, kind = split_key(parts[1])
+            rows = await self._query(self.runner.execute, TAG_COUNTS, (key, kind, key, kind))
+            return await _send(writer, 200, {'key': parts[1], 'rows': rows}, keep_alive)
+        if parts == ['elements']:
+            key, kind = split_key(_param(query, 'key'))
+            value = _param(query, 'value')
+            return await self.stream(writer, TAG_ELEMENTS, (key, kind, value) * 2, keep_alive)
+        if parts == ['near']:
+            return await _send(writer, 200, await self._in_pool(self.near, query), keep_alive)
+        raise HTTPError(404, 'no such endpoint')
+
+    def near(self, query):
+        if self.poi_index is None:
+            raise HTTPError(404, 'service started without --poi-index')
+        value = _param(query, self.poi_index.key)
+        lat, lon = _param(query, 'lat', float), _param(query, 'lon', float)
+        if 'radius' in query:
+            hits = self.poi_index.within(value, lat, lon, _param(query, 'radius', float))
+        else:
+            hits = self.poi_index.nearest(value, lat, lon, _param(query, 'k', int, 5))
+        return [{'id': i, 'lat': la, 'lon': lo, 'distance': round(d, 1)} for d, i, la, lo in hits]
+
+    async def stream(self, writer, sql, params, keep_alive):
+        """Send the rows of a query as a chunked JSON array"""
+        async with self.slots:
+            await self._stream(writer, sql, params, keep_alive)
+
+    async def _stream(self, writer, sql, params, keep_alive):
+        conn = await self._in_pool(self.runner.acquire)
+        try:
+            cursor = await self._in_pool(conn.execute, sql, params)
+            writer.write(_head(200, keep_alive, ['Transfer-Encoding: chunked']))
+            try:
+                separator = b'['
+                while True:
+                    rows = await self._in_pool(cursor.fetchmany, STREAM_ROWS)
+                    if not rows:
+                        break
+                    data = b','.join(json.dumps(row).encode('utf-8') for row in rows)
+                    await _send_chunk(writer, separator + data)
+                    separator = b','
+                await _send_chunk(writer, b']' if separator == b',' else b'[]')
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+            except ConnectionError:
+                raise
+            except Exception as e:
+                raise _ResponseStarted() from e
+        finally:
+            self.runner.release(conn)
+
+
+async def serve(sqlite_file=SQLITE_FILE, host=HOST, port=PORT, size=POOL_SIZE, poi_path=None):
+    poi_index = None
+    if poi_path:
+        from .poi_index import POIIndex
+        poi_index = POIIndex.load(poi_path)
+    with ReportRunner(sqlite_file, size) as runner:
+        service = ReportService(runner, poi_index)
+        server = await asyncio.start_server(service.handle, host, port)
+        print('Serving {0} on http://{1}:{2}'.format(sqlite_file, host, port))
+        async with server:
+            await server.serve_forever()
+
+
+# ================================================== #
+#               Load Generator                       #
+# ================================================== #
+async def _read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status
+
+
+async def _client(host, port, paths, jobs, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError as e:
+        errors.append(e)
+        return
+    try:
+        while jobs:
+            path = paths[jobs.pop() % len(paths)]
+            start = time.perf_counter()
+            writer.write('GET {0} HTTP/1.1\r\nHost: {1}\r\n\r\n'.format(path, host).encode('latin-1'))
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        errors.append(e)  # the server hung up; this client stops here
+    finally:
+        writer.close()
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+    return values[min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))]
+
+
+async def load_test(paths, host=HOST, port=PORT, concurrency=20, requests=1000):
+    """Replay paths round robin from concurrent keep-alive clients; return stats"""
+    jobs, latencies, errors = list(range(requests)), [], []
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, paths, jobs, latencies, errors)
+                           for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    stats = {'requests': len(latencies), 'errors': len(errors), 'seconds': elapsed,
+             'rps': len(latencies) / elapsed, 'p50': None, 'p99': None, 'max': None}
+    if latencies:
+        stats.update(p50=percentile(latencies, 50), p99=percentile(latencies, 99),
+                     max=latencies[-1])
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    serve_cmd = sub.add_parser('serve', help='run the service')
+    serve_cmd.add_argument('sqlite_file', nargs='?', default=SQLITE_FILE)
+    serve_cmd.add_argument('--poi-index', help='POIIndex file for /near')
+    serve_cmd.add_argument('--size', type=int, default=POOL_SIZE,
+                           help='connections and query threads')
+    load = sub.add_parser('load', help='load-test a running service')
+    load.add_argument('paths', nargs='+')
+    load.add_argument('--concurrency', type=int, default=20)
+    load.add_argument('--requests', type=int, default=1000)
+    for cmd in (serve_cmd, load):
+        cmd.add_argument('--host', default=HOST)
+        cmd.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(serve(args.sqlite_file, args.host, args.port, args.size, args.poi_index))
+        except KeyboardInterrupt:
+            pass
+        return
+    stats = asyncio.run(load_test(args.paths, args.host, args.port, args.concurrency, args.requests))
+    print('{requests} requests ({errors} errors) in {seconds:.2f}s: {rps:,.0f} req/s'.format(**stats))
+    if stats['p50'] is None:
+        print('No responses')
+        return 1
+    print('latency p50 {0:.2f} ms, p99 {1:.2f} ms, max {2:.2f} ms'.format(
+        stats['p50'] * 1000, stats['p99'] * 1000, stats['max'] * 1000))
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
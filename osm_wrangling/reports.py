@@ -0,0 +1,243 @@
+"""
+The shipped SQL reports as one catalog, runnable on two engines.
+
+REPORTS holds the queries from the "SQL Queries" cells of OSM_Code.py. They
+run on either engine:
+
+  sqlite  the default: OpenStreetMap2.db as built by the "Preparing for SQL"
+          cell (row store, needs the csv import first);
+  duckdb  DuckDB's in-process, vectorised column engine reading the
+          process_map csv files directly through read_csv, so there is no
+          import step. Needs `pip install duckdb`.
+
+Identifiers that are keywords in DuckDB ("user") are quoted, which SQLite
+accepts too, so both engines run the very same SQL.
+
+    python -m osm_wrangling.reports             all reports on sqlite
+    python -m osm_wrangling.reports --engine duckdb --csv-dir .
+    python -m osm_wrangling.reports --benchmark both engines, side by side
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from pprint import pprint
+
+SQLITE_FILE = 'OpenStreetMap2.db'
+
+REPORTS = OrderedDict([
+    ('nodes', ('Number of nodes', '''
+        SELECT COUNT(*) FROM nodes
+    ''')),
+    ('ways', ('Number of ways', '''
+        SELECT COUNT(*) FROM ways
+    ''')),
+    ('unique_users', ('Number of unique users', '''
+        SELECT COUNT(DISTINCT(e.uid))
+        FROM (SELECT uid FROM nodes UNION ALL SELECT uid FROM ways) e
+    ''')),
+    ('top_users', ('Top 10 contributing users', '''
+        SELECT e."user", COUNT(*) AS num
+        FROM (SELECT "user" FROM nodes UNION ALL SELECT "user" FROM ways) e
+        GROUP BY e."user"
+        ORDER BY num DESC
+        LIMIT 10
+    ''')),
+    ('single_edit_users', ('Number of users appearing only once', '''
+        SELECT COUNT(*)
+        FROM (SELECT e."user"
+              FROM (SELECT "user" FROM nodes UNION ALL SELECT "user" FROM ways) e
+              GROUP BY e."user"
+              HAVING COUNT(*) = 1) u
+    ''')),
+    ('cities', ('Cities of the Phoenix metropolitan area', '''
+        SELECT tags.value, COUNT(*) AS count
+        FROM (SELECT * FROM nodes_tags UNION ALL
+              SELECT * FROM ways_tags) tags
+        WHERE tags.key LIKE '%city'
+        GROUP BY tags.value
+        ORDER BY count DESC
+    ''')),
+    ('religions', ('Top 5 religions', '''
+        SELECT nodes_tags.value, COUNT(*) AS num
+        FROM nodes_tags
+            JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='place_of_worship') i
+            ON nodes_tags.id=i.id
+        WHERE nodes_tags.key='religion'
+        GROUP BY nodes_tags.value
+        ORDER BY num DESC
+        LIMIT 5
+    ''')),
+    ('cuisines', ('Most popular cuisines', '''
+        SELECT nodes_tags.value, COUNT(*) AS num
+        FROM nodes_tags
+            JOIN (SELECT DISTINCT(id) FROM nodes_tags WHERE value='restaurant') i
+            ON nodes_tags.id=i.id
+        WHERE nodes_tags.key='cuisine'
+        GROUP BY nodes_tags.value
+        ORDER BY num DESC
+    ''')),
+])
+
+# process_map csv files and their column types, for the duckdb engine
+CSV_TABLES = OrderedDict([
+    ('nodes', OrderedDict([('id', 'BIGINT'), ('lat', 'DOUBLE'), ('lon', 'DOUBLE'),
+                           ('user', 'VARCHAR'), ('uid', 'BIGINT'), ('version', 'INTEGER'),
+                           ('changeset', 'BIGINT'), ('timestamp', 'BIGINT')])),
+    ('nodes_tags', OrderedDict([('id', 'BIGINT'), ('key', 'VARCHAR'), ('value', 'VARCHAR'),
+                                ('type', 'VARCHAR')])),
+    ('ways', OrderedDict([('id', 'BIGINT'), ('user', 'VARCHAR'), ('uid', 'BIGINT'),
+                          ('version', 'INTEGER'), ('changeset', 'BIGINT'),
+                          ('timestamp', 'BIGINT')])),
+    ('ways_tags', OrderedDict([('id', 'BIGINT'), ('key', 'VARCHAR'), ('value', 'VARCHAR'),
+                               ('type', 'VARCHAR')])),
+    ('ways_nodes', OrderedDict([('id', 'BIGINT'), ('node_id', 'BIGINT'),
+                                ('position', 'INTEGER')])),
+    ('relations', OrderedDict([('id', 'BIGINT'), ('user', 'VARCHAR'), ('uid', 'BIGINT'),
+                               ('version', 'INTEGER'), ('changeset', 'BIGINT'),
+                               ('timestamp', 'BIGINT')])),
+    ('relations_tags', OrderedDict([('id', 'BIGINT'), ('key', 'VARCHAR'), ('value', 'VARCHAR'),
+                                    ('type', 'VARCHAR')])),
+    ('relations_members', OrderedDict([('id', 'BIGINT'), ('member_type', 'VARCHAR'),
+                                       ('member_id', 'BIGINT'), ('role', 'VARCHAR'),
+                                       ('position', 'INTEGER')])),
+])
+
+
+# ================================================== #
+#               Engines                              #
+# ================================================== #
+class SQLiteEngine(object):
+    """Reports over the loaded SQLite database"""
+    name = 'sqlite'
+
+    def __init__(self, sqlite_file=SQLITE_FILE):
+        self.conn = sqlite3.connect(sqlite_file)
+
+    def run(self, sql):
+        return self.conn.execute(sql).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class DuckDBEngine(object):
+    """Reports straight over the process_map csv files, through DuckDB views"""
+    name = 'duckdb'
+
+    def __init__(self, csv_dir='.', threads=None):
+        import duckdb
+        self.conn = duckdb.connect(':memory:')
+        if threads:
+            self.conn.execute('SET threads TO {0:d}'.format(threads))
+        for table, columns in CSV_TABLES.items():
+            path = os.path.join(csv_dir, table + '.csv').replace("'", "''")
+            types = ', '.join("'{0}': '{1}'".format(c, t) for c, t in columns.items())
+            self.conn.execute(
+                "CREATE VIEW {0} AS SELECT * FROM read_csv('{1}', header=true, "
+                "columns={{{2}}})".format(table, path, types))
+
+    def run(self, sql):
+        return self.conn.execute(sql).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+ENGINES = OrderedDict([('sqlite', SQLiteEngine), ('duckdb', DuckDBEngine)])
+
+
+def open_engine(engine='sqlite', sqlite_file=SQLITE_FILE, csv_dir='.'):
+    """Return an engine instance by name"""
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine {0!r}, expected one of {1}".format(engine, list(ENGINES)))
+    return ENGINES[engine](sqlite_file if engine == 'sqlite' else csv_dir)
+
+
+def run_reports(engine, names=None):
+    """Return {report name: rows} for the named (default: all) reports"""
+    return OrderedDict((name, engine.run(REPORTS[name][1])) for name in names or REPORTS)
+
+
+# ================================================== #
+#               Benchmark                            #
+# ================================================== #
+def _normalised(rows):
+    # the engines may break ties in ORDER BY differently
+    return sorted(tuple(row) for row in rows)
+
+
+def benchmark(sqlite_file=SQLITE_FILE, csv_dir='.', repeat=3, names=None):
+    """Time every report on both engines; return [(name, {engine: seconds}, same result)]
+
+    Each report is timed as the best of repeat runs; engines that cannot be
+    opened (duckdb not installed) are left out of the timings.
+    """
+    engines = []
+    for name in ENGINES:
+        try:
+            engines.append(open_engine(name, sqlite_file, csv_dir))
+        except ImportError:
+            print('{0}: not installed, skipped'.format(name))
+    results = []
+    try:
+        for report in names or REPORTS:
+            sql = REPORTS[report][1]
+            timings, answers = OrderedDict(), []
+            for engine in engines:
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    rows = engine.run(sql)
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[engine.name] = best
+                answers.append(_normalised(rows))
+            results.append((report, timings, all(a == answers[0] for a in answers)))
+    finally:
+        for engine in engines:
+            engine.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('reports', nargs='*', help='reports to run (default: all): ' +
+                        ', '.join(REPORTS))
+    parser.add_argument('--engine', choices=list(ENGINES), default='sqlite')
+    parser.add_argument('--sqlite-file', default=SQLITE_FILE)
+    parser.add_argument('--csv-dir', default='.', help='directory of the process_map csv files')
+    parser.add_argument('--benchmark', action='store_true', help='time both engines side by side')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.reports if name not in REPORTS]
+    if unknown:
+        parser.error('unknown report(s): ' + ', '.join(unknown))
+
+    if args.benchmark:
+        results = benchmark(args.sqlite_file, args.csv_dir, args.repeat, args.reports)
+        names = list(results[0][1]) if results else []
+        print('{0:<20}'.format('report') + ''.join('{0:>12}'.format(n) for n in names) + '  same')
+        for report, timings, same in results:
+            print('{0:<20}'.format(report) +
+                  ''.join('{0:>11.4f}s'.format(timings[n]) for n in names) +
+                  '  {0}'.format('yes' if same else 'NO'))
+        return
+
+    try:
+        engine = open_engine(args.engine, args.sqlite_file, args.csv_dir)
+    except ImportError:
+        parser.error('the {0} engine is not installed'.format(args.engine))
+    try:
+        for name, rows in run_reports(engine, args.reports).items():
+            print('{0}:'.format(REPORTS[name][0]))
+            pprint(rows)
+    finally:
+        engine.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+"""
+Compressed sparse row (CSR) road network built from the shaped ways.
+
+ways_nodes(id, node_id, position) already describes the street graph: every
+pair of consecutive nodes of a highway way is a road segment. RoadGraph
+turns the process_map csv output into flat arrays:
+
+    node_ids   vertex -> OSM node id (sorted, so id -> vertex is a bisect)
+    lats/lons  vertex coordinates
+    offsets    vertex -> first edge; edges of v are offsets[v]:offsets[v + 1]
+    targets    edge -> target vertex
+    weights    edge -> segment length in metres (great-circle)
+
+oneway=yes / oneway=-1 ways only get edges in the allowed direction. The
+graph supports connected components, Dijkstra and A* shortest paths and
+one-to-many queries, and is saved as one binary file that is memory-mapped
+on load, so a reload does not copy or parse anything:
+
+    graph = RoadGraph.from_csv('nodes.csv', 'ways_tags.csv', 'ways_nodes.csv')
+    graph.save('phoenix.graph')
+    graph = RoadGraph.load('phoenix.graph')
+    length, path = graph.shortest_path(graph.vertex(node_a), graph.vertex(node_b))
+"""
+from __future__ import division, print_function
+
+import argparse
+import array
+import bisect
+import heapq
+import math
+import struct
+import sys
+import time
+
+from . import osm_io
+from .id_bitmap import IdBitmap
+from .poi_index import haversine
+
+# highway values that are not (yet, or any longer) part of the road network
+EXCLUDED_HIGHWAYS = frozenset(['proposed', 'construction', 'abandoned', 'razed', 'platform'])
+
+_MAGIC = b'RGPH'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHQQ')  # magic, version, vertices, edges
+_INF = float('inf')
+
+
+def _oneway(value):
+    """1 for forward only, -1 for backward only, 0 for both directions"""
+    if value in ('yes', 'true', '1'):
+        return 1
+    if value == '-1':
+        return -1
+    return 0
+
+
+class RoadGraph(object):
+    """Directed road graph in CSR form"""
+
+    def __init__(self, node_ids, lats, lons, offsets, targets, weights, owner=None):
+        self.node_ids = node_ids
+        self.lats = lats
+        self.lons = lons
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self._owner = owner  # keeps the mmap (and file) alive for loaded graphs
+        self.dropped = 0  # edges left out by from_segments for lack of coordinates
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    # ================================================== #
+    #               Building                             #
+    # ================================================== #
+    @classmethod
+    def from_csv(cls, nodes_path, ways_tags_path, ways_nodes_path,
+                 excluded=EXCLUDED_HIGHWAYS):
+        """Build the graph from the nodes / ways_tags / ways_nodes csv files"""
+        highways = {}  # way id -> oneway direction
+        oneway = {}
+        for row in osm_io.iter_csv(ways_tags_path):
+            if row['type'] != 'regular':
+                continue
+            if row['key'] == 'highway' and row['value'] not in excluded:
+                highways[int(row['id'])] = 0
+            elif row['key'] == 'oneway':
+                oneway[int(row['id'])] = _oneway(row['value'])
+        for way_id in highways:
+            highways[way_id] = oneway.get(way_id, 0)
+
+        def segments():
+            way, previous = None, None
+            for row in osm_io.iter_csv(ways_nodes_path):
+                way_id, node_id = int(row['id']), int(row['node_id'])
+                if way_id != way:
+                    way, previous = way_id, None
+                if way_id in highways:
+                    if previous is not None and previous != node_id:
+                        yield previous, node_id, highways[way_id]
+                    previous = node_id
+
+        return cls.from_segments(segments(), osm_io.iter_csv(nodes_path))
+
+    @classmethod
+    def from_segments(cls, segments, nodes):
+        """Build the graph from (from id, to id, oneway) segments and node rows"""
+        sources, dests = osm_io.id_array(), osm_io.id_array()
+        vertices = IdBitmap()
+        for a, b, direction in segments:
+            vertices.add(a)
+            vertices.add(b)
+            if direction >= 0:
+                sources.append(a)
+                dests.append(b)
+            if direction <= 0:
+                sources.append(b)
+                dests.append(a)
+
+        node_ids = osm_io.id_array(vertices)
+        n = len(node_ids)
+        lats = array.array('d', [0.0]) * n
+        lons = array.array('d', [0.0]) * n
+        located = IdBitmap()
+        for row in nodes:
+            node_id = int(row['id'])
+            if node_id in vertices:
+                v = bisect.bisect_left(node_ids, node_id)
+                lats[v], lons[v] = float(row['lat']), float(row['lon'])
+                located.add(node_id)
+
+        # a vertex without a nodes.csv row would sit at (0, 0); drop it and
+        # every segment touching it rather than route over bogus distances
+        dropped = 0
+        if len(located) < n:
+            keep = [v for v in range(n) if node_ids[v] in located]
+            lats = array.array('d', (lats[v] for v in keep))
+            lons = array.array('d', (lons[v] for v in keep))
+            node_ids = osm_io.id_array(node_ids[v] for v in keep)
+            n = len(node_ids)
+            kept_sources, kept_dests = osm_io.id_array(), osm_io.id_array()
+            for a, b in zip(sources, dests):
+                if a in located and b in located:
+                    kept_sources.append(a)
+                    kept_dests.append(b)
+            dropped = len(sources) - len(kept_sources)
+            sources, dests = kept_sources, kept_dests
+
+        # counting sort of the edges by source vertex
+        src = array.array('I', (bisect.bisect_left(node_ids, a) for a in sources))
+        dst = array.array('I', (bisect.bisect_left(node_ids, b) for b in dests))
+        offsets = array.array('I', [0]) * (n + 1)
+        for v in src:
+            offsets[v + 1] += 1
+        for v in range(n):
+            offsets[v + 1] += offsets[v]
+        fill = array.array('I', offsets)
+        targets = array.array('I', [0]) * len(src)
+        weights = array.array('f', [0.0]) * len(src)
+        for u, v in zip(src, dst):
+            i = fill[u]
+            fill[u] += 1
+            targets[i] = v
+            weights[i] = haversine(lats[u], lons[u], lats[v], lons[v])
+        graph = cls(node_ids, lats, lons, offsets, targets, weights)
+        graph.dropped = dropped
+        return graph
+
+    # ================================================== #
+    #               Storage                              #
+    # ================================================== #
+    def _sections(self):
+        return [self.node_ids, self.lats, self.lons, self.offsets, self.targets, self.weights]
+
+    def save(self, path):
+        """Write the arrays little-endian, each section padded to 8 bytes"""
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(self), self.edge_count))
+            f.write(b'\0' * (-_HEADER.size % 8))
+            for arr in self._sections():
+                osm_io.write_array(f, arr)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved graph (python 3) or read it into arrays (python 2)"""
+        with open(path, 'rb') as f:
+            magic, version, n, m = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("{0} is not a road graph file".format(path))
+            layout = [(osm_io.ID_TYPECODE, n), ('d', n), ('d', n), ('I', n + 1), ('I', m), ('f', m)]
+            sections, data = osm_io.read_arrays(f, _HEADER.size + (-_HEADER.size % 8), layout)
+        return cls(*sections, owner=data)
+
+    # ================================================== #
+    #               Queries                              #
+    # ================================================== #
+    def vertex(self, node_id):
+        """Vertex index of an OSM node id, or None if it is not on the graph"""
+        v = bisect.bisect_left(self.node_ids, node_id)
+        if v < len(self.node_ids) and self.node_ids[v] == node_id:
+            return v
+        return None
+
+    def nearest_vertex(self, lat, lon):
+        """Closest vertex to a point (linear scan)"""
+        coslat = math.cos(math.radians(lat))
+        lats, lons = self.lats, self.lons
+        return min(range(len(self)),
+                   key=lambda v: (lats[v] - lat) ** 2 + ((lons[v] - lon) * coslat) ** 2)
+
+    def neighbours(self, v):
+        for i in range(self.offsets[v], self.offsets[v + 1]):
+            yield self.targets[i], self.weights[i]
+
+    def connected_components(self):
+        """Weakly connected components; returns (labels, sizes largest first)"""
+        n = len(self)
+        parent = array.array('I', range(n))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        offsets, targets = self.offsets, self.targets
+        for u in range(n):
+            for i in range(offsets[u], offsets[u + 1]):
+                a, b = find(u), find(targets[i])
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        labels = array.array('I', (find(v) for v in range(n)))
+        sizes = {}
+        for root in labels:
+            sizes[root] = sizes.get(root, 0) + 1
+        return labels, sorted(sizes.values(), reverse=True)
+
+    def dijkstra(self, source, targets=None, max_distance=_INF):
+        """Distances from source; stops early once all targets are settled"""
+        offsets, edge_targets, weights = self.offsets, self.targets, self.weights
+        remaining = set(targets) if targets is not None else None
+        dist = {source: 0.0}
+        pred = {source: None}
+        heap = [(0.0, source)]
+        done = set()
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            for i in range(offsets[u], offsets[u + 1]):
+                v = edge_targets[i]
+                nd = d + weights[i]
+                if nd < dist.get(v, _INF) and nd <= max_distance:
+                    dist[v] = nd
+                    pred[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred
+
+    def astar(self, source, target):
+        """Shortest path with the great-circle distance as heuristic"""
+        offsets, edge_targets, weights = self.offsets, self.targets, self.weights
+        lats, lons = self.lats, self.lons
+        tlat, tlon = lats[target], lons[target]
+        dist = {source: 0.0}
+        pred = {source: None}
+        heap = [(haversine(lats[source], lons[source], tlat, tlon), source)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if u in done:
+                continue
+            done.add(u)
+            d = dist[u]
+            for i in range(offsets[u], offsets[u + 1]):
+                v = edge_targets[i]
+                nd = d + weights[i]
+                if nd < dist.get(v, _INF):
+                    dist[v] = nd
+                    pred[v] = u
+                    # edge weights are float32; shave a little off the heuristic so
+                    # rounding can never make it overestimate
+                    h = haversine(lats[v], lons[v], tlat, tlon) * 0.9999
+                    heapq.heappush(heap, (nd + h, v))
+        return dist, pred
+
+    @staticmethod
+    def _path(pred, target):
+        if target not in pred:
+            return None
+        path = []
+        while target is not None:
+            path.append(target)
+            target = pred[target]
+        return path[::-1]
+
+    def shortest_path(self, source, target, method='astar'):
+        """Return (length in metres, [vertices]) or (inf, None) if unreachable"""
+        if method == 'astar':
+            dist, pred = self.astar(source, target)
+        else:
+            dist, pred = self.dijkstra(source, [target])
+        path = self._path(pred, target)
+        return (dist[target], path) if path else (_INF, None)
+
+    def one_to_many(self, source, targets):
+        """Distances from source to each target (inf when unreachable), one search"""
+        dist, _ = self.dijkstra(source, targets)
+        return [dist.get(t, _INF) for t in targets]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    sub = parser.add_subparsers(dest='command')
+    build = sub.add_parser('build', help='build the graph from process_map csv files')
+    build.add_argument('out')
+    build.add_argument('--nodes', default='nodes.csv')
+    build.add_argument('--ways-tags', default='ways_tags.csv')
+    build.add_argument('--ways-nodes', default='ways_nodes.csv')
+    route = sub.add_parser('route', help='shortest path between two OSM node ids')
+    route.add_argument('graph')
+    route.add_argument('source', type=int)
+    route.add_argument('target', type=int)
+    info = sub.add_parser('components', help='print connected component sizes')
+    info.add_argument('graph')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.command == 'build':
+        graph = RoadGraph.from_csv(args.nodes, args.ways_tags, args.ways_nodes)
+        graph.save(args.out)
+        print('{0} vertices, {1} edges, built in {2:.1f}s'.format(
+            len(graph), graph.edge_count, time.time() - start))
+        if graph.dropped:
+            print('{0} edges dropped: endpoints missing from {1}'.format(
+                graph.dropped, args.nodes), file=sys.stderr)
+        return 0
+    graph = RoadGraph.load(args.graph)
+    if args.command == 'route':
+        source, target = graph.vertex(args.source), graph.vertex(args.target)
+        if source is None or target is None:
+            print('Node not on the road graph')
+            return 1
+        length, path = graph.shortest_path(source, target)
+        if path is None:
+            print('No route')
+            return 1
+        print('{0:.0f} m via {1} nodes'.format(length, len(path)))
+        print(' '.join(str(graph.node_ids[v]) for v in path))
+    elif args.command == 'components':
+        _, sizes = graph.connected_components()
+        print('{0} components, largest: {1}'.format(len(sizes), sizes[:10]))
+    print('Took {0:.3f}s'.format(time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,250 @@
+"""
+Shape OSM nodes and ways into the five csv files loaded into SQLite.
+
+This is the "Complete Code" section of OSM_Code.py as importable functions:
+shape_element turns one node, way or relation into dicts matching schema.SCHEMA, and
+process_map streams an .osm file through it into
+
+    nodes.csv  nodes_tags.csv  ways.csv  ways_nodes.csv  ways_tags.csv
+    relations.csv  relations_tags.csv  relations_members.csv
+
+cerberus is only imported when validate=True.
+
+    process_map('phoenix_arizona.osm', validate=False, out_dir='phoenix')
+"""
+import csv
+import os
+import re
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from . import profiling
+from .osm_io import PY2, open_csv, timestamp_to_epoch
+
+NODES_PATH = "nodes.csv"
+NODE_TAGS_PATH = "nodes_tags.csv"
+WAYS_PATH = "ways.csv"
+WAY_NODES_PATH = "ways_nodes.csv"
+WAY_TAGS_PATH = "ways_tags.csv"
+RELATIONS_PATH = "relations.csv"
+RELATION_TAGS_PATH = "relations_tags.csv"
+RELATION_MEMBERS_PATH = "relations_members.csv"
+
+LOWER_COLON = re.compile(r'^([a-z]|_)+:([a-z]|_)+')
+PROBLEMCHARS = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+NODE_FIELDS = ['id', 'lat', 'lon', 'user', 'uid', 'version', 'changeset', 'timestamp']
+NODE_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+WAY_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+WAY_NODES_FIELDS = ['id', 'node_id', 'position']
+RELATION_FIELDS = ['id', 'user', 'uid', 'version', 'changeset', 'timestamp']
+RELATION_TAGS_FIELDS = ['id', 'key', 'value', 'type']
+RELATION_MEMBERS_FIELDS = ['id', 'member_type', 'member_id', 'role', 'position']
+
+_TEXT = type(u'')
+
+
+def shape_tags(element, problem_chars=PROBLEMCHARS, default_tag_type='regular',
+               cleaning_rules=None):
+    """Shape the <tag> children of element
+
+    As in the notebook, a key that starts with a problem character is kept
+    with an empty key and type; the rest of the key is not checked.
+    """
+    tags = []
+    for tag in element.iter('tag'):
+        k = tag.attrib['k']
+        tag_dict = {'id': element.attrib['id'], 'value': tag.attrib['v']}
+        if problem_chars.match(k):
+            tag_dict['type'] = tag_dict['key'] = ''
+        elif ':' in k:
+            tag_dict['type'], tag_dict['key'] = k.split(':', 1)
+        else:
+            tag_dict['type'] = default_tag_type
+            tag_dict['key'] = k
+        if cleaning_rules is not None:
+            tag_dict['value'] = cleaning_rules.clean(k, tag_dict['value'])
+        tags.append(tag_dict)
+    return tags
+
+
+def shape_element(element, node_attr_fields=NODE_FIELDS, way_attr_fields=WAY_FIELDS,
+                  problem_chars=PROBLEMCHARS, default_tag_type='regular', cleaning_rules=None,
+                  relation_attr_fields=RELATION_FIELDS):
+    """Clean and shape node, way or relation XML element to Python dict
+
+    cleaning_rules (a cleaning_rules.RuleSet) cleans tag values on the way through, e.g.
+    RuleSet.load(RULES_PATH) for the street, postcode and phone rules.
+    """
+    tags = shape_tags(element, problem_chars, default_tag_type, cleaning_rules)
+    if element.tag == 'node':
+        node_attribs = {field: element.attrib[field] for field in node_attr_fields}
+        node_attribs['timestamp'] = timestamp_to_epoch(node_attribs['timestamp'])
+        return {'node': node_attribs, 'node_tags': tags}
+    elif element.tag == 'way':
+        way_attribs = {field: element.attrib[field] for field in way_attr_fields}
+        way_attribs['timestamp'] = timestamp_to_epoch(way_attribs['timestamp'])
+        way_nodes = [{'id': element.attrib['id'], 'node_id': nd.attrib['ref'], 'position': i}
+                     for i, nd in enumerate(element.iter('nd'))]
+        return {'way': way_attribs, 'way_nodes': way_nodes, 'way_tags': tags}
+    elif element.tag == 'relation':
+        relation_attribs = {field: element.attrib[field] for field in relation_attr_fields}
+        relation_attribs['timestamp'] = timestamp_to_epoch(relation_attribs['timestamp'])
+        members = [{'id': element.attrib['id'], 'member_type': member.attrib['type'],
+                    'member_id': member.attrib['ref'], 'role': member.attrib.get('role', ''),
+                    'position': i}
+                   for i, member in enumerate(element.iter('member'))]
+        return {'relation': relation_attribs, 'relation_members': members,
+                'relation_tags': tags}
+
+
+# ================================================== #
+#               Helper Functions                     #
+# ================================================== #
+def get_element(osm_file, tags=('node', 'way', 'relation'), keep=None):
+    """Yield element if it is the right type of tag (and keep(element) is true, if given)"""
+
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in tags:
+            if keep is None or keep(elem):
+                yield elem
+            root.clear()
+
+
+def validate_element(element, validator, schema=None):
+    """Raise ValidationError if element does not match schema"""
+    import cerberus
+    if schema is None:
+        from .schema import SCHEMA as schema
+    if validator.validate(element, schema) is not True:
+        field, errors = next(iter(validator.errors.items()))
+        message_string = "\nElement of type '{0}' has the following errors:\n{1}"
+        error_strings = (
+            "{0}: {1}".format(k, v if isinstance(v, str) else ", ".join(v))
+            for k, v in errors.items()
+        )
+        raise cerberus.ValidationError(
+            message_string.format(field, "\n".join(error_strings))
+        )
+
+
+class UnicodeDictWriter(csv.DictWriter, object):
+    """Extend csv.DictWriter to handle Unicode input (on python 2)"""
+
+    def writerow(self, row):
+        if PY2:
+            row = {k: (v.encode('utf-8') if isinstance(v, _TEXT) else v) for k, v in row.items()}
+        super(UnicodeDictWriter, self).writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+
+# (csv file, field names, shaped element key) for every file process_map writes
+OUTPUTS = [
+    (NODES_PATH, NODE_FIELDS, 'node'),
+    (NODE_TAGS_PATH, NODE_TAGS_FIELDS, 'node_tags'),
+    (WAYS_PATH, WAY_FIELDS, 'way'),
+    (WAY_NODES_PATH, WAY_NODES_FIELDS, 'way_nodes'),
+    (WAY_TAGS_PATH, WAY_TAGS_FIELDS, 'way_tags'),
+    (RELATIONS_PATH, RELATION_FIELDS, 'relation'),
+    (RELATION_TAGS_PATH, RELATION_TAGS_FIELDS, 'relation_tags'),
+    (RELATION_MEMBERS_PATH, RELATION_MEMBERS_FIELDS, 'relation_members'),
+]
+
+
+class CsvWriters(object):
+    """The csv files of one output directory; write() takes shape_element() dicts"""
+
+    def __init__(self, out_dir='.', mode='w'):
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        self.files = []
+        self.writers = {}
+        for name, fields, key in OUTPUTS:
+            path = os.path.join(out_dir, name)
+            header = mode == 'w' or not os.path.exists(path)
+            if mode == 'w' and os.path.exists(path):
+                os.remove(path)  # a new file: the stage cache may hold a hard link to the old one
+            f = open_csv(path, mode)
+            self.files.append(f)
+            self.writers[key] = UnicodeDictWriter(f, fields)
+            if header:
+                self.writers[key].writeheader()
+
+    def write(self, el):
+        for key, value in el.items():
+            if isinstance(value, list):
+                self.writers[key].writerows(value)
+            else:
+                self.writers[key].writerow(value)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ================================================== #
+#               Main Function                        #
+# ================================================== #
+def process_map(file_in, validate, element_filter=None, integrity_checker=None,
+                stream_stats=None, cleaning_rules=None, out_dir='.', writer=None):
+    """Iteratively process each XML element and write to csv(s) in out_dir
+
+    element_filter (an osm_filter.ElementFilter) restricts the output to a bbox/polygon
+    and/or tag predicates; it costs one extra light pass over the file but skips shaping,
+    validating and writing every element that is not selected.
+
+    integrity_checker (an osm_integrity.IntegrityChecker) is fed every shaped element and
+    collects dangling way -> node references, duplicate ids and ordering violations.
+
+    stream_stats (an osm_sketches.StreamStats) builds the unique user / top contributor /
+    top tag sketches in the same pass, so those reports are ready without loading SQLite.
+
+    cleaning_rules (a cleaning_rules.RuleSet) is handed to shape_element so cleaned values
+    reach the csv files in the same pass; cleaning_rules.hits() has the per-rule counts.
+
+    writer replaces the csv files in out_dir with another object with the CsvWriters
+    interface, e.g. a tiles.TileWriter that partitions the output by quadkey tile.
+
+    With OSM_PROFILE set (see profiling.py) get_element, shape_element, validate_element
+    and the writes are timed and profiled as separate stages.
+    """
+
+    keep = element_filter.select(file_in) if element_filter is not None else None
+    if validate is True:
+        import cerberus
+        validator = cerberus.Validator()
+
+    with profiling.profiled('shape') as profiler, writer or CsvWriters(out_dir) as writer:
+        elements = get_element(file_in, tags=('node', 'way', 'relation'), keep=keep)
+        shape, validate_el, write = shape_element, validate_element, writer.write
+        if profiler is not None:
+            elements = profiler.iterate('get_element', elements)
+            shape = profiler.wrap('shape_element', shape)
+            validate_el = profiler.wrap('validate_element', validate_el)
+            write = profiler.wrap('write', write)
+
+        for element in elements:
+            el = shape(element, cleaning_rules=cleaning_rules)
+            if el:
+                if validate is True:
+                    validate_el(el, validator)
+                if integrity_checker is not None:
+                    integrity_checker.check(el)
+                if stream_stats is not None:
+                    stream_stats.add_shaped(el)
+                write(el)
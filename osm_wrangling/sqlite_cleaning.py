@@ -0,0 +1,80 @@
+"""
+Apply the street, postcode and phone cleaning rules inside SQLite.
+
+The normalizers from cleaning.py are registered as deterministic SQL
+functions on the connection, so a cleanup is a single set-based UPDATE per
+rule instead of a Python round trip per row:
+
+    UPDATE nodes_tags SET value = clean_phone(value) WHERE key = 'phone'
+
+apply_cleaning() runs every rule against nodes_tags and ways_tags in one
+transaction and returns the number of rows each rule changed.
+
+    python -m osm_wrangling.sqlite_cleaning OpenStreetMap2.db
+"""
+from __future__ import print_function
+
+import argparse
+import sqlite3
+import time
+
+from . import cleaning
+
+FUNCTIONS = {
+    'clean_street': cleaning.clean_street,
+    'clean_zip': cleaning.clean_zip,
+    'clean_phone': cleaning.clean_phone,
+}
+
+# (rule name, WHERE clause selecting the tag rows, SQL function)
+RULES = [
+    ('street', "key = 'street' AND type = 'addr'", 'clean_street'),
+    ('postcode', "key = 'postcode' AND type = 'addr'", 'clean_zip'),
+    ('phone', "key = 'phone' AND type = 'regular'", 'clean_phone'),
+]
+
+TAG_TABLES = ('nodes_tags', 'ways_tags')
+
+
+def register_functions(conn):
+    """Register the cleaning functions on a sqlite3 connection"""
+    for name, func in FUNCTIONS.items():
+        try:
+            conn.create_function(name, 1, func, deterministic=True)
+        except (TypeError, sqlite3.NotSupportedError):
+            # python < 3.8 or SQLite < 3.8.3 do not know about deterministic functions
+            conn.create_function(name, 1, func)
+
+
+def apply_cleaning(conn, rules=RULES, tables=TAG_TABLES):
+    """Run every rule as one UPDATE per table; return {(table, rule): rows changed}"""
+    register_functions(conn)
+    changed = {}
+    with conn:
+        for table in tables:
+            for rule, where, func in rules:
+                cur = conn.execute(
+                    'UPDATE {0} SET value = {1}(value) '
+                    'WHERE {2} AND value IS NOT {1}(value)'.format(table, func, where))
+                changed[(table, rule)] = cur.rowcount
+    return changed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('sqlite_file', nargs='?', default='OpenStreetMap2.db')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.sqlite_file)
+    try:
+        start = time.time()
+        changed = apply_cleaning(conn)
+    finally:
+        conn.close()
+    for (table, rule), count in sorted(changed.items()):
+        print('{0:<12} {1:<10} {2:>8} rows changed'.format(table, rule, count))
+    print('Took {0:.2f}s'.format(time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
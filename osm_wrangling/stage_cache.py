@@ -0,0 +1,351 @@
+"""
+Content-addressed cache for the pipeline stages: audit, shape and load.
+
+Every stage run is keyed by a fingerprint of what it depends on:
+
+  - its input files, by size and mtime (or by sha256 with hash_inputs=True);
+  - its parameters, including where it writes;
+  - the code that implements it: a hash of the source of its modules.
+
+When the fingerprint of a run matches a recorded one the stage is skipped
+and its recorded result is returned. Output files are kept in a
+content-addressed object store (objects/ab/cdef...), so outputs that were
+overwritten by a run with other inputs are restored instead of rebuilt.
+They are hard-linked into the store, which then costs no extra disk while
+the outputs are in place; where the file system cannot link they are copied,
+which doubles the disk used by a full extract's csv files. The pipeline's
+writers replace their files rather than rewrite them, so a linked object
+keeps its contents; one that changed size anyway is not restored. Objects no
+longer referred to by a record stay until "cache prune" deletes them. The
+database is too large to copy and is changed in place by later steps, so
+the load stage stamps its fingerprint into the database instead and is
+reused while that stamp is there.
+
+    cache = StageCache()
+    result = cached_audit(cache, 'phoenix_arizona.osm')
+    cached_shape(cache, 'phoenix_arizona.osm', rules_path=RULES_PATH)
+    cached_load(cache, 'OpenStreetMap2.db')
+
+StageCache(force=True) reruns everything, StageCache(force=['load']) only
+the named stages; invalidate(['shape']) drops the records of one stage.
+
+    python -m osm_wrangling.stage_cache list
+    python -m osm_wrangling.stage_cache clear shape
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import time
+
+CACHE_DIR = '.osm_cache'
+STAGES = ('audit', 'shape', 'load')
+BLOCK_SIZE = 1 << 20
+PICKLE_PROTOCOL = 2  # readable from python 2 and 3
+
+
+def file_digest(path):
+    """sha256 hex digest of the contents of path"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(path, hash_inputs=False):
+    """What a stage's fingerprint records about one input file"""
+    st = os.stat(path)
+    signature = {'path': os.path.abspath(path), 'size': st.st_size}
+    if hash_inputs:
+        signature['sha256'] = file_digest(path)
+    else:
+        signature['mtime'] = st.st_mtime
+    return signature
+
+
+def code_version(modules):
+    """sha1 of the source files of modules, so editing the code invalidates its stages"""
+    digest = hashlib.sha1()
+    for module in modules:
+        source = module.__file__
+        if source.endswith(('.pyc', '.pyo')):
+            source = source[:-1]
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class StageCache(object):
+    """Records stage runs under cache_dir and skips runs whose fingerprint was seen before"""
+
+    def __init__(self, cache_dir=CACHE_DIR, force=False, hash_inputs=False):
+        self.cache_dir = cache_dir
+        self.force = force
+        self.hash_inputs = hash_inputs
+        self.hits = []
+        self.misses = []
+
+    def _forced(self, stage):
+        return self.force is True or (self.force and stage in self.force)
+
+    def _record_path(self, stage, key, ext='.json'):
+        return os.path.join(self.cache_dir, 'stages', stage, key + ext)
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest[2:])
+
+    def fingerprint(self, stage, inputs=(), params=None, code=()):
+        """Return (key, spec): the sha256 key of a stage run and the spec it hashes"""
+        spec = {'stage': stage,
+                'inputs': [file_signature(path, self.hash_inputs) for path in inputs],
+                'params': params or {},
+                'code': code_version(code)}
+        blob = json.dumps(spec, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(blob).hexdigest(), spec
+
+    def run(self, stage, func, inputs=(), params=None, code=(), outputs=(), check=None, stamp=None):
+        """Return func(), or the recorded result of an earlier run with the same fingerprint
+
+        outputs are files func writes (or a function returning them, called after func);
+        they are stored and restored with the result.
+        check(key) and stamp(key) verify and mark outputs kept elsewhere (the database).
+        """
+        key, spec = self.fingerprint(stage, inputs, params, code)
+        if not self._forced(stage):
+            found, result = self._lookup(stage, key, check)
+            if found:
+                self.hits.append(stage)
+                return result
+        self.misses.append(stage)
+        start = time.time()
+        result = func()
+        if stamp is not None:
+            stamp(key)
+        if callable(outputs):
+            outputs = outputs()
+        record = {'spec': spec, 'seconds': time.time() - start, 'created': time.time(),
+                  'outputs': dict((os.path.abspath(path), self._store(path)) for path in outputs)}
+        self._write(self._record_path(stage, key, '.pickle'),
+                    pickle.dumps(result, PICKLE_PROTOCOL))
+        self._write(self._record_path(stage, key),
+                    json.dumps(record, sort_keys=True, indent=1).encode('utf-8'))
+        return result
+
+    def _lookup(self, stage, key, check):
+        try:
+            with open(self._record_path(stage, key), 'rb') as f:
+                record = json.loads(f.read().decode('utf-8'))
+            with open(self._record_path(stage, key, '.pickle'), 'rb') as f:
+                result = pickle.loads(f.read())
+        except (IOError, OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if check is not None and not check(key):
+            return False, None
+        for path, stored in record['outputs'].items():
+            if not self._restore(path, stored):
+                return False, None
+        return True, result
+
+    def _write(self, path, data):
+        """Write data to path atomically, so an interrupted run leaves no half record"""
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    def _store(self, path):
+        """Link (or copy) an output file into the object store; return its {size, mtime, sha256}"""
+        st = os.stat(path)
+        digest = file_digest(path)
+        target = self._object_path(digest)
+        if not os.path.exists(target):
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            try:
+                os.link(path, target)
+            except (OSError, AttributeError):  # another device, no hard links, or no os.link
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+                os.close(fd)
+                shutil.copyfile(path, tmp)
+                os.utime(tmp, (st.st_atime, st.st_mtime))
+                os.rename(tmp, target)
+        return {'size': st.st_size, 'mtime': st.st_mtime, 'sha256': digest}
+
+    def _restore(self, path, stored):
+        """Make sure output path holds the stored object; False if it cannot be restored"""
+        try:
+            st = os.stat(path)
+            if st.st_size == stored['size'] and st.st_mtime == stored['mtime']:
+                return True
+        except OSError:
+            pass
+        source = self._object_path(stored['sha256'])
+        if not os.path.exists(source) or os.path.getsize(source) != stored['size']:
+            return False  # pruned, or rewritten in place through a hard link
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if os.path.exists(path):
+            os.remove(path)  # it may be a hard link to another object
+        shutil.copyfile(source, path)
+        os.utime(path, (stored['mtime'], stored['mtime']))
+        return True
+
+    def records(self, stages=STAGES):
+        """Yield (stage, key, record) for every recorded run"""
+        for stage in stages:
+            directory = os.path.join(self.cache_dir, 'stages', stage)
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.json'):
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        yield stage, name[:-5], json.loads(f.read().decode('utf-8'))
+
+    def invalidate(self, stages=STAGES):
+        """Forget every recorded run of stages; stored objects stay until prune()"""
+        for stage in stages:
+            directory = os.path.join(self.cache_dir, 'stages', stage)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory)
+
+    def prune(self):
+        """Delete stored objects no record refers to; return the bytes freed"""
+        referenced = set(stored['sha256'] for _, _, record in self.records()
+                         for stored in record['outputs'].values())
+        freed = 0
+        objects = os.path.join(self.cache_dir, 'objects')
+        for directory, _, names in os.walk(objects):
+            for name in names:
+                if os.path.basename(directory) + name not in referenced:
+                    path = os.path.join(directory, name)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return freed
+
+
+# ================================================== #
+#               Cached Stages                        #
+# ================================================== #
+def cached_audit(cache, osm_file):
+    """audit.audit(osm_file), reused while the file and the audit code are unchanged"""
+    from . import audit, cleaning
+    return cache.run('audit', lambda: audit.audit(osm_file), inputs=[osm_file],
+                     code=[audit, cleaning])
+
+
+def cached_shape(cache, osm_file, out_dir='.', validate=False, rules_path=None, bbox=None,
+                 tags=(), tile_zoom=None, way_tile='first'):
+    """process_map into out_dir, skipped (or restored) while its inputs are unchanged
+
+    bbox is (minlat, minlon, maxlat, maxlon) and tags are osm_filter predicates, as for
+    python -m osm_wrangling shape; with tile_zoom the output is split into quadkey tiles.
+    """
+    from . import cleaning, cleaning_rules, osm_filter, osm_io, schema, shape, tiles
+    writers = []  # the TileWriter build() used, for its list of tile files
+
+    def build():
+        element_filter = rules = None
+        if bbox or tags:
+            element_filter = osm_filter.ElementFilter(
+                osm_filter.BBox(*bbox) if bbox else None,
+                [osm_filter.parse_tag_predicate(t) for t in tags])
+        if rules_path:
+            rules = cleaning_rules.RuleSet.load(rules_path)
+        writer = None
+        if tile_zoom:
+            writer = tiles.TileWriter(out_dir, tile_zoom, way_tile)
+            writers.append(writer)
+        shape.process_map(osm_file, validate, element_filter=element_filter,
+                          cleaning_rules=rules, out_dir=out_dir, writer=writer)
+
+    if tile_zoom:
+        outputs = lambda: writers[0].paths()
+    else:
+        outputs = [os.path.join(out_dir, name) for name, _, _ in shape.OUTPUTS]
+    params = {'out_dir': os.path.abspath(out_dir), 'validate': bool(validate),
+              'bbox': list(bbox) if bbox else None, 'tags': list(tags),
+              'tile_zoom': tile_zoom, 'way_tile': way_tile if tile_zoom else None}
+    return cache.run('shape', build, inputs=[osm_file] + ([rules_path] if rules_path else []),
+                     params=params, outputs=outputs,
+                     code=[shape, schema, osm_io, osm_filter, cleaning, cleaning_rules, tiles])
+
+
+def _db_stamp(sqlite_file, stage):
+    if not os.path.exists(sqlite_file):
+        return None
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        return conn.execute('SELECT key FROM stage_cache WHERE stage = ?', (stage,)).fetchone()[0]
+    except (sqlite3.Error, TypeError):
+        return None
+    finally:
+        conn.close()
+
+
+def _stamp_db(sqlite_file, stage, key):
+    conn = sqlite3.connect(sqlite_file)
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS stage_cache(stage TEXT PRIMARY KEY, key TEXT)')
+        conn.execute('INSERT OR REPLACE INTO stage_cache(stage, key) VALUES (?, ?)', (stage, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def cached_load(cache, sqlite_file, csv_dir='.'):
+    """load.load(sqlite_file, csv_dir), skipped while the database holds a load of the same csv files"""
+    from . import address_index, cleaning, edit_history, load, osm_io, relations, tag_search
+
+    def build():
+        if os.path.exists(sqlite_file):
+            _stamp_db(sqlite_file, 'load', None)  # a load that fails half way must not match
+        return load.load(sqlite_file, csv_dir)
+
+    csv_files = [os.path.join(csv_dir, csv_name) for table, (csv_name, _, _) in load.TABLES.items()
+                 if table not in load.OPTIONAL_TABLES or os.path.exists(os.path.join(csv_dir, csv_name))]
+    return cache.run('load', build, inputs=csv_files,
+                     params={'sqlite_file': os.path.abspath(sqlite_file)},
+                     code=[load, tag_search, address_index, edit_history, relations, cleaning,
+                           osm_io],
+                     check=lambda key: _db_stamp(sqlite_file, 'load') == key,
+                     stamp=lambda key: _stamp_db(sqlite_file, 'load', key))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    sub = parser.add_subparsers(dest='command', metavar='command')
+    sub.required = True
+    sub.add_parser('list', help='list the recorded stage runs')
+    clear = sub.add_parser('clear', help='forget the recorded runs of some (default: all) stages')
+    clear.add_argument('stages', nargs='*', metavar='stage', help=', '.join(STAGES))
+    sub.add_parser('prune', help='delete stored outputs no recorded run refers to')
+    args = parser.parse_args(argv)
+
+    cache = StageCache(args.cache_dir)
+    if args.command == 'list':
+        for stage, key, record in cache.records():
+            print('{0:<6} {1}  {2}  {3:8.2f}s  {4}'.format(
+                stage, key[:12], time.strftime('%Y-%m-%d %H:%M', time.localtime(record['created'])),
+                record['seconds'], ' '.join(s['path'] for s in record['spec']['inputs'])))
+    elif args.command == 'clear':
+        unknown = set(args.stages) - set(STAGES)
+        if unknown:
+            parser.error('unknown stage(s): ' + ', '.join(sorted(unknown)))
+        cache.invalidate(args.stages or STAGES)
+    else:
+        print('freed {0} bytes'.format(cache.prune()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Suggest street-type mapping entries from the data instead of by eye.
+
+The mapping dictionaries in cleaning.py were built by reading audit output,
+which does not scale to a state-wide extract with hundreds of thousands of
+distinct street names, and comparing every name with every other is O(n^2).
+This miner works on street *types* (the last word of the name, after the
+suite/unit part is dropped) instead:
+
+  1. count every distinct type, weighted by how often its street names occur;
+  2. build the canonical vocabulary from the USPS street types plus any
+     type frequent enough in the data to be trusted, unless it is itself a
+     variant of a USPS type;
+  3. block the vocabulary by first letter and character bigrams, so each
+     unexpected type is only scored against a handful of candidates;
+  4. score candidates as abbreviations (a subsequence sharing first and last
+     letter: "Blvd" -> "Boulevard"), case variants ("RD" -> "Road") or typos
+     ("Boulavard" -> "Boulevard"), and rank the suggestions by frequency.
+
+check_mapping() uses the same vocabulary to flag existing mapping entries
+that look wrong, such as a target that is not a street type.
+
+    python -m osm_wrangling.street_suffixes --osm phoenix_arizona.osm
+    python -m osm_wrangling.street_suffixes --csv nodes_tags.csv ways_tags.csv
+"""
+from __future__ import division, print_function
+
+import argparse
+import difflib
+import time
+from collections import Counter, defaultdict
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from . import cleaning, osm_io
+
+# USPS Publication 28 primary street suffix names seen in US extracts
+STREET_TYPES = [
+    "Alley", "Avenue", "Bend", "Boulevard", "Bypass", "Causeway", "Center",
+    "Circle", "Commons", "Court", "Cove", "Creek", "Crossing", "Drive",
+    "Expressway", "Freeway", "Gateway", "Glen", "Highway", "Hill", "Hollow",
+    "Junction", "Lane", "Loop", "Mall", "Meadows", "Mountain", "Parkway",
+    "Pass", "Path", "Pike", "Place", "Plaza", "Point", "Ridge", "Road",
+    "Row", "Run", "Square", "Street", "Terrace", "Trace", "Trail", "Turnpike",
+    "View", "Vista", "Walk", "Way",
+]
+
+MIN_VOCABULARY_COUNT = 50
+MIN_SCORE = 0.6
+
+
+def street_type(name):
+    """Last word of a street name, after suite/unit parts are dropped"""
+    name = cleaning.street_unit_re.sub('', name).strip()
+    m = cleaning.street_type_re.search(name)
+    return m.group() if m else None
+
+
+# ================================================== #
+#               Collecting Street Names              #
+# ================================================== #
+def names_from_osm(osm_file):
+    """Count addr:street values in an OSM file"""
+    names = Counter()
+    context = ET.iterparse(osm_file, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag in ('node', 'way'):
+            for tag in elem.iter('tag'):
+                if tag.attrib['k'] == 'addr:street':
+                    names[tag.attrib['v']] += 1
+            root.clear()
+    return names
+
+
+def names_from_csv(*paths):
+    """Count addr:street values in nodes_tags / ways_tags csv files"""
+    names = Counter()
+    for path in paths:
+        for row in osm_io.iter_csv(path):
+            if row['key'] == 'street' and row['type'] == 'addr':
+                names[row['value']] += 1
+    return names
+
+
+def count_types(names):
+    """Fold {street name: count} into {street type: count}"""
+    types = Counter()
+    for name, count in names.items():
+        kind = street_type(name)
+        if kind:
+            types[kind] += count
+    return types
+
+
+# ================================================== #
+#               Blocking and Scoring                 #
+# ================================================== #
+def _bigrams(word):
+    word = word.lower()
+    return set(word[i:i + 2] for i in range(len(word) - 1)) or set([word])
+
+
+def _is_subsequence(short, long_):
+    it = iter(long_)
+    return all(c in it for c in short)
+
+
+class Vocabulary(object):
+    """Canonical street types, blocked by first letter and by bigram"""
+
+    def __init__(self, words):
+        self.words = set(words)
+        self.by_letter = defaultdict(set)
+        self.by_bigram = defaultdict(set)
+        for word in self.words:
+            self.by_letter[word[0].lower()].add(word)
+            for gram in _bigrams(word):
+                self.by_bigram[gram].add(word)
+
+    @classmethod
+    def from_types(cls, types, min_count=MIN_VOCABULARY_COUNT, base=STREET_TYPES,
+                   min_score=MIN_SCORE):
+        """USPS types plus frequent, capitalised data types that are not variants of them"""
+        vocabulary = cls(base)
+        extra = []
+        for kind, count in types.items():
+            if count >= min_count and len(kind) >= 4 and kind.isalpha() and kind.istitle():
+                if max([score(kind, w) for w in vocabulary.candidates(kind)] or [0]) < min_score:
+                    extra.append(kind)
+        return cls(vocabulary.words.union(extra)) if extra else vocabulary
+
+    def candidates(self, token):
+        """Vocabulary words sharing the first letter or a bigram with token"""
+        found = set(self.by_letter.get(token[0].lower(), ()))
+        for gram in _bigrams(token):
+            found |= self.by_bigram.get(gram, set())
+        return found
+
+
+def score(token, word):
+    """How likely token is a variant of the canonical word, 0..1"""
+    t, w = token.rstrip('.').lower(), word.lower()
+    if not t:
+        return 0.0
+    if t == w:
+        return 1.0 if token != word else 0.0
+    if t[0] == w[0] and len(t) < len(w) and _is_subsequence(t, w):
+        result = 0.5 + 0.3 * len(t) / len(w)
+        if t[-1] == w[-1]:
+            result += 0.2
+        return result
+    ratio = difflib.SequenceMatcher(None, t, w).ratio()
+    if ratio >= 0.8 and abs(len(t) - len(w)) <= 2:
+        return ratio
+    return 0.0
+
+
+def suggest(types, vocabulary, min_score=MIN_SCORE):
+    """Return [(type, suggestion, score, count)] for unexpected types, most frequent first"""
+    suggestions = []
+    for token, count in types.items():
+        if token in vocabulary.words:
+            continue
+        best, best_score = None, 0.0
+        for word in vocabulary.candidates(token):
+            s = score(token, word)
+            if s > best_score or (s == best_score and best is not None
+                                  and types.get(word, 0) > types.get(best, 0)):
+                best, best_score = word, s
+        if best is not None and best_score >= min_score:
+            suggestions.append((token, best, round(best_score, 3), count))
+    suggestions.sort(key=lambda s: (-s[3], s[0]))
+    return suggestions
+
+
+def check_mapping(mapping, vocabulary):
+    """Flag mapping entries whose key is a street type or whose target is not one"""
+    problems = []
+    for key, target in sorted(mapping.items()):
+        if key in vocabulary.words:
+            problems.append((key, target, 'key is already a street type'))
+        elif target not in vocabulary.words:
+            problems.append((key, target, 'target is not a known street type'))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--osm', help='read addr:street from an OSM file')
+    source.add_argument('--csv', nargs='+', help='read addr:street from tag csv files')
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE)
+    parser.add_argument('--min-count', type=int, default=MIN_VOCABULARY_COUNT,
+                        help='frequency at which a data type joins the vocabulary')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    names = names_from_osm(args.osm) if args.osm else names_from_csv(*args.csv)
+    types = count_types(names)
+    vocabulary = Vocabulary.from_types(types, args.min_count, min_score=args.min_score)
+    suggestions = suggest(types, vocabulary, args.min_score)
+    print('# {0} distinct street names, {1} distinct street types, {2:.2f}s'.format(
+        len(names), len(types), time.time() - start))
+    print('mapping = {')
+    for token, word, s, count in suggestions:
+        key = '"{0}":'.format(token)
+        print('    {0:<14} "{1}",  # {2} uses, score {3}'.format(key, word, count, s))
+    print('}')
+    for key, target, problem in check_mapping(cleaning.mapping, vocabulary):
+        print('# cleaning.mapping["{0}"] = "{1}": {2}'.format(key, target, problem))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+FTS5 full-text search over names, streets and other tag values.
+
+Finding a business or street by name used to be a LIKE '%...%' scan over
+every nodes_tags / ways_tags row. tag_search is an FTS5 table holding the
+values of SEARCH_KEYS (name, addr:street, addr:city, ... configurable) with
+the element type, id and full tag key alongside. The loader fills it with
+index_tags() from the same rows it inserts into the tag tables; build()
+does the same for a database that is already loaded.
+
+Street names are indexed in their cleaned form (cleaning.clean_street), and
+query words are expanded with the same abbreviation mappings, so "n 7th st",
+"North 7th Street" and "N. 7th St" all find the same street. Results are
+ranked with bm25; the last query word is treated as a prefix unless
+prefix=False, backed by FTS5 prefix indexes for 2 and 3 characters.
+
+    python -m osm_wrangling.tag_search build OpenStreetMap2.db
+    python -m osm_wrangling.tag_search search OpenStreetMap2.db "camelback rd" --keys addr:street
+"""
+from __future__ import print_function
+
+import argparse
+import re
+import sqlite3
+import time
+
+from .cleaning import clean_street, mapping, mapping2
+
+SEARCH_KEYS = ('name', 'addr:street', 'addr:city', 'brand', 'operator', 'alt_name', 'old_name')
+
+CREATE_TABLE = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS tag_search USING fts5(
+        value, key UNINDEXED, element UNINDEXED, id UNINDEXED,
+        prefix = '2 3', tokenize = 'unicode61 remove_diacritics 2')
+'''
+INSERT = 'INSERT INTO tag_search(value, key, element, id) VALUES (?, ?, ?, ?)'
+
+# query word (lower case, no trailing dot) -> the word clean_street writes instead
+_EXPANSIONS = {}
+for _abbreviation, _word in list(mapping.items()) + list(mapping2.items()):
+    _EXPANSIONS[_abbreviation.rstrip('.').lower()] = _word
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_CLEANERS = {'addr:street': clean_street}
+
+
+def create_table(conn):
+    conn.execute(CREATE_TABLE)
+
+
+def index_tags(conn, element, rows, keys=SEARCH_KEYS):
+    """Index the searchable ones among (id, key, value, type) tag rows of one element type"""
+    keys = frozenset(keys)
+
+    def searchable():
+        for element_id, key, value, kind in rows:
+            full_key = key if kind == 'regular' else kind + ':' + key
+            if full_key in keys:
+                clean = _CLEANERS.get(full_key)
+                yield (clean(value) if clean else value), full_key, element, element_id
+
+    conn.executemany(INSERT, searchable())
+
+
+def build(conn, keys=SEARCH_KEYS):
+    """(Re)build the index from the loaded nodes, ways and relations tag tables"""
+    conn.execute('DROP TABLE IF EXISTS tag_search')
+    create_table(conn)
+    for element, table in (('node', 'nodes_tags'), ('way', 'ways_tags'),
+                           ('relation', 'relations_tags')):
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+            continue  # loaded before relations were shaped
+        rows = conn.cursor().execute('SELECT id, key, value, type FROM {0}'.format(table))
+        index_tags(conn, element, rows, keys)
+    conn.execute("INSERT INTO tag_search(tag_search) VALUES ('optimize')")
+    conn.commit()
+
+
+def fts_query(text, prefix=True):
+    """Turn free text into an FTS5 query with abbreviation expansion"""
+    words = _WORD_RE.findall(text)
+    terms = []
+    for i, word in enumerate(words):
+        term = '"{0}"'.format(word)
+        if prefix and i == len(words) - 1:
+            term += '*'
+        expansion = _EXPANSIONS.get(word.lower())
+        if expansion and expansion.lower() != word.lower():
+            term = '({0} OR "{1}")'.format(term, expansion)
+        terms.append(term)
+    return ' AND '.join(terms)
+
+
+def search(conn, text, keys=None, prefix=True, limit=20):
+    """Return [(element, id, key, value)] matching text, best matches first"""
+    query = fts_query(text, prefix)
+    if not query:
+        return []
+    sql = 'SELECT element, id, key, value FROM tag_search WHERE tag_search MATCH ?'
+    params = [query]
+    if keys:
+        sql += ' AND key IN ({0})'.format(', '.join('?' * len(keys)))
+        params.extend(keys)
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    sub = parser.add_subparsers(dest='command')
+    build_cmd = sub.add_parser('build', help='build the index from the tag tables')
+    build_cmd.add_argument('sqlite_file')
+    build_cmd.add_argument('--keys', nargs='+', default=SEARCH_KEYS)
+    search_cmd = sub.add_parser('search', help='search the index')
+    search_cmd.add_argument('sqlite_file')
+    search_cmd.add_argument('text')
+    search_cmd.add_argument('--keys', nargs='+', help='only match these tag keys')
+    search_cmd.add_argument('--exact', action='store_true', help='no prefix match on the last word')
+    search_cmd.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.sqlite_file)
+    try:
+        start = time.time()
+        if args.command == 'build':
+            build(conn, args.keys)
+            count = conn.execute('SELECT COUNT(*) FROM tag_search').fetchone()[0]
+            print('Indexed {0} values in {1:.1f}s'.format(count, time.time() - start))
+        else:
+            for row in search(conn, args.text, args.keys, not args.exact, args.limit):
+                print('{0:<5} {1:>12}  {2:<12} {3}'.format(*row))
+            print('{0:.2f} ms'.format((time.time() - start) * 1000))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
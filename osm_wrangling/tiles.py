@@ -0,0 +1,278 @@
+"""
+Partition the process_map output by quadkey tile.
+
+TileWriter takes the place of the monolithic csv files: every node goes
+to the tile (at zoom `zoom`) it lies in, together with its tags, and every
+way - with its tags and node list - goes to the tile of its first node or of
+the centroid of its nodes. Each tile gets its own file set, and tiles.json
+records the zoom, and per tile its row counts, its bbox and the bbox of the
+nodes actually in it:
+
+    tiles/
+        tiles.json
+        023010213310/nodes.csv nodes_tags.csv ways.csv ways_nodes.csv ways_tags.csv ...
+        023010213311/...
+        _/...                   relations, and ways none of whose nodes are in the extract
+
+Regional jobs then read only the tiles that intersect their area:
+
+    with TileWriter('tiles', zoom=12) as writer:
+        process_map('phoenix_arizona.osm', False, writer=writer)
+    for row in iter_tiles('tiles', 'nodes', bbox=(33.4, -112.1, 33.5, -112.0)):
+        ...
+
+    python -m osm_wrangling shape phoenix_arizona.osm --out-dir tiles --tile-zoom 12
+    python -m osm_wrangling.tiles tiles --bbox 33.4,-112.1,33.5,-112.0
+"""
+from __future__ import division, print_function
+
+import argparse
+import array
+import bisect
+import json
+import math
+import os
+import shutil
+from collections import OrderedDict
+
+from . import osm_io
+from .shape import OUTPUTS, CsvWriters
+
+TILE_ZOOM = 12
+MAX_OPEN_TILES = 64  # tiles whose files stay open at once; one file handle per table each
+MIN_UNSORTED = 4096  # out of order node ids NodeLocations collects before merging them
+MANIFEST = 'tiles.json'
+NO_TILE = '_'
+WAY_TILE_MODES = ('first', 'centroid')
+MAX_LAT = 85.05112878  # where the web mercator tile grid ends
+
+# shaped element key -> table, e.g. 'node_tags' -> 'nodes_tags'
+TABLE_OF_KEY = dict((key, name[:-len('.csv')]) for name, _, key in OUTPUTS)
+TABLES = [name[:-len('.csv')] for name, _, _ in OUTPUTS]
+
+
+def quadkey(lat, lon, zoom=TILE_ZOOM):
+    """Quadkey of the zoom level `zoom` tile holding (lat, lon)"""
+    lat = min(max(lat, -MAX_LAT), MAX_LAT)
+    sin_lat = math.sin(math.radians(lat))
+    n = 1 << zoom
+    x = min(n - 1, max(0, int((lon + 180) / 360 * n)))
+    y = min(n - 1, max(0, int((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * n)))
+    digits = []
+    for bit in range(zoom - 1, -1, -1):
+        digits.append('0123'[((x >> bit) & 1) | (((y >> bit) & 1) << 1)])
+    return ''.join(digits)
+
+
+def tile_bbox(key):
+    """(minlat, minlon, maxlat, maxlon) of the tile with quadkey key"""
+    x = y = 0
+    for digit in key:
+        x = (x << 1) | (int(digit) & 1)
+        y = (y << 1) | (int(digit) >> 1)
+    n = 1 << len(key)
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180)
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class NodeLocations(object):
+    """node id -> (lat, lon) in three flat arrays, looked up by binary search
+
+    Extracts list their nodes by id, so the arrays stay sorted by just
+    appending. Ids that come out of order wait in a dict that is merged into
+    the arrays once it holds more than an eighth of them, which keeps an
+    unsorted file at O(n log n) however its adds and lookups interleave.
+    """
+
+    def __init__(self):
+        self.ids = osm_io.id_array()
+        self.lats = array.array('d')
+        self.lons = array.array('d')
+        self._unsorted = {}
+
+    def add(self, node_id, lat, lon):
+        if self.ids and node_id < self.ids[-1]:
+            self._unsorted[node_id] = (lat, lon)
+            if len(self._unsorted) > max(MIN_UNSORTED, len(self.ids) // 8):
+                self._merge()
+            return
+        self.ids.append(node_id)
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def _merge(self):
+        ids, lats, lons = osm_io.id_array(), array.array('d'), array.array('d')
+        start = 0
+        for node_id, (lat, lon) in sorted(self._unsorted.items()):
+            end = bisect.bisect_left(self.ids, node_id, start)
+            ids.extend(self.ids[start:end])
+            lats.extend(self.lats[start:end])
+            lons.extend(self.lons[start:end])
+            ids.append(node_id)
+            lats.append(lat)
+            lons.append(lon)
+            start = end
+        ids.extend(self.ids[start:])
+        lats.extend(self.lats[start:])
+        lons.extend(self.lons[start:])
+        self.ids, self.lats, self.lons = ids, lats, lons
+        self._unsorted = {}
+
+    def get(self, node_id):
+        """(lat, lon) of node_id, or None if it was never added"""
+        i = bisect.bisect_left(self.ids, node_id)
+        if i < len(self.ids) and self.ids[i] == node_id:
+            return self.lats[i], self.lons[i]
+        return self._unsorted.get(node_id)
+
+
+class TileWriter(object):
+    """Writes shape_element() dicts into one CsvWriters directory per quadkey tile"""
+
+    def __init__(self, root, zoom=TILE_ZOOM, way_tile='first', max_open=MAX_OPEN_TILES):
+        if not 1 <= zoom <= 23:
+            raise ValueError('zoom must be between 1 and 23, not {0}'.format(zoom))
+        if way_tile not in WAY_TILE_MODES:
+            raise ValueError('way_tile must be one of {0}'.format(WAY_TILE_MODES))
+        self.root = root
+        self.zoom = zoom
+        self.way_tile = way_tile
+        self.max_open = max_open
+        self.nodes = NodeLocations()
+        self.rows = {}
+        self.bounds = {}
+        self._open = OrderedDict()  # least recently written first
+        self._remove_old_tiles()
+
+    def _remove_old_tiles(self):
+        """Delete the tiles of an earlier run, so no stale tile is left next to the new ones"""
+        try:
+            old = read_manifest(self.root)
+        except (IOError, OSError, ValueError):
+            return
+        for tile in old['tiles']:
+            shutil.rmtree(os.path.join(self.root, tile), ignore_errors=True)
+
+    def _writers(self, tile):
+        writers = self._open.pop(tile, None)
+        if writers is None:
+            if len(self._open) >= self.max_open:
+                self._open.popitem(last=False)[1].close()
+            directory = os.path.join(self.root, tile)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            writers = CsvWriters(directory, 'a' if tile in self.rows else 'w')
+            self.rows.setdefault(tile, dict.fromkeys(TABLES, 0))
+        self._open[tile] = writers
+        return writers
+
+    def _way_tile(self, way_nodes):
+        locations = [self.nodes.get(int(nd['node_id'])) for nd in way_nodes]
+        locations = [loc for loc in locations if loc is not None]
+        if not locations:
+            return NO_TILE
+        if self.way_tile == 'first':
+            lat, lon = locations[0]
+        else:
+            lat = sum(loc[0] for loc in locations) / len(locations)
+            lon = sum(loc[1] for loc in locations) / len(locations)
+        return quadkey(lat, lon, self.zoom)
+
+    def write(self, el):
+        if 'node' in el:
+            node = el['node']
+            lat, lon = float(node['lat']), float(node['lon'])
+            self.nodes.add(int(node['id']), lat, lon)
+            tile = quadkey(lat, lon, self.zoom)
+            b = self.bounds.get(tile)
+            self.bounds[tile] = [lat, lon, lat, lon] if b is None else [
+                min(b[0], lat), min(b[1], lon), max(b[2], lat), max(b[3], lon)]
+        elif 'way' in el:
+            tile = self._way_tile(el['way_nodes'])
+        else:
+            tile = NO_TILE  # relations routinely span many tiles
+        self._writers(tile).write(el)
+        rows = self.rows[tile]
+        for key, value in el.items():
+            rows[TABLE_OF_KEY[key]] += len(value) if isinstance(value, list) else 1
+
+    def manifest(self):
+        tiles = {}
+        for tile, rows in self.rows.items():
+            tiles[tile] = {'rows': rows,
+                           'bbox': list(tile_bbox(tile)) if tile != NO_TILE else None,
+                           'data_bbox': self.bounds.get(tile)}
+        return {'zoom': self.zoom, 'way_tile': self.way_tile, 'tiles': tiles,
+                'rows': dict((table, sum(t['rows'][table] for t in tiles.values())) for table in TABLES)}
+
+    def close(self):
+        while self._open:
+            self._open.popitem()[1].close()
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        path = os.path.join(self.root, MANIFEST)
+        if os.path.exists(path):
+            os.remove(path)  # a new file: the stage cache may hold a hard link to the old one
+        with open(path, 'w') as f:
+            json.dump(self.manifest(), f, indent=1, sort_keys=True)
+
+    def paths(self):
+        """Every file written: the manifest and each tile's csv files"""
+        return [os.path.join(self.root, MANIFEST)] + [
+            os.path.join(self.root, tile, name) for tile in sorted(self.rows) for name, _, _ in OUTPUTS]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ================================================== #
+#               Reading Tiles                        #
+# ================================================== #
+def read_manifest(root):
+    with open(os.path.join(root, MANIFEST)) as f:
+        return json.load(f)
+
+
+def select_tiles(root, bbox=None):
+    """Tiles of root intersecting bbox (minlat, minlon, maxlat, maxlon); all tiles without one"""
+    tiles = read_manifest(root)['tiles']
+    if bbox is None:
+        return sorted(tiles)
+    return sorted(tile for tile, info in tiles.items()
+                  if info['bbox'] is not None and _intersects(info['bbox'], bbox))
+
+
+def iter_tiles(root, table, bbox=None):
+    """Yield the rows of table (e.g. 'nodes') from the tiles intersecting bbox"""
+    for tile in select_tiles(root, bbox):
+        for row in osm_io.iter_csv(os.path.join(root, tile, table + '.csv')):
+            yield row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('root', help='directory holding tiles.json')
+    parser.add_argument('--bbox', help='minlat,minlon,maxlat,maxlon (default: every tile)')
+    args = parser.parse_args(argv)
+
+    bbox = [float(v) for v in args.bbox.split(',')] if args.bbox else None
+    tiles = read_manifest(args.root)['tiles']
+    widths = [max(10, len(t)) for t in TABLES]
+    print('{0:<24} {1}'.format('tile', ' '.join('{0:>{1}}'.format(t, w) for t, w in zip(TABLES, widths))))
+    for tile in select_tiles(args.root, bbox):
+        print('{0:<24} {1}'.format(tile, ' '.join('{0:>{1}}'.format(tiles[tile]['rows'].get(t, 0), w)
+                                                  for t, w in zip(TABLES, widths))))
+
+
+if __name__ == '__main__':
+    main()
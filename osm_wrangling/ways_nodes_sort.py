@@ -0,0 +1,253 @@
+"""
+External merge sort of ways_nodes.csv by node_id.
+
+process_map writes ways_nodes in way order, but "which ways use this node"
+and node -> way joins want it in node order, and tens of millions of rows
+do not sort in python memory. The sort therefore runs in two phases:
+
+  1. read as many rows as fit the memory budget into compact integer arrays,
+     sort them by (node_id, way id, position) and spill them to a temporary
+     run file;
+  2. k-way merge the runs with a heap (in several passes when there are more
+     runs than MAX_FAN_IN open files), writing ways_nodes_by_node.csv and,
+     optionally, a node -> ways index.
+
+The index holds the distinct node ids, offsets and the way ids in CSR form
+and is memory-mapped by NodeWays.load:
+
+    python -m osm_wrangling.ways_nodes_sort ways_nodes.csv ways_nodes_by_node.csv --index node_ways.idx --memory 256
+
+    ways = NodeWays.load('node_ways.idx')
+    ways.ways_of(2184736420)
+"""
+from __future__ import division, print_function
+
+import argparse
+import array
+import bisect
+import csv
+import heapq
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+from . import osm_io
+
+# array storage and the spill buffer (2 x 3 x 8 bytes) plus the order and
+# key lists the sort builds
+BYTES_PER_ROW = 112
+BLOCK_ROWS = 1 << 14
+MAX_FAN_IN = 64
+FIELDS = ['id', 'node_id', 'position']
+
+_MAGIC = b'NWIX'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHQQ')  # magic, version, nodes, rows
+
+
+# ================================================== #
+#               Runs                                 #
+# ================================================== #
+def _write_run(rows, tmpdir):
+    """Sort (way, node, position) rows by node and spill them; return the path"""
+    ways, nodes, positions = rows
+    order = list(range(len(nodes)))
+    # process_map output is already in (way, position) order, so one stable
+    # sort on the node id is enough; anything else is put in that order first
+    if any((ways[i], positions[i]) >= (ways[i + 1], positions[i + 1]) for i in range(len(ways) - 1)):
+        order.sort(key=lambda i: (ways[i], positions[i]))
+    order.sort(key=nodes.__getitem__)
+    out = osm_io.id_array()
+    for i in order:
+        out.append(nodes[i])
+        out.append(ways[i])
+        out.append(positions[i])
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+    with os.fdopen(fd, 'wb') as f:
+        out.tofile(f)
+    return path
+
+
+def make_runs(ways_nodes_path, run_rows, tmpdir):
+    """Phase 1: return ([run paths], rows read)"""
+    runs, total = [], 0
+    rows = osm_io.id_array(), osm_io.id_array(), array.array('I')
+    for row in osm_io.iter_csv(ways_nodes_path):
+        rows[0].append(int(row['id']))
+        rows[1].append(int(row['node_id']))
+        rows[2].append(int(row['position']))
+        if len(rows[0]) == run_rows:
+            runs.append(_write_run(rows, tmpdir))
+            total += run_rows
+            rows = osm_io.id_array(), osm_io.id_array(), array.array('I')
+    if rows[0]:
+        runs.append(_write_run(rows, tmpdir))
+        total += len(rows[0])
+    return runs, total
+
+
+def _read_run(path, block_rows=BLOCK_ROWS):
+    """Yield the (node, way, position) rows of a run file a block at a time"""
+    with open(path, 'rb') as f:
+        while True:
+            block = osm_io.id_array()
+            try:
+                block.fromfile(f, 3 * block_rows)
+            except EOFError:  # short last block; what was read is kept
+                pass
+            for i in range(0, len(block), 3):
+                yield block[i], block[i + 1], block[i + 2]
+            if len(block) < 3 * block_rows:
+                return
+
+
+def _merge_to_run(paths, tmpdir):
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+    with os.fdopen(fd, 'wb') as f:
+        out = osm_io.id_array()
+        for row in heapq.merge(*[_read_run(p) for p in paths]):
+            out.extend(row)
+            if len(out) >= 3 * BLOCK_ROWS:
+                out.tofile(f)
+                out = osm_io.id_array()
+        out.tofile(f)
+    for p in paths:
+        os.remove(p)
+    return path
+
+
+def merge_runs(runs, tmpdir, fan_in=MAX_FAN_IN):
+    """Phase 2: iterate over all rows in (node, way, position) order"""
+    while len(runs) > fan_in:
+        runs = [_merge_to_run(runs[i:i + fan_in], tmpdir) for i in range(0, len(runs), fan_in)]
+    return heapq.merge(*[_read_run(p) for p in runs])
+
+
+# ================================================== #
+#               Node -> Ways Index                   #
+# ================================================== #
+class _IndexWriter(object):
+    """Stream the sorted rows into the three index sections, then join them"""
+
+    def __init__(self, path, tmpdir):
+        self.path = path
+        self.files = [tempfile.TemporaryFile(dir=tmpdir) for _ in range(3)]
+        self.buffers = [osm_io.id_array(), osm_io.id_array(), osm_io.id_array()]
+        self.last = None
+        self.nodes = 0
+        self.rows = 0
+
+    def _flush(self, force=False):
+        for buf, f in zip(self.buffers, self.files):
+            if force or len(buf) >= BLOCK_ROWS:
+                buf.tofile(f)
+                del buf[:]
+
+    def add(self, node_id, way_id):
+        node_ids, offsets, way_ids = self.buffers
+        if node_id != self.last:
+            node_ids.append(node_id)
+            offsets.append(self.rows)
+            self.last = node_id
+            self.nodes += 1
+        way_ids.append(way_id)
+        self.rows += 1
+        self._flush()
+
+    def close(self):
+        self.buffers[1].append(self.rows)
+        self._flush(force=True)
+        with open(self.path, 'wb') as out:
+            out.write(_HEADER.pack(_MAGIC, _VERSION, self.nodes, self.rows))
+            out.write(b'\0' * (-_HEADER.size % 8))
+            for f in self.files:
+                f.seek(0)
+                shutil.copyfileobj(f, out)
+                f.close()
+
+
+class NodeWays(object):
+    """Memory-mapped node -> ways index written by external_sort"""
+
+    def __init__(self, node_ids, offsets, way_ids, owner=None):
+        self.node_ids = node_ids
+        self.offsets = offsets
+        self.way_ids = way_ids
+        self._owner = owner
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, version, nodes, rows = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("{0} is not a node -> ways index".format(path))
+            layout = [(osm_io.ID_TYPECODE, nodes), (osm_io.ID_TYPECODE, nodes + 1),
+                      (osm_io.ID_TYPECODE, rows)]
+            sections, data = osm_io.read_arrays(f, _HEADER.size + (-_HEADER.size % 8), layout)
+        return cls(*sections, owner=data)
+
+    def ways_of(self, node_id):
+        """Ids of the ways that use node_id, once per use, in way order"""
+        i = bisect.bisect_left(self.node_ids, node_id)
+        if i == len(self.node_ids) or self.node_ids[i] != node_id:
+            return []
+        return list(self.way_ids[self.offsets[i]:self.offsets[i + 1]])
+
+
+# ================================================== #
+#               Driver                               #
+# ================================================== #
+def external_sort(ways_nodes_path, out_path, memory_mb=256, index_path=None,
+                  tmpdir=None, fan_in=MAX_FAN_IN):
+    """Write ways_nodes sorted by node_id (and the node -> ways index); return stats"""
+    run_rows = max(BLOCK_ROWS, memory_mb * (1 << 20) // BYTES_PER_ROW)
+    workdir = tempfile.mkdtemp(prefix='ways_nodes_sort', dir=tmpdir)
+    stats = {'run_rows': run_rows}
+    try:
+        start = time.time()
+        runs, rows = make_runs(ways_nodes_path, run_rows, workdir)
+        stats.update(rows=rows, runs=len(runs), run_seconds=time.time() - start)
+
+        start = time.time()
+        index = _IndexWriter(index_path, workdir) if index_path else None
+        with osm_io.open_csv(out_path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+            for node_id, way_id, position in merge_runs(runs, workdir, fan_in):
+                writer.writerow((way_id, node_id, position))
+                if index is not None:
+                    index.add(node_id, way_id)
+        if index is not None:
+            index.close()
+            stats['nodes'] = index.nodes
+        stats['merge_seconds'] = time.time() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('ways_nodes', nargs='?', default='ways_nodes.csv')
+    parser.add_argument('out', nargs='?', default='ways_nodes_by_node.csv')
+    parser.add_argument('--index', help='also write a node -> ways index to this file')
+    parser.add_argument('--memory', type=int, default=256, help='memory budget in MB')
+    parser.add_argument('--tmpdir', help='directory for the run files')
+    args = parser.parse_args(argv)
+
+    stats = external_sort(args.ways_nodes, args.out, args.memory, args.index, args.tmpdir)
+    total = stats['run_seconds'] + stats['merge_seconds']
+    print('{rows} rows in {runs} runs of up to {run_rows} rows'.format(**stats))
+    print('runs:  {0:.1f}s ({1:,.0f} rows/s)'.format(
+        stats['run_seconds'], stats['rows'] / max(stats['run_seconds'], 1e-9)))
+    print('merge: {0:.1f}s ({1:,.0f} rows/s)'.format(
+        stats['merge_seconds'], stats['rows'] / max(stats['merge_seconds'], 1e-9)))
+    print('total: {0:.1f}s ({1:,.0f} rows/s)'.format(total, stats['rows'] / max(total, 1e-9)))
+    if 'nodes' in stats:
+        print('index: {0} distinct nodes -> {1}'.format(stats['nodes'], args.index))
+
+
+if __name__ == '__main__':
+    main()